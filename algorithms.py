@@ -1,5 +1,5 @@
 import numpy as np
-from scipy.signal import find_peaks as scipy_find_peaks, peak_widths
+from profiling import stage
 
 
 def compute_baseline(signal):
@@ -8,52 +8,318 @@ def compute_baseline(signal):
     return np.median(trimmed)
 
 
-def find_peaks(x: np.ndarray,
-               baseline: float = None,
-               section_sd: float = None,
-               section_mean: float = None,
-               signal_total_sd: float = None,
-               distance: int = 15000,
-               prominence: float = 30,
-               local_dist: int = 20000) -> tuple[np.ndarray, np.ndarray]:
-
-    try:
-        peaks, properties = scipy_find_peaks(
-            x,
-            height=baseline + signal_total_sd,
-            distance=distance,
-            prominence=prominence
-        )
-
-        peak_heights = properties.get("peak_heights", x[peaks])
-        peak_widths = properties.get("peak_widths", x[peaks])
-
-        tumor_peaks = []
-        water_peaks = []
-        total_peak_size = 0
-
-        for i, peak_index in enumerate(peaks):
-            peak_height = peak_heights[i]
-            peak_width = peak_widths[i]
-            peak_size = peak_height * peak_width * 0.5
-
-            start = max(0, peak_index - local_dist)
-            end = min(len(x), peak_index + local_dist)
-            local_area = x[start:end]
-
-            local_min = min(local_area)
-
-            if (local_min < baseline - 2*signal_total_sd) and (peak_height < baseline + 9*signal_total_sd):
-                water_peaks.append(peak_index)
-            else:
-                tumor_peaks.append(peak_index)
-                total_peak_size += peak_size
-
-        return np.array(tumor_peaks), np.array(water_peaks)
-
-    except Exception as e:
-        print("Error finding peaks:", e)
-        return np.array([]), np.array([])
+BASELINE_ENGINES = ("percentile", "histogram", "rolling")
+INT16_OFFSET = 32768
+INT16_BINS = 65536
+
+
+def int16_histogram(signal) -> np.ndarray:
+    values = np.asarray(signal)
+    return np.bincount(values.view(np.uint16) ^ np.uint16(INT16_OFFSET), minlength=INT16_BINS)
+
+
+def _order_statistic(cumulative: np.ndarray, k: int) -> int:
+    return int(np.searchsorted(cumulative, k, side="right")) - INT16_OFFSET
+
+
+def _histogram_percentile(cumulative: np.ndarray, n: int, q: float) -> float:
+    # same virtual index and lerp as np.percentile(method="linear")
+    virtual_index = (n - 1) * (q / 100)
+    if virtual_index >= n - 1:
+        return float(_order_statistic(cumulative, n - 1))
+
+    previous_index = int(np.floor(virtual_index))
+    gamma = virtual_index - previous_index
+    previous = _order_statistic(cumulative, previous_index)
+    following = _order_statistic(cumulative, previous_index + 1)
+    # numpy subtracts in the input dtype, so wrap like int16
+    diff = (following - previous + INT16_OFFSET) % INT16_BINS - INT16_OFFSET
+
+    if gamma >= 0.5:
+        return following - diff * (1 - gamma)
+    return previous + diff * gamma
+
+
+def baseline_from_histogram(counts: np.ndarray) -> np.float64:
+    cumulative = np.cumsum(counts)
+    n = int(cumulative[-1])
+    if n == 0:
+        return np.float64(np.nan)
+
+    lower = _histogram_percentile(cumulative, n, 5)
+    upper = _histogram_percentile(cumulative, n, 95)
+
+    first_bin = max(int(np.ceil(lower)) + INT16_OFFSET, 0)
+    last_bin = min(int(np.floor(upper)) + INT16_OFFSET, INT16_BINS - 1)
+    if last_bin < first_bin:
+        return np.float64(np.nan)
+
+    below = int(cumulative[first_bin - 1]) if first_bin > 0 else 0
+    trimmed_count = int(cumulative[last_bin]) - below
+    if trimmed_count == 0:
+        return np.float64(np.nan)
+
+    half = trimmed_count // 2
+    if trimmed_count % 2:
+        return np.float64(_order_statistic(cumulative, below + half))
+    return np.float64((_order_statistic(cumulative, below + half - 1) + _order_statistic(cumulative, below + half)) / 2)
+
+
+def compute_baseline_histogram(signal) -> np.float64:
+    return baseline_from_histogram(int16_histogram(signal))
+
+
+def compute_section_baseline(section, engine: str = "histogram"):
+    if engine != "percentile" and section.dtype == np.int16:
+        return compute_baseline_histogram(section)
+    return compute_baseline(section)
+
+
+def rolling_baseline(signal, window: int, step: int, start: int = 0, end: int = None) -> tuple[np.ndarray, np.ndarray]:
+    signal_length = len(signal)
+    if end is None:
+        end = signal_length
+
+    half = window // 2
+    breakpoints = np.arange(start // step * step, end, step, dtype=np.int64)
+    values = np.empty(len(breakpoints), dtype=float)
+
+    counts = None
+    low = high = 0
+    for i, piece_start in enumerate(breakpoints):
+        center = int(piece_start) + step // 2
+        new_low = max(0, center - half)
+        new_high = min(signal_length, center + half)
+
+        if counts is None or new_low >= high:
+            counts = int16_histogram(signal[new_low:new_high])
+        else:
+            if new_low > low:
+                counts -= int16_histogram(signal[low:new_low])
+            if new_high > high:
+                counts += int16_histogram(signal[high:new_high])
+        low, high = new_low, new_high
+
+        values[i] = baseline_from_histogram(counts)
+
+    return breakpoints, values
+
+
+def sliding_min(x: np.ndarray, radius: int) -> np.ndarray:
+    from scipy.ndimage import minimum_filter1d
+
+    # window [i - radius, i + radius), clipped at the edges
+    return minimum_filter1d(x, size=2 * radius, mode="nearest")
+
+
+def sliding_min_at(x: np.ndarray, radius: int, indices: np.ndarray, block: int = 256) -> np.ndarray:
+    # sliding_min(x, radius)[indices] without filtering all of x: block minima cover the middle of each window
+    indices = np.asarray(indices, dtype=np.int64)
+    n = len(x)
+    if 2 * block * len(indices) >= n:
+        return sliding_min(x, radius)[indices]
+
+    lo = np.maximum(indices - radius, 0)
+    hi = np.minimum(indices + radius, n)
+    result = np.full(len(indices), np.inf)
+
+    first = -(-lo // block)
+    last = hi // block
+    whole = np.flatnonzero(first < last)
+    if len(whole):
+        result[whole] = _range_min(np.minimum.reduceat(x, np.arange(0, n, block)), first[whole], last[whole] - 1)
+
+    offsets = np.arange(block)
+    for edge_start, edge_end in ((lo, np.minimum(first * block, hi)), (np.maximum(last * block, lo), hi)):
+        edge = edge_start[:, None] + offsets
+        values = np.where(edge < edge_end[:, None], x[np.minimum(edge, n - 1)], np.inf)
+        result = np.minimum(result, values.min(axis=1))
+    return result
+
+
+def _range_min(values: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    # inclusive ranges, through a sparse table of minima over power-of-two spans
+    table = [values]
+    while 2 ** len(table) <= len(values):
+        half = 2 ** (len(table) - 1)
+        table.append(np.minimum(table[-1][:-half], table[-1][half:]))
+
+    levels = np.frexp(hi - lo + 1)[1] - 1
+    result = np.empty(len(lo), dtype=values.dtype)
+    for level in np.unique(levels):
+        selected = levels == level
+        result[selected] = np.minimum(table[level][lo[selected]], table[level][hi[selected] - 2 ** level + 1])
+    return result
+
+
+CANDIDATE_DTYPE = np.dtype([
+    ("index", np.int64),
+    ("height", np.float64),
+    ("baseline", np.float64),
+    ("prominence", np.float64),
+    ("local_min", np.float64),
+    ("sd", np.float64),
+])
+
+
+def _greater_chain_min(heights: np.ndarray, gaps_before: np.ndarray) -> np.ndarray:
+    # Minimum of the gaps between each peak and its nearest strictly higher predecessor (or the start), found by
+    # pointer jumping: every round a peak skips to its predecessor's predecessor, folding in that stretch's minimum.
+    nearest = np.arange(-1, len(heights) - 1)
+    chain_min = np.array(gaps_before, dtype=np.float64)
+    active = np.flatnonzero(nearest >= 0)
+    while len(active):
+        jump = nearest[active]
+        lower = heights[jump] <= heights[active]
+        active, jump = active[lower], jump[lower]
+        chain_min[active] = np.minimum(chain_min[active], chain_min[jump])
+        nearest[active] = nearest[jump]
+        active = active[nearest[active] >= 0]
+    return chain_min
+
+
+def gap_prominences(heights: np.ndarray, gap_min: np.ndarray) -> np.ndarray:
+    # gap_min[i] is the minimum of x between peaks i - 1 and i, from the start before the first and to the end after the last
+    heights = np.asarray(heights, dtype=np.float64)
+    left_min = np.minimum(_greater_chain_min(heights, gap_min[:-1]), heights)
+    right_min = _greater_chain_min(heights[::-1], gap_min[:0:-1])[::-1]
+    return heights - np.maximum(left_min, right_min)
+
+
+def peak_prominences(x: np.ndarray, peaks: np.ndarray) -> np.ndarray:
+    # Same as scipy's peak_prominences with wlen=None, provided peaks holds every local maximum at least as high as
+    # the lowest of them: the scan from a peak then always stops inside the hill of its nearest higher peak.
+    return gap_prominences(x[peaks], np.minimum.reduceat(x, np.concatenate(([0], peaks))))
+
+
+def find_peak_candidates(x: np.ndarray,
+                         baseline=None,
+                         signal_total_sd: float = None,
+                         min_height_sd: float = 1.0,
+                         local_dist: int = 20000,
+                         profile=None) -> np.ndarray:
+    from scipy.signal import find_peaks as scipy_find_peaks
+
+    x = np.asarray(x, dtype=np.float64)
+    min_height = baseline + min_height_sd * signal_total_sd
+
+    with stage(profile, "scipy_peaks"):
+        # one scalar floor for the prominence structure, the per-sample threshold is applied after
+        peaks, _ = scipy_find_peaks(x, height=float(np.min(min_height)))
+
+    candidates = np.zeros(len(peaks), dtype=CANDIDATE_DTYPE)
+    if len(peaks) == 0:
+        return candidates
+
+    with stage(profile, "peak_features"):
+        candidates["index"] = peaks
+        candidates["height"] = x[peaks]
+        candidates["baseline"] = np.asarray(baseline)[peaks] if np.ndim(baseline) else baseline
+        candidates["prominence"] = peak_prominences(x, peaks)
+        candidates["local_min"] = sliding_min_at(x, local_dist, peaks)
+        candidates["sd"] = signal_total_sd
+
+    if np.ndim(min_height):
+        candidates = candidates[np.asarray(min_height)[peaks] <= candidates["height"]]
+    return candidates
+
+
+def select_by_distance(positions: np.ndarray, heights: np.ndarray, distance: float) -> np.ndarray:
+    # find_peaks' distance rule on sorted positions: highest first, each kept peak drops its neighbours closer than
+    # distance; the same argsort makes equal heights resolve the same way. Decided in rounds instead of one peak at a
+    # time: a peak that outranks every undecided peak within distance is kept, since any higher one there was dropped
+    distance = int(np.ceil(distance))
+    positions = np.asarray(positions, dtype=np.int64)
+    ranks = np.empty(len(positions), dtype=np.int64)
+    ranks[np.argsort(heights)] = np.arange(len(positions))
+
+    keep = np.zeros(len(positions), dtype=bool)
+    undecided = np.arange(len(positions))
+    while len(undecided):
+        near = positions[undecided]
+        lo = np.searchsorted(near, near - distance, side="right")
+        hi = np.searchsorted(near, near + distance, side="left") - 1
+        top = -_range_min(-ranks[undecided], lo, hi) == ranks[undecided]
+        keep[undecided[top]] = True
+
+        # everything within distance of a kept peak is dropped, the kept peaks included as they are decided
+        covered = np.cumsum(np.bincount(lo[top], minlength=len(near) + 1)
+                            - np.bincount(hi[top] + 1, minlength=len(near) + 1))[:-1]
+        undecided = undecided[covered == 0]
+    return keep
+
+
+def spaced_peaks(candidates: np.ndarray, height_sd: float = 1.0, distance: int = 15000) -> np.ndarray:
+    # the order of find_peaks: height, then distance among the survivors; prominence is left to split_peaks
+    peaks = candidates[candidates["baseline"] + height_sd * candidates["sd"] <= candidates["height"]]
+    if distance is not None and len(peaks):
+        peaks = peaks[select_by_distance(peaks["index"], peaks["height"], distance)]
+    return peaks
+
+
+def split_peaks(peaks: np.ndarray,
+                prominence: float = 30,
+                water_dip_sd: float = 2,
+                water_height_sd: float = 9) -> tuple[np.ndarray, np.ndarray]:
+    peaks = peaks[prominence <= peaks["prominence"]]
+    is_water = ((peaks["local_min"] < peaks["baseline"] - water_dip_sd * peaks["sd"])
+                & (peaks["height"] < peaks["baseline"] + water_height_sd * peaks["sd"]))
+    return peaks["index"][~is_water], peaks["index"][is_water]
+
+
+def select_peaks(candidates: np.ndarray,
+                 height_sd: float = 1.0,
+                 distance: int = 15000,
+                 prominence: float = 30,
+                 water_dip_sd: float = 2,
+                 water_height_sd: float = 9,
+                 profile=None) -> tuple[np.ndarray, np.ndarray]:
+    with stage(profile, "classification"):
+        return split_peaks(spaced_peaks(candidates, height_sd, distance), prominence, water_dip_sd, water_height_sd)
+
+
+PEAK_TUMOR = 0
+PEAK_WATER = 1
+
+PEAK_FEATURES_DTYPE = np.dtype([
+    ("index", np.int64),
+    ("height", np.float64),
+    ("width", np.float64),
+    ("prominence", np.float64),
+    ("local_min", np.float64),
+    ("class", np.int8),
+])
+
+
+def window_prominences(x: np.ndarray, peaks: np.ndarray, reach: int) -> np.ndarray:
+    from scipy.signal import peak_prominences as scipy_peak_prominences
+
+    return scipy_peak_prominences(x, peaks, wlen=2 * reach + 1)[0]
+
+
+def half_prominence_bounds(x: np.ndarray, peaks: np.ndarray, prominence: np.ndarray,
+                           reach: int) -> tuple[np.ndarray, np.ndarray]:
+    from scipy.signal import peak_widths
+
+    # where each peak crosses half its prominence, searched at most reach samples out on either side
+    left_bases = np.maximum(peaks - reach, 0)
+    right_bases = np.minimum(peaks + reach, len(x) - 1)
+    _, _, left_ips, right_ips = peak_widths(x, peaks, rel_height=0.5, prominence_data=(prominence, left_bases, right_bases))
+    return left_ips, right_ips
+
+
+def peak_features(x: np.ndarray, peaks: np.ndarray, classes: np.ndarray, prominence: np.ndarray, local_min: np.ndarray,
+                  reach: int) -> np.ndarray:
+    # peaks are positions in x; widths in samples at half prominence
+    left_ips, right_ips = half_prominence_bounds(x, peaks, prominence, reach)
+    features = np.zeros(len(peaks), dtype=PEAK_FEATURES_DTYPE)
+    features["index"] = peaks
+    features["height"] = x[peaks]
+    features["width"] = right_ips - left_ips
+    features["prominence"] = prominence
+    features["local_min"] = local_min
+    features["class"] = classes
+    return features
 
 
 def minmax_downsample(x: np.ndarray,
@@ -0,0 +1,64 @@
+import numpy as np
+
+
+class PiecewiseBaseline:
+    def __init__(self, breakpoints, values, length: int):
+        self.breakpoints = np.asarray(breakpoints, dtype=np.int64)
+        self.values = np.asarray(values, dtype=float)
+        self.length = length
+        self.dtype = self.values.dtype
+        self._breakpoint_buffer = self.breakpoints
+        self._value_buffer = self.values
+
+    @classmethod
+    def from_sections(cls, values, length: int, section_size: int):
+        return cls(np.arange(0, length, section_size), values, length)
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def shape(self):
+        return (self.length,)
+
+    @property
+    def nbytes(self):
+        return self.breakpoints.nbytes + self.values.nbytes
+
+    def append(self, breakpoints, values, length: int):
+        # spare capacity doubles when it runs out, so a streamed baseline is not copied whole on every update;
+        # breakpoints and values stay views of the filled part
+        size = len(self.breakpoints)
+        new_size = size + len(breakpoints)
+        if new_size > len(self._breakpoint_buffer):
+            capacity = max(2 * len(self._breakpoint_buffer), new_size)
+            self._breakpoint_buffer = np.concatenate((self.breakpoints, np.empty(capacity - size, dtype=np.int64)))
+            self._value_buffer = np.concatenate((self.values, np.empty(capacity - size, dtype=self.dtype)))
+        self._breakpoint_buffer[size:new_size] = breakpoints
+        self._value_buffer[size:new_size] = values
+        self.breakpoints = self._breakpoint_buffer[:new_size]
+        self.values = self._value_buffer[:new_size]
+        self.length = length
+
+    def value_at(self, indices):
+        pieces = np.searchsorted(self.breakpoints, indices, side="right") - 1
+        return self.values[pieces]
+
+    def expand(self, start: int = 0, end: int = None) -> np.ndarray:
+        start = max(0, start)
+        end = self.length if end is None else min(end, self.length)
+        if end <= start:
+            return np.array([], dtype=self.dtype)
+
+        first = np.searchsorted(self.breakpoints, start, side="right") - 1
+        last = np.searchsorted(self.breakpoints, end, side="left")
+        bounds = np.append(np.maximum(self.breakpoints[first:last], start), end)
+        return np.repeat(self.values[first:last], np.diff(bounds))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, end, step = key.indices(self.length)
+            if step == 1:
+                return self.expand(start, end)
+            return self.value_at(np.arange(start, end, step))
+        return self.value_at(key)
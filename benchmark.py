@@ -0,0 +1,401 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from formatters import format_size, format_time
+
+SIZES = [1_000_000, 10_000_000, 100_000_000, 500_000_000]
+BENCHMARKS = ("compute_baseline", "find_peaks", "process_signal", "whole_signal", "minmax_downsample", "csv_to_bin",
+              "export_peaks", "coincidence")
+CSV_MAX_SAMPLES = 10_000_000
+WHOLE_EXACT_MAX_SAMPLES = 20_000_000
+EXPORT_MAX_PEAKS = 1_000_000
+COINCIDENCE_MAX_PEAKS = 5_000_000
+MATCH_TOLERANCE = 500
+WARMUP_SAMPLES = 500_000
+
+
+def peak_rss_bytes() -> int:
+    # resource is Unix only; psutil reports the peak working set on Windows. None when neither is available.
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss)
+
+
+def record(benchmark: str, variant: str, samples: int, seconds: float, **extra) -> dict:
+    return {
+        "benchmark": benchmark,
+        "variant": variant,
+        "samples": samples,
+        "seconds": seconds,
+        "samples_per_second": samples / seconds if seconds > 0 else 0.0,
+        **extra,
+    }
+
+
+def section_starts(length: int, section_size: int):
+    return range(0, length, section_size)
+
+
+def bench_compute_baseline(path: str) -> list[dict]:
+    from algorithms import compute_baseline, compute_baseline_histogram
+    from detection import SECTION_SIZE
+    from signal_source import SignalSource
+
+    signal = SignalSource.from_bin(path).channel(0)
+    results = []
+    for variant, function in (("percentile", compute_baseline), ("histogram", compute_baseline_histogram)):
+        started = time.perf_counter()
+        for start in section_starts(len(signal), SECTION_SIZE):
+            function(signal[start:start + SECTION_SIZE])
+        results.append(record("compute_baseline", variant, len(signal), time.perf_counter() - started))
+    return results
+
+
+def bench_find_peaks(path: str) -> list[dict]:
+    from algorithms import compute_baseline_histogram
+    from detection import EXTEND, SECTION_SIZE, _section_peaks, signal_sd
+    from signal_source import SignalSource
+
+    signal = SignalSource.from_bin(path).channel(0)
+    total_signal_sd = signal_sd(signal)
+    elapsed = 0.0
+    for start in section_starts(len(signal), SECTION_SIZE):
+        section_bl = compute_baseline_histogram(signal[start:start + SECTION_SIZE])
+        start_extended = max(0, start - EXTEND)
+        extended_section = np.asarray(signal[start_extended:start + SECTION_SIZE + EXTEND])
+        started = time.perf_counter()
+        _section_peaks(extended_section, start, start + SECTION_SIZE, start_extended, section_bl, total_signal_sd)
+        elapsed += time.perf_counter() - started
+    return [record("find_peaks", "sectioned", len(signal), elapsed)]
+
+
+def detection_accuracy(results: list, truth: list) -> dict:
+    from synthetic import match_events
+
+    accuracy = {}
+    for channel, (tumor_peaks, water_peaks, _) in enumerate(results):
+        accuracy[f"channel_{channel}"] = {
+            "tumor": match_events(tumor_peaks, truth[channel]["tumor"], MATCH_TOLERANCE),
+            "water": match_events(water_peaks, truth[channel]["water"], MATCH_TOLERANCE),
+        }
+    return accuracy
+
+
+def bench_process_signal(path: str) -> list[dict]:
+    from detection import process_file_parallel, process_frames
+    from signal_source import SignalSource
+    from synthetic import load_truth
+
+    source = SignalSource.from_bin(path)
+    truth = load_truth(path)["truth"]
+    samples = len(source) * source.n_channels
+    results = []
+
+    for engine in ("percentile", "histogram", "rolling"):
+        started = time.perf_counter()
+        detected = process_frames(source.frames, baseline_engine=engine)
+        results.append(record("process_signal", f"serial-{engine}", samples, time.perf_counter() - started,
+                              accuracy=detection_accuracy(detected, truth)))
+
+    n_workers = os.cpu_count() or 1
+    if n_workers > 1:
+        started = time.perf_counter()
+        detected = process_file_parallel(path, n_workers=n_workers)
+        results.append(record("process_signal", f"parallel-{n_workers}", samples, time.perf_counter() - started,
+                              accuracy=detection_accuracy(detected, truth)))
+
+    return results
+
+
+def whole_signal_reference(signal, baseline, signal_total_sd: float) -> tuple[np.ndarray, np.ndarray]:
+    from scipy.signal import find_peaks
+    from algorithms import sliding_min
+    from detection import DISTANCE, LOCAL_DIST, PROMINENCE, WATER_DIP_SD, WATER_HEIGHT_SD
+
+    # the definition the chunked engine must reproduce: one find_peaks call over the whole channel in memory
+    x = np.asarray(signal, dtype=np.float64)
+    threshold = baseline[:]
+    peaks, _ = find_peaks(x, height=threshold + signal_total_sd, distance=DISTANCE, prominence=PROMINENCE)
+    is_water = ((sliding_min(x, LOCAL_DIST)[peaks] < threshold[peaks] - WATER_DIP_SD * signal_total_sd)
+                & (x[peaks] < threshold[peaks] + WATER_HEIGHT_SD * signal_total_sd))
+    return peaks[~is_water], peaks[is_water]
+
+
+def bench_whole_signal(path: str) -> list[dict]:
+    from detection import process_frames
+    from signal_source import SignalSource
+    from signal_stats import frame_stats
+    from synthetic import load_truth, match_events
+    from whole_signal import process_frames_whole
+
+    source = SignalSource.from_bin(path)
+    truth = load_truth(path)["truth"]
+    samples = len(source) * source.n_channels
+
+    started = time.perf_counter()
+    sectioned = process_frames(source.frames, baseline_engine="rolling")
+    sectioned_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    whole = process_frames_whole(source.frames)
+    whole_seconds = time.perf_counter() - started
+
+    agreement = {}
+    for channel, ((tumor_peaks, water_peaks, _), (sectioned_tumor, sectioned_water, _)) in enumerate(zip(whole, sectioned)):
+        agreement[f"channel_{channel}"] = {
+            "tumor": match_events(tumor_peaks, sectioned_tumor, MATCH_TOLERANCE),
+            "water": match_events(water_peaks, sectioned_water, MATCH_TOLERANCE),
+        }
+
+    exact = None
+    if len(source) <= WHOLE_EXACT_MAX_SAMPLES:
+        sds = frame_stats(source.frames, len(source) or 1).sds()
+        exact = all(
+            all(np.array_equal(a, b) for a, b in zip(whole_signal_reference(signal, baseline, sd), (tumor_peaks, water_peaks)))
+            for signal, (tumor_peaks, water_peaks, baseline), sd in zip(source.channels, whole, sds)
+        )
+
+    return [
+        record("whole_signal", "sectioned-rolling", samples, sectioned_seconds, accuracy=detection_accuracy(sectioned, truth)),
+        record("whole_signal", "whole", samples, whole_seconds, accuracy=detection_accuracy(whole, truth),
+               agreement_with_sectioned=agreement, exact=exact),
+    ]
+
+
+def bench_minmax_downsample(path: str) -> list[dict]:
+    from algorithms import minmax_downsample
+    from pyramid import MinMaxPyramid
+    from signal_source import SignalSource
+    from tile_cache import TileCache
+
+    source = SignalSource.from_bin(path)
+    signal = source.channel(0)
+    results = []
+
+    started = time.perf_counter()
+    minmax_downsample(source.time_range(0, len(signal)), np.asarray(signal), canvas_width=2000)
+    results.append(record("minmax_downsample", "full-range", len(signal), time.perf_counter() - started))
+
+    started = time.perf_counter()
+    pyramid = MinMaxPyramid.build(signal)
+    results.append(record("minmax_downsample", "pyramid-build", len(signal), time.perf_counter() - started))
+
+    # what a redraw does: stitch the visible tiles of the pyramid level, computing the ones not cached yet
+    started = time.perf_counter()
+    TileCache().query("signal", 0, signal, pyramid, 0, len(signal), 2000)
+    results.append(record("minmax_downsample", "pyramid-query", len(signal), time.perf_counter() - started))
+
+    return results
+
+
+def bench_csv_to_bin(path: str) -> list[dict]:
+    from converter import csv_to_bin
+    from signal_source import SignalSource
+
+    source = SignalSource.from_bin(path)
+    if len(source) > CSV_MAX_SAMPLES:
+        return []
+
+    csv_path = os.path.splitext(path)[0] + ".csv"
+    if not os.path.exists(csv_path):
+        with open(csv_path, "w") as file:
+            file.write("adc1,adc2\n")
+            for start in range(0, len(source), 1_000_000):
+                frames = np.column_stack([channel[start:start + 1_000_000] for channel in source.channels])
+                np.savetxt(file, frames, fmt="%d", delimiter=",")
+
+    out_path = os.path.splitext(path)[0] + ".converted.bin"
+    started = time.perf_counter()
+    csv_to_bin(csv_path, out_path)
+    elapsed = time.perf_counter() - started
+    os.remove(out_path)
+
+    return [record("csv_to_bin", "chunked", len(source), elapsed, input_bytes=os.path.getsize(csv_path))]
+
+
+def bench_export_peaks(path: str) -> list[dict]:
+    from scipy.signal import find_peaks
+    from detection import process_frames
+    from peak_export import EXPORT_EXTENSIONS, export_peaks
+    from signal_source import SignalSource
+
+    source = SignalSource.from_bin(path)
+    baselines = [baseline for _, _, baseline in process_frames(source.frames)]
+
+    # every local maximum stands in for a detected peak, so the table is large enough to show bulk throughput
+    tumor_peaks = []
+    water_peaks = []
+    for signal in source.channels:
+        maxima = find_peaks(np.asarray(signal))[0][:EXPORT_MAX_PEAKS // source.n_channels]
+        tumor_peaks.append(maxima[::2])
+        water_peaks.append(maxima[1::2])
+
+    results = []
+    for name, extension in EXPORT_EXTENSIONS.items():
+        out_path = os.path.splitext(path)[0] + ".peak_table" + extension
+        started = time.perf_counter()
+        try:
+            rows = export_peaks(out_path, source.frames, source.sampling_rate, tumor_peaks, water_peaks, baselines)
+        except ImportError as e:
+            print(f"Skipping {name} export: {e}")
+            continue
+        elapsed = time.perf_counter() - started
+        results.append(record("export_peaks", name, len(source), elapsed, rows=rows, rows_per_second=rows / elapsed,
+                              output_bytes=os.path.getsize(out_path)))
+        os.remove(out_path)
+    return results
+
+
+def bench_coincidence(path: str) -> list[dict]:
+    from scipy.signal import find_peaks
+    from coincidence import match_peaks, two_pointer_pairs
+    from signal_source import SignalSource
+
+    source = SignalSource.from_bin(path)
+    if source.n_channels < 2:
+        return []
+
+    # every local maximum stands in for a detected peak, far denser than real peaks and so mostly contested
+    a, b = (find_peaks(np.asarray(signal))[0][:COINCIDENCE_MAX_PEAKS] for signal in source.channels[:2])
+
+    started = time.perf_counter()
+    pair_a, pair_b = match_peaks(a, b, MATCH_TOLERANCE)
+    elapsed = time.perf_counter() - started
+
+    # the plain walk over every peak is the reference the clustered merge has to reproduce
+    started = time.perf_counter()
+    walk_a, walk_b = two_pointer_pairs(a, b, MATCH_TOLERANCE)
+    walk_elapsed = time.perf_counter() - started
+    exact = np.array_equal(pair_a, walk_a) and np.array_equal(pair_b, walk_b)
+
+    peaks = len(a) + len(b)
+    return [
+        record("coincidence", "walk", len(source), walk_elapsed, peaks=peaks, peaks_per_second=peaks / walk_elapsed,
+               matched=len(walk_a)),
+        record("coincidence", "clustered", len(source), elapsed, peaks=peaks, peaks_per_second=peaks / elapsed,
+               matched=len(pair_a), exact=exact),
+    ]
+
+
+def run_benchmark(name: str, path: str, warmup_path: str = None) -> tuple[list[dict], int, str]:
+    benchmark = globals()[f"bench_{name}"]
+    if warmup_path is not None:
+        # an untimed pass over a small recording pays for imports and first calls, so the first timed case does not
+        benchmark(warmup_path)
+
+    if peak_rss_bytes() is not None:
+        results = benchmark(path)
+        return results, peak_rss_bytes(), "rss"
+
+    # without an RSS reading, the peak of Python and numpy allocations is the closest substitute
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        results = benchmark(path)
+        return results, tracemalloc.get_traced_memory()[1], "tracemalloc"
+    finally:
+        tracemalloc.stop()
+
+
+def dataset_path(data_dir: str, n_samples: int, seed: int) -> str:
+    return os.path.join(data_dir, f"synthetic_{n_samples}_{seed}.bin")
+
+
+def ensure_dataset(data_dir: str, n_samples: int, seed: int) -> str:
+    from synthetic import generate_recording, truth_path
+
+    path = dataset_path(data_dir, n_samples, seed)
+    if not (os.path.exists(path) and os.path.exists(truth_path(path))):
+        print(f"Generating {n_samples:,} samples -> {path}")
+        generate_recording(path, n_samples, seed=seed)
+    return path
+
+
+def compare(results: list[dict], previous_path: str):
+    with open(previous_path) as file:
+        previous = {(r["benchmark"], r["variant"], r["samples"]): r for r in json.load(file)["results"]}
+
+    for result in results:
+        old = previous.get((result["benchmark"], result["variant"], result["samples"]))
+        if old is None or not old["samples_per_second"]:
+            continue
+        ratio = result["samples_per_second"] / old["samples_per_second"]
+        print(f"{result['benchmark']:>18} {result['variant']:<18} {result['samples']:>12,} {ratio:6.2f}x")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the detection pipeline on synthetic recordings.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="samples per channel")
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "signal-analyzer-bench"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="previous results file to compare throughput against")
+    parser.add_argument("--no-warmup", action="store_true",
+                        help="time each benchmark cold, including imports and first-call costs")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    warmup_path = None if args.no_warmup else ensure_dataset(args.data_dir, WARMUP_SAMPLES, args.seed)
+    context = multiprocessing.get_context("spawn")
+    results = []
+
+    for n_samples in args.sizes:
+        path = ensure_dataset(args.data_dir, n_samples, args.seed)
+
+        for name in args.benchmarks:
+            # fresh process per benchmark so peak RSS is not inherited from earlier runs
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                benchmark_results, peak, memory_source = executor.submit(run_benchmark, name, path, warmup_path).result()
+
+            for result in benchmark_results:
+                result["peak_rss_bytes"] = peak
+                result["peak_memory_source"] = memory_source
+                results.append(result)
+                print(f"{result['benchmark']:>18} {result['variant']:<18} {n_samples:>12,} samples "
+                      f"{format_time(result['seconds']):>12} {result['samples_per_second']:>14,.0f} samples/s "
+                      f"peak {'RSS' if memory_source == 'rss' else 'traced'} {format_size(peak)}")
+
+    output = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": args.seed,
+            "warmup_samples": None if args.no_warmup else WARMUP_SAMPLES,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(output, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import numpy as np
+from algorithms import CANDIDATE_DTYPE, spaced_peaks, split_peaks
+from detection import SECTION_SIZE, crop_section, peak_params
+from profiling import stage
+
+
+class CandidateStore:
+    def __init__(self, n_channels: int, section_size: int = SECTION_SIZE):
+        self.section_size = section_size
+        self.sections = [{} for _ in range(n_channels)]
+        self.ends = {}
+        # per section, the candidates left by the last height and distance, which changing the other thresholds keeps
+        self.spaced = [{} for _ in range(n_channels)]
+
+    @property
+    def n_channels(self) -> int:
+        return len(self.sections)
+
+    def __bool__(self):
+        return any(self.sections)
+
+    def add(self, start: int, channel_candidates: list, end: int = None):
+        self.ends[start] = start + self.section_size if end is None else end
+        for sections, spaced, candidates in zip(self.sections, self.spaced, channel_candidates):
+            sections[start] = candidates
+            spaced.pop(start, None)
+
+    def select(self, channel: int, params: dict = None, profile=None) -> tuple[np.ndarray, np.ndarray]:
+        if params is None:
+            params = peak_params()
+
+        tumor_peaks = []
+        water_peaks = []
+        sections = self.sections[channel]
+        spaced = self.spaced[channel]
+        key = (params["height_sd"], params["distance"])
+        for start in sorted(sections):
+            # each section re-runs the selection on its extended candidates, then keeps its own range like detection
+            with stage(profile, "classification"):
+                if start not in spaced or spaced[start][0] != key:
+                    spaced[start] = (key, spaced_peaks(sections[start], *key))
+                peaks = split_peaks(spaced[start][1], params["prominence"], params["water_dip_sd"],
+                                    params["water_height_sd"])
+            tumor, water = crop_section(start, self.ends[start], *peaks)
+            tumor_peaks.append(tumor)
+            water_peaks.append(water)
+
+        empty = np.array([], dtype=np.int64)
+        return (np.concatenate(tumor_peaks) if tumor_peaks else empty,
+                np.concatenate(water_peaks) if water_peaks else empty)
+
+    def select_all(self, params: dict = None, profile=None) -> list[tuple[np.ndarray, np.ndarray]]:
+        return [self.select(channel, params, profile) for channel in range(self.n_channels)]
+
+    def lookup(self, channel: int, peaks: np.ndarray, field: str) -> np.ndarray:
+        # the value the owning section saw for each peak, NaN where no section holds it as a candidate
+        peaks = np.asarray(peaks, dtype=np.int64)
+        values = np.full(len(peaks), np.nan)
+        sections = self.sections[channel]
+        for start in sorted(sections):
+            first, last = np.searchsorted(peaks, (start, self.ends[start]))
+            index = sections[start]["index"]
+            if first == last or len(index) == 0:
+                continue
+            positions = np.minimum(np.searchsorted(index, peaks[first:last]), len(index) - 1)
+            found = index[positions] == peaks[first:last]
+            values[first:last][found] = sections[start][field][positions[found]]
+        return values
+
+    def to_arrays(self) -> dict:
+        arrays = {"candidate_section_size": np.array([self.section_size], dtype=np.int64)}
+        for channel, sections in enumerate(self.sections):
+            starts = sorted(sections)
+            arrays[f"candidate_starts_{channel}"] = np.array(starts, dtype=np.int64)
+            arrays[f"candidate_ends_{channel}"] = np.array([self.ends[start] for start in starts], dtype=np.int64)
+            arrays[f"candidate_counts_{channel}"] = np.array([len(sections[start]) for start in starts], dtype=np.int64)
+            arrays[f"candidates_{channel}"] = (np.concatenate([sections[start] for start in starts]) if starts
+                                               else np.zeros(0, dtype=CANDIDATE_DTYPE))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: dict):
+        if "candidate_section_size" not in arrays:
+            return None
+
+        n_channels = 0
+        while f"candidates_{n_channels}" in arrays:
+            n_channels += 1
+
+        store = cls(n_channels, int(arrays["candidate_section_size"][0]))
+        for channel in range(n_channels):
+            offsets = np.cumsum(arrays[f"candidate_counts_{channel}"])[:-1]
+            chunks = np.split(arrays[f"candidates_{channel}"], offsets)
+            for start, end, candidates in zip(arrays[f"candidate_starts_{channel}"], arrays[f"candidate_ends_{channel}"], chunks):
+                store.sections[channel][int(start)] = candidates
+                store.ends[int(start)] = int(end)
+        return store
@@ -0,0 +1,200 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from algorithms import BASELINE_ENGINES
+from candidate_store import CandidateStore
+from coincidence import COINCIDENCE_TOLERANCE, channel_coincidences
+from detection import BASELINE_ENGINE, DETECTION_MODE, DETECTION_MODES, SECTION_SIZE, peak_feature_tables, process_frames
+from formatters import format_time
+from peak_export import EXPORT_EXTENSIONS, check_export_backend, export_peaks
+from profiling import PipelineProfile, dump_report, profile_call, run_report
+from signal_source import SignalSource, DEFAULT_N_CHANNELS, DEFAULT_SAMPLING_RATE
+from whole_signal import process_frames_whole
+
+SUPPORTED_TYPES = (".bin", ".sig", ".csv")
+
+
+def collect_files(inputs: list[str]) -> list[str]:
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern)
+
+        for path in sorted(candidates):
+            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in SUPPORTED_TYPES and path not in files:
+                files.append(path)
+
+    return files
+
+
+def analyze_file(file_path: str, output_dir: str = None, sampling_rate: float = DEFAULT_SAMPLING_RATE,
+                 section_size: int = SECTION_SIZE, baseline_engine: str = BASELINE_ENGINE, profile: bool = False,
+                 n_channels: int = DEFAULT_N_CHANNELS, mode: str = DETECTION_MODE,
+                 export_format: str = None, coincidence_tolerance: float = COINCIDENCE_TOLERANCE) -> dict:
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+
+    with SignalSource.open(file_path, sampling_rate, n_channels) as source:
+        # the source extension stays in the name, so rec.bin and rec.sig side by side get separate outputs
+        output_base = os.path.join(output_dir or os.path.dirname(file_path), os.path.basename(file_path))
+        pipeline_profile = PipelineProfile() if profile else None
+        arrays = {}
+        tumor_counts = {}
+        water_counts = {}
+        candidates = CandidateStore(source.n_channels, section_size) if export_format else None
+
+        if mode == "whole":
+            detect = lambda: process_frames_whole(source.frames, section_size, profile=pipeline_profile,
+                                                  candidates=candidates)
+        else:
+            detect = lambda: process_frames(source.frames, section_size, baseline_engine=baseline_engine,
+                                            profile=pipeline_profile, candidates=candidates)
+        channel_results = profile_call(detect, output_base + ".prof" if profile else None)
+
+        features = peak_feature_tables(source.frames, channel_results, candidates)
+        for name, (tumor_peaks, water_peaks, baseline), table in zip(source.channel_names, channel_results, features):
+            arrays[f"{name}_tumor_peaks"] = tumor_peaks
+            arrays[f"{name}_water_peaks"] = water_peaks
+            arrays[f"{name}_features"] = table
+            arrays[f"{name}_baseline_breakpoints"] = baseline.breakpoints
+            arrays[f"{name}_baseline_values"] = baseline.values
+            tumor_counts[name] = len(tumor_peaks)
+            water_counts[name] = len(water_peaks)
+
+        # matched pairs of every channel with the first, each row holding the two peak positions
+        coincidence_counts = {}
+        tumor_peaks, water_peaks, _ = zip(*channel_results)
+        names = source.channel_names
+        tolerance = int(round(coincidence_tolerance * source.sampling_rate))
+        for channel, classes in channel_coincidences(tumor_peaks, water_peaks, tolerance).items():
+            pair_name = f"{names[0]}_{names[channel]}"
+            coincidence_counts[pair_name] = {}
+            for class_name, result in classes.items():
+                arrays[f"{pair_name}_{class_name}_pairs"] = result["pairs"]
+                coincidence_counts[pair_name][class_name] = {
+                    "matched": result["matched"],
+                    "unmatched": [len(result["unmatched_a"]), len(result["unmatched_b"])],
+                    "median_lag": (None if np.isnan(result["median_lag"])
+                                   else result["median_lag"] / source.sampling_rate),
+                }
+
+        output_path = output_base + ".peaks.npz"
+        np.savez(output_path, sampling_rate=source.sampling_rate, **arrays)
+
+        table_path = None
+        if export_format:
+            table_path = output_base + ".peak_table" + EXPORT_EXTENSIONS[export_format]
+            export_peaks(table_path, source.frames, source.sampling_rate, *zip(*channel_results), candidates)
+
+        if profile:
+            report = run_report([pipeline_profile], time.perf_counter() - started, time.thread_time() - cpu_started,
+                                file=file_path, baseline_engine=baseline_engine, mode=mode, section_size=section_size,
+                                cprofile=output_base + ".prof")
+            dump_report(report, output_base + ".profile.json")
+
+        return {
+            "file": file_path,
+            "output": output_path,
+            "table": table_path,
+            "samples": len(source),
+            "channels": source.n_channels,
+            "seconds": time.perf_counter() - started,
+            "tumor_peaks": tumor_counts,
+            "water_peaks": water_counts,
+            "coincidences": coincidence_counts,
+        }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Detect tumor and water peaks in recordings without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="directories, files or glob patterns of .bin/.sig/.csv recordings")
+    parser.add_argument("-o", "--output-dir",
+                        help="where to write <file>.peaks.npz with peaks, per-peak features and baselines "
+                             "(default: next to each input)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--sampling-rate", type=float, default=DEFAULT_SAMPLING_RATE)
+    parser.add_argument("--channels", type=int, default=DEFAULT_N_CHANNELS, help="channels interleaved in .bin files")
+    parser.add_argument("--section-size", type=int, default=SECTION_SIZE)
+    parser.add_argument("--baseline-engine", choices=BASELINE_ENGINES, default=BASELINE_ENGINE)
+    parser.add_argument("--mode", choices=DETECTION_MODES, default=DETECTION_MODE,
+                        help="sections: per-section baselines on extended windows; whole: one pass with a rolling baseline")
+    parser.add_argument("--export", choices=EXPORT_EXTENSIONS,
+                        help="also write the per-peak table (<file>.peak_table.<ext>) in this format")
+    parser.add_argument("--coincidence-tolerance", type=float, default=COINCIDENCE_TOLERANCE * 1000,
+                        help="largest lag in ms between peaks paired across channels")
+    parser.add_argument("--profile", action="store_true",
+                        help="write per-stage timings (<file>.profile.json) and cProfile stats (<file>.prof) per input")
+    parser.add_argument("--summary", help="summary JSON path (default: summary.json in the output directory)")
+    args = parser.parse_args(argv)
+
+    if args.export:
+        try:
+            check_export_backend(args.export)
+        except ImportError as e:
+            parser.error(str(e))
+
+    files = collect_files(args.inputs)
+    if not files:
+        print("No .bin, .sig or .csv files found.", file=sys.stderr)
+        return 1
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    results = []
+    failures = []
+
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(files)))) as executor:
+        futures = {
+            executor.submit(analyze_file, path, args.output_dir, args.sampling_rate, args.section_size,
+                            args.baseline_engine, args.profile, args.channels, args.mode, args.export,
+                            args.coincidence_tolerance / 1000): path
+            for path in files
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"{path}: error: {e}", file=sys.stderr)
+                failures.append({"file": path, "error": str(e)})
+                continue
+
+            results.append(result)
+            counts = ", ".join(f"{name} {count} tumor / {result['water_peaks'][name]} water"
+                               for name, count in result["tumor_peaks"].items())
+            print(f"{path}: {result['samples']:,} samples in {format_time(result['seconds'])} ({counts})")
+
+    elapsed = time.perf_counter() - started
+    total_samples = sum(result["samples"] for result in results)
+    summary = {
+        "files": len(results),
+        "failed": len(failures),
+        "samples": total_samples,
+        "seconds": elapsed,
+        "samples_per_second": total_samples / elapsed if elapsed > 0 else 0.0,
+        "workers": args.workers,
+        "results": sorted(results, key=lambda result: result["file"]),
+        "failures": failures,
+    }
+
+    summary_path = args.summary or os.path.join(args.output_dir or os.getcwd(), "summary.json")
+    with open(summary_path, "w") as file:
+        json.dump(summary, file, indent=2)
+
+    print(f"{len(results)} files, {total_samples:,} samples in {format_time(elapsed)} "
+          f"({summary['samples_per_second']:,.0f} samples/s), summary: {summary_path}")
+
+    return 0 if not failures else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
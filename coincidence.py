@@ -0,0 +1,87 @@
+import numpy as np
+
+COINCIDENCE_TOLERANCE = 0.01
+
+
+def two_pointer_pairs(a: np.ndarray, b: np.ndarray, tolerance: int) -> tuple[np.ndarray, np.ndarray]:
+    # plain lists walk several times faster than indexing numpy scalars
+    a = np.asarray(a).tolist()
+    b = np.asarray(b).tolist()
+    pairs_a = []
+    pairs_b = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if abs(b[j] - a[i]) <= tolerance:
+            pairs_a.append(i)
+            pairs_b.append(j)
+            i += 1
+            j += 1
+        elif a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+    return np.array(pairs_a, dtype=np.int64), np.array(pairs_b, dtype=np.int64)
+
+
+def match_peaks(a: np.ndarray, b: np.ndarray, tolerance: int) -> tuple[np.ndarray, np.ndarray]:
+    # The one-to-one pairs a forward two-pointer merge of the sorted peaks finds, as indices into a and b. Peaks more
+    # than the tolerance apart never meet in that walk, so the merged sequence splits into independent clusters at
+    # such gaps: clusters of one peak per channel pair up in numpy and only the crowded rest takes the walk. Both
+    # steps are a single pass, whatever the spacing of the peaks.
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    empty = np.array([], dtype=np.int64)
+    if len(a) == 0 or len(b) == 0:
+        return empty, empty
+
+    values = np.concatenate((a, b))
+    # timsort merges the two sorted runs in linear time
+    order = np.argsort(values, kind="stable")
+    merged = values[order]
+    is_b = order >= len(a)
+
+    cluster = np.cumsum(np.diff(merged, prepend=merged[0]) > tolerance)
+    sizes = np.bincount(cluster)[cluster]
+    crowded = sizes > 2
+    if np.count_nonzero(crowded) > len(merged) // 2:
+        # mostly crowded, the walk over everything is cheaper than splitting it up
+        return two_pointer_pairs(a, b, tolerance)
+
+    first = np.flatnonzero((sizes == 2) & (np.diff(cluster, prepend=-1) != 0))
+    first = first[is_b[first] != is_b[first + 1]]
+    pair_a = np.where(is_b[first], order[first + 1], order[first])
+    pair_b = np.where(is_b[first], order[first], order[first + 1]) - len(a)
+
+    if np.any(crowded):
+        crowded_a = order[crowded & ~is_b]
+        crowded_b = order[crowded & is_b] - len(a)
+        walk_a, walk_b = two_pointer_pairs(a[crowded_a], b[crowded_b], tolerance)
+        pair_a = np.concatenate((pair_a, crowded_a[walk_a]))
+        pair_b = np.concatenate((pair_b, crowded_b[walk_b]))
+
+    by_a = np.argsort(pair_a, kind="stable")
+    return pair_a[by_a], pair_b[by_a]
+
+
+def coincidences(a: np.ndarray, b: np.ndarray, tolerance: int) -> dict:
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    pair_a, pair_b = match_peaks(a, b, tolerance)
+    lags = b[pair_b] - a[pair_a]
+    return {
+        "pairs": np.column_stack((a[pair_a], b[pair_b])),
+        "lags": lags,
+        "unmatched_a": np.delete(a, pair_a),
+        "unmatched_b": np.delete(b, pair_b),
+        "matched": len(pair_a),
+        "median_lag": float(np.median(lags)) if len(lags) else float("nan"),
+    }
+
+
+def channel_coincidences(tumor_peaks: list, water_peaks: list, tolerance: int, reference: int = 0) -> dict:
+    # every other channel against the reference one, tumor with tumor and water with water
+    return {
+        channel: {"tumor": coincidences(tumor_peaks[reference], tumor_peaks[channel], tolerance),
+                  "water": coincidences(water_peaks[reference], water_peaks[channel], tolerance)}
+        for channel in range(len(tumor_peaks)) if channel != reference
+    }
@@ -1,24 +1,167 @@
 import os
-import pandas as pd
 import numpy as np
+from signal_source import DEFAULT_N_CHANNELS, DEFAULT_SAMPLING_RATE, channel_columns
+from sigfile import CHUNK_SIZE, SigWriter
 
+CHUNK_ROWS = 1_000_000
 
-def csv_to_bin(file_path: str, save_path: str = None):
+
+class ConversionCancelled(Exception):
+    pass
+
+
+def _estimate_row_bytes(file_path):
+    with open(file_path, "rb") as file:
+        sample = file.read(1 << 20)
+    return len(sample) / max(sample.count(b"\n"), 1)
+
+
+def _read_chunks_pyarrow(pa_csv, file, columns, chunk_rows, file_size):
+    row_bytes = _estimate_row_bytes(file.name)
+    rows = 0
+    reader = pa_csv.open_csv(
+        file,
+        read_options=pa_csv.ReadOptions(block_size=chunk_rows * 16, use_threads=False),
+        convert_options=pa_csv.ConvertOptions(include_columns=columns)
+    )
+    for batch in reader:
+        rows += batch.num_rows
+        yield ([batch.column(name).to_numpy(zero_copy_only=False) for name in columns],
+               min(rows * row_bytes / file_size, 1.0))
+
+
+def _read_chunks_pandas(file, columns, chunk_rows, file_size):
+    import pandas as pd
+
+    for chunk in pd.read_csv(file, usecols=columns, chunksize=chunk_rows, engine="c", low_memory=True):
+        yield [chunk[name].to_numpy() for name in columns], min(file.tell() / file_size, 1.0)
+
+
+def _check_columns(file_path) -> list[str]:
+    with open(file_path, "r") as file:
+        header = [name.strip().strip('"') for name in file.readline().split(",")]
+
+    columns = channel_columns(header)
+    if not columns:
+        raise ValueError("The csv file should have columns 'adc1', 'adc2', ...")
+    return columns
+
+
+class _BinWriter:
+    def __init__(self, path):
+        self.file = open(path, "wb")
+
+    def write(self, frames):
+        frames.tofile(self.file)
+
+    def close(self):
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+def _open_writer(save_path, tmp_path, columns, sampling_rate):
+    if os.path.splitext(save_path)[1].lower() == ".sig":
+        return SigWriter(tmp_path, len(columns), sampling_rate, channel_names=columns)
+    return _BinWriter(tmp_path)
+
+
+def csv_to_bin(file_path: str,
+               save_path: str = None,
+               chunk_rows: int = CHUNK_ROWS,
+               progress=None,
+               is_cancelled=None,
+               sampling_rate: float = DEFAULT_SAMPLING_RATE):
 
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"The file '{file_path}' does not exist.")
 
-    df = pd.read_csv(file_path, low_memory=True)
+    columns = _check_columns(file_path)
+
+    if save_path is None:
+        save_path = os.path.splitext(file_path)[0] + ".bin"
+
+    try:
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        pa_csv = None
 
-    if "adc1" not in df.columns or "adc2" not in df.columns:
-        raise ValueError("The csv file should have columns 'adc1' and 'adc2'.")
+    file_size = os.path.getsize(file_path)
+    tmp_path = save_path + ".part"
 
-    signal_1 = np.asarray(df["adc1"], dtype=np.int16)
-    signal_2 = np.asarray(df["adc2"], dtype=np.int16)
-    interleaved = np.column_stack((signal_1, signal_2))
+    try:
+        out = _open_writer(save_path, tmp_path, columns, sampling_rate)
+        try:
+            with open(file_path, "rb") as file:
+                if pa_csv is not None:
+                    chunks = _read_chunks_pyarrow(pa_csv, file, columns, chunk_rows, max(file_size, 1))
+                else:
+                    chunks = _read_chunks_pandas(file, columns, chunk_rows, max(file_size, 1))
+
+                for signals, fraction in chunks:
+                    interleaved = np.empty((len(signals[0]), len(columns)), dtype=np.int16)
+                    for channel, signal in enumerate(signals):
+                        interleaved[:, channel] = signal
+                    out.write(interleaved)
+
+                    if progress is not None:
+                        progress(fraction)
+                    if is_cancelled is not None and is_cancelled():
+                        raise ConversionCancelled()
+        except BaseException:
+            out.abort()
+            raise
+        out.close()
+
+        os.replace(tmp_path, save_path)
+
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return save_path
+
+
+def bin_to_sig(file_path: str,
+               save_path: str = None,
+               n_channels: int = DEFAULT_N_CHANNELS,
+               sampling_rate: float = DEFAULT_SAMPLING_RATE,
+               dtype=np.int16,
+               chunk_size: int = CHUNK_SIZE,
+               progress=None,
+               is_cancelled=None) -> str:
 
     if save_path is None:
-        save_path = os.path.splitext(file_path)[0] + ".bin"
+        save_path = os.path.splitext(file_path)[0] + ".sig"
+
+    n_frames = os.path.getsize(file_path) // (n_channels * np.dtype(dtype).itemsize)
+    tmp_path = save_path + ".part"
+    step = chunk_size * 16
+
+    try:
+        out = SigWriter(tmp_path, n_channels, sampling_rate, dtype=dtype, chunk_size=chunk_size)
+        try:
+            if n_frames:
+                frames = np.memmap(file_path, dtype=dtype, mode="r", shape=(n_frames, n_channels))
+                for start in range(0, n_frames, step):
+                    out.write(frames[start:start + step])
+
+                    if progress is not None:
+                        progress(min(start + step, n_frames) / n_frames)
+                    if is_cancelled is not None and is_cancelled():
+                        raise ConversionCancelled()
+        except BaseException:
+            out.abort()
+            raise
+        out.close()
+
+        os.replace(tmp_path, save_path)
+
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
-    interleaved.tofile(save_path)
     return save_path
@@ -0,0 +1,548 @@
+import os
+import bisect
+import time
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+from algorithms import (
+    PEAK_FEATURES_DTYPE, PEAK_TUMOR, PEAK_WATER, compute_section_baseline, find_peak_candidates, peak_features,
+    rolling_baseline, select_peaks, sliding_min_at, window_prominences
+)
+from baseline import PiecewiseBaseline
+from profiling import PipelineProfile, stage
+from signal_source import SignalSource
+from signal_stats import SectionStats, SignalStats, channel_block, frame_stats, sd_from_moments, signal_stats
+
+SECTION_SIZE = 200000
+EXTEND = 10000
+MOMENTS_CHUNK_SIZE = 1 << 20
+DISTANCE = 15000
+PROMINENCE = 30
+LOCAL_DIST = 20000
+HEIGHT_SD = 1.0
+WATER_DIP_SD = 2
+WATER_HEIGHT_SD = 9
+# candidates are kept down to this height, the loosest threshold a re-selection can use
+CANDIDATE_HEIGHT_SD = 1.0
+BASELINE_ENGINE = "histogram"
+DETECTION_MODES = ("sections", "whole")
+DETECTION_MODE = "sections"
+ROLLING_STEPS_PER_SECTION = 8
+SHARD_MAX_SECTIONS = 8
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class DetectionCancelled(Exception):
+    pass
+
+
+def detection_params(section_size: int = SECTION_SIZE, extend: int = EXTEND, baseline_engine: str = BASELINE_ENGINE,
+                     mode: str = DETECTION_MODE) -> dict:
+    return {
+        "mode": mode,
+        "section_size": section_size,
+        "extend": extend,
+        "baseline_engine": baseline_engine,
+        "distance": DISTANCE,
+        "prominence": PROMINENCE,
+        "local_dist": LOCAL_DIST,
+        "candidate_height_sd": CANDIDATE_HEIGHT_SD,
+    }
+
+
+def peak_params(height_sd: float = HEIGHT_SD, distance: int = DISTANCE, prominence: float = PROMINENCE,
+                water_dip_sd: float = WATER_DIP_SD, water_height_sd: float = WATER_HEIGHT_SD) -> dict:
+    return {
+        "height_sd": height_sd,
+        "distance": distance,
+        "prominence": prominence,
+        "water_dip_sd": water_dip_sd,
+        "water_height_sd": water_height_sd,
+    }
+
+
+def signal_moments(signal, start: int = 0, end: int = None, chunk_size: int = MOMENTS_CHUNK_SIZE) -> tuple[int, int, int]:
+    if end is None:
+        end = len(signal)
+
+    total = 0
+    total_sq = 0
+    for chunk_start in range(start, end, chunk_size):
+        chunk = np.asarray(signal[chunk_start:min(chunk_start + chunk_size, end)], dtype=np.int64)
+        total += int(chunk.sum())
+        total_sq += int(np.dot(chunk, chunk))
+
+    return end - start, total, total_sq
+
+
+def signal_sd(signal) -> float:
+    if np.issubdtype(signal.dtype, np.integer):
+        return sd_from_moments(*signal_moments(signal))
+    return float(np.std(signal))
+
+
+def uses_rolling_baseline(signal, baseline_engine: str) -> bool:
+    return baseline_engine == "rolling" and signal.dtype == np.int16
+
+
+def rolling_pieces(signal, start: int, end: int, section_size: int = SECTION_SIZE, extend: int = EXTEND):
+    step = max(1, section_size // ROLLING_STEPS_PER_SECTION)
+    return rolling_baseline(signal, section_size, step, max(0, start - extend), min(len(signal), end + extend))
+
+
+def _section_baseline(section, start: int, end: int, start_extended: int, end_extended: int, signal_length: int,
+                      baseline_engine: str, rolling: tuple[np.ndarray, np.ndarray] = None, section_stats: SectionStats = None):
+    if rolling is not None:
+        breakpoints, values = rolling
+        section_bl = PiecewiseBaseline(breakpoints, values, signal_length)[start_extended:end_extended]
+        in_section = (breakpoints >= start) & (breakpoints < end)
+        return section_bl, breakpoints[in_section], values[in_section]
+
+    if section_stats is not None and section_stats.baseline is not None and baseline_engine != "percentile":
+        section_bl = section_stats.baseline
+    else:
+        section_bl = compute_section_baseline(section, baseline_engine)
+    return section_bl, np.array([start], dtype=np.int64), np.array([section_bl], dtype=float)
+
+
+def crop_section(start: int, end: int, tumor_peaks: np.ndarray, water_peaks: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return tumor_peaks[(tumor_peaks >= start) & (tumor_peaks < end)], water_peaks[(water_peaks >= start) & (water_peaks < end)]
+
+
+def _section_peaks(extended_section, start: int, end: int, start_extended: int, section_bl, total_signal_sd: float,
+                   profile: PipelineProfile = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    candidates = find_peak_candidates(
+        extended_section,
+        baseline=section_bl,
+        signal_total_sd=total_signal_sd,
+        min_height_sd=CANDIDATE_HEIGHT_SD,
+        local_dist=LOCAL_DIST,
+        profile=profile
+    )
+    candidates["index"] += start_extended
+
+    tumor_peaks, water_peaks = select_peaks(candidates, **peak_params(), profile=profile)
+    return (*crop_section(start, end, tumor_peaks, water_peaks), candidates)
+
+
+def process_section(signal,
+                    start: int,
+                    total_signal_sd: float,
+                    section_size: int = SECTION_SIZE,
+                    extend: int = EXTEND,
+                    baseline_engine: str = BASELINE_ENGINE,
+                    rolling: tuple[np.ndarray, np.ndarray] = None,
+                    profile: PipelineProfile = None,
+                    section_stats: SectionStats = None):
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+
+    signal_length = len(signal)
+    end = min(start + section_size, signal_length)
+    section = signal[start:end]
+
+    start_extended = max(0, start - extend)
+    end_extended = min(signal_length, end + extend)
+    extended_section = signal[start_extended:end_extended]
+
+    with stage(profile, "baseline"):
+        section_bl, breakpoints, values = _section_baseline(section, start, end, start_extended, end_extended, signal_length,
+                                                            baseline_engine, rolling, section_stats)
+
+    tumor_peaks, water_peaks, candidates = _section_peaks(extended_section, start, end, start_extended, section_bl,
+                                                          total_signal_sd, profile)
+
+    if profile is not None:
+        profile.add_section(start, end - start, time.perf_counter() - wall_start, time.thread_time() - cpu_start,
+                            len(tumor_peaks), len(water_peaks))
+
+    return tumor_peaks, water_peaks, breakpoints, values, candidates
+
+
+def process_frame_section(frames,
+                          start: int,
+                          total_signal_sds: list[float],
+                          section_size: int = SECTION_SIZE,
+                          extend: int = EXTEND,
+                          baseline_engine: str = BASELINE_ENGINE,
+                          rolling: list = None,
+                          profile: PipelineProfile = None,
+                          section_stats: list[SectionStats] = None) -> list:
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+
+    signal_length = len(frames)
+    end = min(start + section_size, signal_length)
+    start_extended = max(0, start - extend)
+    end_extended = min(signal_length, end + extend)
+
+    with stage(profile, "read_frames"):
+        block = channel_block(frames, start_extended, end_extended)
+    sections = block[:, start - start_extended:end - start_extended]
+
+    results = []
+    for channel, extended_section in enumerate(block):
+        with stage(profile, "baseline"):
+            section_bl, breakpoints, values = _section_baseline(
+                sections[channel], start, end, start_extended, end_extended, signal_length, baseline_engine,
+                rolling[channel] if rolling is not None else None,
+                section_stats[channel] if section_stats is not None else None
+            )
+
+        tumor_peaks, water_peaks, candidates = _section_peaks(extended_section, start, end, start_extended, section_bl,
+                                                              total_signal_sds[channel], profile)
+        results.append((tumor_peaks, water_peaks, breakpoints, values, candidates))
+
+    if profile is not None:
+        profile.add_section(start, (end - start) * len(block), time.perf_counter() - wall_start,
+                            time.thread_time() - cpu_start, sum(len(r[0]) for r in results), sum(len(r[1]) for r in results))
+
+    return results
+
+
+def concatenate_sections(results: list) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    if not results:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty, np.array([], dtype=float)
+    return tuple(np.concatenate([r[i] for r in results]) for i in range(4))
+
+
+def assemble_sections(signal_length: int, results: list):
+    tumor_peaks, water_peaks, breakpoints, values = concatenate_sections(results)
+    return tumor_peaks, water_peaks, PiecewiseBaseline(breakpoints, values, signal_length)
+
+
+def section_peaks(results: list) -> list:
+    # what assembling needs from each channel's section results; the candidates go to the collector only
+    return [channel_results[:4] for channel_results in results]
+
+
+def assemble_partial(signal_length: int, sections: dict, section_size: int = SECTION_SIZE):
+    # sections not processed yet get a NaN baseline so the plot leaves a gap there
+    empty = np.array([], dtype=np.int64)
+    results = []
+    if 0 not in sections:
+        results.append((empty, empty, np.array([0]), np.array([np.nan])))
+
+    for start in sorted(sections):
+        results.append(sections[start])
+        end = start + section_size
+        if end < signal_length and end not in sections:
+            results.append((empty, empty, np.array([end]), np.array([np.nan])))
+
+    return assemble_sections(signal_length, results)
+
+
+def classified_peaks(tumor_peaks: np.ndarray, water_peaks: np.ndarray, start: int, end: int) -> tuple[np.ndarray, np.ndarray]:
+    # the peaks of both classes in [start, end), in index order, with PEAK_TUMOR / PEAK_WATER for each
+    tumor = tumor_peaks[np.searchsorted(tumor_peaks, start):np.searchsorted(tumor_peaks, end)]
+    water = water_peaks[np.searchsorted(water_peaks, start):np.searchsorted(water_peaks, end)]
+    peaks = np.concatenate((tumor, water)).astype(np.int64)
+    classes = np.concatenate((np.full(len(tumor), PEAK_TUMOR, np.int8), np.full(len(water), PEAK_WATER, np.int8)))
+    order = np.argsort(peaks, kind="stable")
+    return peaks[order], classes[order]
+
+
+def peak_feature_tables(frames, channel_results: list, candidates=None, batch_size: int = 1 << 22) -> list[np.ndarray]:
+    # One PEAK_FEATURES_DTYPE table per channel for detection results. Prominence and local min are the values
+    # detection classified with where the candidates still hold them, otherwise taken from the signal.
+    signal_length = len(frames)
+    tables = [[] for _ in channel_results]
+    for start in range(0, signal_length, batch_size):
+        end = min(start + batch_size, signal_length)
+        channel_peaks = [classified_peaks(np.asarray(tumor), np.asarray(water), start, end)
+                         for tumor, water, _ in channel_results]
+        if not any(len(peaks) for peaks, _ in channel_peaks):
+            continue
+
+        offset = max(0, start - LOCAL_DIST)
+        block = channel_block(frames, offset, min(signal_length, end + LOCAL_DIST)).astype(np.float64)
+        for channel, (x, (peaks, classes)) in enumerate(zip(block, channel_peaks)):
+            if len(peaks) == 0:
+                continue
+            local = (peaks - offset).astype(np.intp)
+            prominence = candidates.lookup(channel, peaks, "prominence") if candidates else np.full(len(peaks), np.nan)
+            local_min = candidates.lookup(channel, peaks, "local_min") if candidates else np.full(len(peaks), np.nan)
+            missing = np.isnan(prominence)
+            prominence[missing] = window_prominences(x, local[missing], EXTEND)
+            missing = np.isnan(local_min)
+            local_min[missing] = sliding_min_at(x, LOCAL_DIST, local[missing])
+
+            features = peak_features(x, local, classes, prominence, local_min, EXTEND)
+            features["index"] = peaks
+            tables[channel].append(features)
+
+    return [np.concatenate(table) if table else np.zeros(0, dtype=PEAK_FEATURES_DTYPE) for table in tables]
+
+
+def next_section(remaining: list[int], section_size: int, visible_range: tuple[int, int] = None) -> int:
+    if visible_range is not None:
+        i = bisect.bisect_right(remaining, visible_range[0] - section_size)
+        if i < len(remaining) and remaining[i] < visible_range[1]:
+            return remaining.pop(i)
+    return remaining.pop(0)
+
+
+def process_signal(signal,
+                   section_size: int = SECTION_SIZE,
+                   extend: int = EXTEND,
+                   baseline_engine: str = BASELINE_ENGINE,
+                   profile: PipelineProfile = None,
+                   progress=None,
+                   on_section=None,
+                   is_cancelled=None,
+                   visible_range=None,
+                   candidates=None,
+                   stats=None):
+    signal_length = len(signal)
+
+    if stats is None:
+        with stage(profile, "signal_stats"):
+            stats = signal_stats(signal, section_size)
+    total_signal_sd = stats.sd
+
+    rolling = None
+    if uses_rolling_baseline(signal, baseline_engine):
+        with stage(profile, "rolling_baseline"):
+            rolling = rolling_pieces(signal, 0, signal_length, section_size, 0)
+
+    remaining = list(range(0, signal_length, section_size))
+    n_sections = len(remaining)
+    sections = {}
+    while remaining:
+        if is_cancelled is not None and is_cancelled():
+            raise DetectionCancelled()
+
+        start = next_section(remaining, section_size, visible_range() if visible_range is not None else None)
+        results = process_section(signal, start, total_signal_sd, section_size, extend, baseline_engine, rolling, profile,
+                                  stats.sections[start])
+        if candidates is not None:
+            candidates.add(start, [results[4]])
+        sections[start] = results[:4]
+
+        if on_section is not None:
+            on_section(start, sections[start])
+        if progress is not None:
+            progress(len(sections), n_sections)
+
+    with stage(profile, "concatenate"):
+        return assemble_sections(signal_length, [sections[start] for start in sorted(sections)])
+
+
+def process_frames(frames,
+                   section_size: int = SECTION_SIZE,
+                   extend: int = EXTEND,
+                   baseline_engine: str = BASELINE_ENGINE,
+                   profile: PipelineProfile = None,
+                   progress=None,
+                   on_section=None,
+                   is_cancelled=None,
+                   visible_range=None,
+                   candidates=None,
+                   stats: SignalStats = None) -> list:
+    signal_length, n_channels = frames.shape
+
+    if stats is None:
+        with stage(profile, "signal_stats"):
+            stats = frame_stats(frames, section_size)
+    total_signal_sds = stats.sds()
+
+    rolling = None
+    if uses_rolling_baseline(frames, baseline_engine):
+        with stage(profile, "rolling_baseline"):
+            rolling = [rolling_pieces(frames[:, channel], 0, signal_length, section_size, 0) for channel in range(n_channels)]
+
+    remaining = list(range(0, signal_length, section_size))
+    n_sections = len(remaining)
+    sections = {}
+    while remaining:
+        if is_cancelled is not None and is_cancelled():
+            raise DetectionCancelled()
+
+        start = next_section(remaining, section_size, visible_range() if visible_range is not None else None)
+        results = process_frame_section(frames, start, total_signal_sds, section_size, extend, baseline_engine,
+                                        rolling, profile, stats.section(start))
+        if candidates is not None:
+            candidates.add(start, [channel_results[4] for channel_results in results])
+        sections[start] = section_peaks(results)
+
+        if on_section is not None:
+            on_section(start, sections[start])
+        if progress is not None:
+            progress(len(sections), n_sections)
+
+    with stage(profile, "concatenate"):
+        return [assemble_sections(signal_length, [sections[start][channel] for start in sorted(sections)])
+                for channel in range(n_channels)]
+
+
+class IncrementalDetector:
+    def __init__(self, section_size: int = SECTION_SIZE, extend: int = EXTEND, baseline_engine: str = BASELINE_ENGINE):
+        self.section_size = section_size
+        self.extend = extend
+        # a centred rolling window would need data past the confirmed sections
+        self.baseline_engine = "histogram" if baseline_engine == "rolling" else baseline_engine
+        self.next_start = 0
+        self.moments = (0, 0, 0)
+
+    def update(self, signal, final: bool = False):
+        signal_length = len(signal)
+
+        n, total, total_sq = self.moments
+        if signal_length > n:
+            _, new_total, new_total_sq = signal_moments(signal, n, signal_length)
+            self.moments = (signal_length, total + new_total, total_sq + new_total_sq)
+        total_signal_sd = sd_from_moments(*self.moments)
+
+        results = []
+        while self.next_start < signal_length:
+            end = self.next_start + self.section_size
+            if not final and end + self.extend > signal_length:
+                break
+            results.append(process_section(signal, self.next_start, total_signal_sd, self.section_size, self.extend,
+                                           self.baseline_engine))
+            self.next_start = min(end, signal_length)
+
+        return (*concatenate_sections(results), self.next_start)
+
+
+def open_source(path: str, n_channels: int, dtype=np.int16, offset: int = 0) -> SignalSource:
+    if os.path.splitext(path)[1].lower() == ".sig":
+        return SignalSource.from_sig(path)
+    return SignalSource.from_bin(path, n_channels=n_channels, dtype=dtype, offset=offset)
+
+
+_cancel_event = None
+
+
+def _init_worker(cancel_event):
+    global _cancel_event
+    _cancel_event = cancel_event
+
+
+def _until_cancelled(starts):
+    # a shard stops between sections once the parent cancels, leaving its result incomplete and unused
+    for start in starts:
+        if _cancel_event is not None and _cancel_event.is_set():
+            return
+        yield start
+
+
+def _stats_task(path, n_channels, dtype, offset, starts, section_size):
+    profile = PipelineProfile()
+    with open_source(path, n_channels, dtype, offset) as source, profile.stage("signal_stats"):
+        stats = frame_stats(source.frames, section_size, _until_cancelled(starts))
+    return stats, profile
+
+
+def _sections_task(path, n_channels, dtype, offset, starts, total_signal_sds, section_size, extend, baseline_engine,
+                   section_stats):
+    profile = PipelineProfile()
+    with open_source(path, n_channels, dtype, offset) as source:
+        frames = source.frames
+        rolling = None
+        if uses_rolling_baseline(frames, baseline_engine):
+            end = min(starts[-1] + section_size, len(frames))
+            with profile.stage("rolling_baseline"):
+                rolling = [rolling_pieces(frames[:, channel], starts[0], end, section_size, extend)
+                           for channel in range(frames.shape[1])]
+        results = [
+            process_frame_section(frames, start, total_signal_sds, section_size, extend, baseline_engine, rolling, profile,
+                                  section_stats[start])
+            for start in _until_cancelled(starts)
+        ]
+    return results, profile
+
+
+def _shards(items: list, n_shards: int, max_shard_size: int = None) -> list:
+    shard_size = max(1, -(-len(items) // n_shards))
+    if max_shard_size is not None:
+        shard_size = min(shard_size, max_shard_size)
+    return [items[i:i + shard_size] for i in range(0, len(items), shard_size)]
+
+
+def _wait_or_cancel(futures, is_cancelled):
+    done, _ = wait(futures, timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+    if is_cancelled is not None and is_cancelled():
+        raise DetectionCancelled()
+    return done
+
+
+def process_file_parallel(path: str,
+                          n_channels: int = 2,
+                          dtype=np.int16,
+                          offset: int = 0,
+                          n_workers: int = None,
+                          section_size: int = SECTION_SIZE,
+                          extend: int = EXTEND,
+                          baseline_engine: str = BASELINE_ENGINE,
+                          progress=None,
+                          profile: PipelineProfile = None,
+                          on_section=None,
+                          is_cancelled=None,
+                          visible_range=None,
+                          candidates=None,
+                          stats: SignalStats = None) -> list:
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if profile is None:
+        profile = PipelineProfile()
+
+    with open_source(path, n_channels, dtype, offset) as source:
+        signal_length, n_channels = source.frames.shape
+    section_starts = list(range(0, signal_length, section_size))
+    n_shards = n_workers * 4
+    location = (path, n_channels, dtype, offset)
+
+    context = multiprocessing.get_context("spawn")
+    cancel_event = context.Event()
+    executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=context, initializer=_init_worker,
+                                   initargs=(cancel_event,))
+    try:
+        shards = _shards(section_starts, n_shards, SHARD_MAX_SECTIONS)
+        if stats is None:
+            stats = SignalStats(n_channels, section_size)
+            pending = [executor.submit(_stats_task, *location, starts, section_size) for starts in shards]
+            while pending:
+                for future in _wait_or_cancel(pending, is_cancelled):
+                    pending.remove(future)
+                    shard_stats, shard_profile = future.result()
+                    profile.merge(shard_profile)
+                    stats.merge(shard_stats)
+        total_signal_sds = stats.sds()
+
+        visible = visible_range() if visible_range is not None else None
+        if visible is not None:
+            shards.sort(key=lambda starts: not (starts[0] < visible[1] and starts[-1] + section_size > visible[0]))
+
+        pending = {
+            executor.submit(_sections_task, *location, starts, total_signal_sds, section_size, extend, baseline_engine,
+                            {start: stats.section(start) for start in starts}): starts
+            for starts in shards
+        }
+
+        sections = {}
+        while pending:
+            for future in _wait_or_cancel(pending, is_cancelled):
+                starts = pending.pop(future)
+                shard_results, shard_profile = future.result()
+                profile.merge(shard_profile)
+                for start, results in zip(starts, shard_results):
+                    if candidates is not None:
+                        candidates.add(start, [channel_results[4] for channel_results in results])
+                    sections[start] = section_peaks(results)
+                    if on_section is not None:
+                        on_section(start, sections[start])
+                if progress is not None:
+                    progress(len(sections), len(section_starts))
+    except BaseException:
+        # running shards stop at their next section; waiting for them would hold up a cancel
+        cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    with profile.stage("concatenate"):
+        return [assemble_sections(signal_length, [sections[start][channel] for start in sorted(sections)])
+                for channel in range(n_channels)]
@@ -1,47 +1,154 @@
 import sys
+from profiling import StartupProfile
+
+# installed before the other imports, so their cost shows up per module
+startup_profile = StartupProfile() if "--startup-times" in sys.argv else None
+if startup_profile is not None:
+    startup_profile.install()
+
 import os
-import pandas as pd
+import shutil
 import numpy as np
 from PySide6.QtWidgets import QApplication, QFileDialog
-from PySide6.QtCore import QThread
-from workers import PeakWorker
+from PySide6.QtCore import QThread, QTimer
+from workers import (
+    ConvertWorker, ExportWorker, PeakWorker, PyramidWorker, SelectionWorker, StreamWorker, TilePrefetchWorker
+)
 from formatters import format_size, format_time
 from algorithms import minmax_downsample
-from converter import csv_to_bin
+from pyramid import pyramid_path
+from baseline import PiecewiseBaseline
+from peak_export import EXPORT_FORMATS, export_available
+from peak_index import PeakIndex
+from signal_source import SignalSource, DEFAULT_SAMPLING_RATE
+from detection import detection_params, peak_params
+from profiling import DEFAULT_PROFILE_DIR
+from result_cache import ResultCache, arrays_to_results
+from result_store import new_session_dir
+from tile_cache import TileCache
+from candidate_store import CandidateStore
+from coincidence import channel_coincidences
 from main_window import MainWindow
 
+SIGNAL_COLORS = ("cornflowerblue", "orange", "mediumseagreen", "orchid", "sienna", "slategray", "gold", "teal")
+PEAK_COLORS = ("red", "green", "purple", "magenta", "brown", "darkcyan", "olive", "navy")
+Y_MARGIN = 0.05
+Y_PAN_MARGIN = 0.25
+
 
 class SignalAnalyzer(MainWindow):
     def __init__(self):
         super().__init__()
 
         self.worker = None
+        self.worker_params = None
         self.thread = None
-        self.i = None
         self.file_path = None
-        self.signal_1 = None
-        self.signal_2 = None
-        self.time = None
-        self.sampling_rate = 50000
+        self.source = None
+        self.retired_sources = []
+        self.sampling_rate = DEFAULT_SAMPLING_RATE
         self.plotting_start_index = 0
         self.plotting_end_index = None
-        self.s1_tumor_peaks = np.array([])
-        self.s2_tumor_peaks = np.array([])
-        self.s1_water_peaks = np.array([])
-        self.s2_water_peaks = np.array([])
-        self.baseline_1 = None
-        self.baseline_2 = None
+        self.view_span = None
+        self.tumor_peaks = []
+        self.water_peaks = []
+        self.baselines = []
+        self.candidates = None
+        self.coincidences = {}
+        self.result_store = None
+        self.session_dir = new_session_dir()
+        self.pyramid_jobs = []
+        self.detection_jobs = []
+        self.signal_pyramids = None
+        self.baseline_pyramids = None
+        self.stream_worker = None
+        self.stream_thread = None
+        self.stream_window = 10 * self.sampling_rate
+        self.convert_worker = None
+        self.convert_thread = None
+        self.export_worker = None
+        self.export_thread = None
+        self.result_cache = ResultCache()
+        self.detection_metrics = None
+        self.tile_cache = TileCache()
+        self.last_view = None
 
         self.open_action.triggered.connect(self.load_data)
+        self.follow_action.triggered.connect(self.on_follow_toggled)
         self.convert_action.triggered.connect(self.convert_file_to_bin)
+        self.export_action.triggered.connect(self.export_peaks)
         self.exit_action.triggered.connect(self.close)
         self.peaks_checkbox.stateChanged.connect(self.on_checkbox_toggle)
         self.water_checkbox.stateChanged.connect(self.on_checkbox_toggle)
         self.baseline_checkbox.stateChanged.connect(self.on_checkbox_toggle)
-        self.signal_1_checkbox.stateChanged.connect(self.on_checkbox_toggle)
-        self.signal_2_checkbox.stateChanged.connect(self.on_checkbox_toggle)
-        self.range_slider.valueChanged.connect(self.on_slider_change)
+        for checkbox in self.signal_checkboxes:
+            checkbox.stateChanged.connect(self.on_checkbox_toggle)
         self.range_button.clicked.connect(self.reset_slider_range)
+        self.cancel_button.clicked.connect(self.on_cancel_clicked)
+        self.clear_cache_action.triggered.connect(self.result_cache.clear)
+        for spin in self.threshold_spins.values():
+            spin.valueChanged.connect(self.schedule_peak_selection)
+        self.thresholds_button.clicked.connect(self.reset_thresholds)
+        self.tolerance_spin.valueChanged.connect(lambda _: self.coincidence_timer.start())
+
+        self.plot_timer = QTimer(self)
+        self.plot_timer.setSingleShot(True)
+        self.plot_timer.setInterval(15)
+        self.plot_timer.timeout.connect(self.plot_current_range)
+
+        self.selection_timer = QTimer(self)
+        self.selection_timer.setSingleShot(True)
+        self.selection_timer.setInterval(30)
+        self.selection_timer.timeout.connect(self.apply_peak_selection)
+
+        self.coincidence_timer = QTimer(self)
+        self.coincidence_timer.setSingleShot(True)
+        self.coincidence_timer.setInterval(30)
+        self.coincidence_timer.timeout.connect(self.update_coincidences)
+
+        self.plot_pending = False
+        self.start_prefetch_worker()
+        self.start_selection_worker()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.canvas is None and not self.plot_pending:
+            # the window is on screen now; matplotlib loads on the next turn of the event loop
+            self.plot_pending = True
+            if startup_profile is not None:
+                startup_profile.phase("first paint")
+            QTimer.singleShot(0, self.ensure_plot)
+
+    def ensure_plot(self):
+        if not self.create_plot_widgets():
+            return
+
+        self.range_slider.valueChanged.connect(self.on_slider_change)
+        self.init_plot()
+
+        if startup_profile is not None:
+            startup_profile.phase("plot widgets")
+            startup_profile.uninstall()
+            print(startup_profile.report())
+
+    def start_prefetch_worker(self):
+        self.prefetch_thread = QThread()
+        self.prefetch_worker = TilePrefetchWorker(self.tile_cache)
+        self.prefetch_worker.moveToThread(self.prefetch_thread)
+        self.prefetch_thread.started.connect(self.prefetch_worker.run)
+        self.prefetch_worker.error.connect(lambda message: print("Error prefetching tiles:", message))
+        self.prefetch_worker.finished.connect(self.prefetch_thread.quit)
+        self.prefetch_thread.start()
+
+    def start_selection_worker(self):
+        self.selection_thread = QThread()
+        self.selection_worker = SelectionWorker()
+        self.selection_worker.moveToThread(self.selection_thread)
+        self.selection_thread.started.connect(self.selection_worker.run)
+        self.selection_worker.selected.connect(self.on_peaks_selected)
+        self.selection_worker.error.connect(lambda message: print("Error selecting peaks:", message))
+        self.selection_worker.finished.connect(self.selection_thread.quit)
+        self.selection_thread.start()
 
     def show_progress_busy(self, text):
         self.status_label.setText(text)
@@ -72,20 +179,23 @@ class SignalAnalyzer(MainWindow):
             self,
             "Open Data File",
             start_dir,
-            "Binary files (*.bin)"
+            "Signal files (*.bin *.sig)"
         )
 
         if not file_path:
             print("No file selected.")
             return
 
+        self.ensure_plot()
+        self.stop_following()
+        self.cancel_detection()
         self.file_path = file_path
         file_name = os.path.basename(file_path)
         self.file_label.setText(f"Selected file: {file_name}")
         print("Loading file:", file_path)
 
-        self.signal_1_checkbox.setEnabled(False)
-        self.signal_2_checkbox.setEnabled(False)
+        for checkbox in self.signal_checkboxes:
+            checkbox.setEnabled(False)
         self.baseline_checkbox.setEnabled(False)
         self.peaks_checkbox.setEnabled(False)
         self.water_checkbox.setEnabled(False)
@@ -100,55 +210,74 @@ class SignalAnalyzer(MainWindow):
 
         try:
 
-            if file_type == ".csv":
-
-                self.i = pd.read_csv(file_path, low_memory=True)
-                number_of_points = len(self.i)
-                self.signal_1 = self.i["adc1"].values
-                self.signal_2 = self.i["adc2"].values
-
-            elif file_type == ".bin":
-
-                number_of_samples = file_size // (2 * np.dtype(np.int16).itemsize)
-                raw_data = np.memmap(file_path, dtype=np.int16, mode="r", shape=(number_of_samples, 2))
-                self.signal_1 = raw_data[:, 0]
-                self.signal_2 = raw_data[:, 1]
-                number_of_points = len(raw_data)
-                self.i = pd.DataFrame({"adc1": self.signal_1, "adc2": self.signal_2})
-
-            else:
+            if file_type not in (".csv", ".bin", ".sig"):
                 print("This file type is not supported.")
                 return
 
+            self.retire_source()
+            self.source = SignalSource.open(file_path, DEFAULT_SAMPLING_RATE, self.bin_channels())
+            self.sampling_rate = self.source.sampling_rate
+            number_of_points = len(self.source)
+            self.set_channel_count(self.source.n_channels)
+
             print("File loaded!")
 
-            signal_time_sec = number_of_points / self.sampling_rate
+            signal_time_sec = self.source.duration
             signal_time_str = format_time(signal_time_sec)
 
             self.file_size_label.setText(f"File size: {file_size_str}")
             self.data_points_label.setText(f"Data points: {number_of_points:,}")
             self.signal_time_label.setText(f"Signal duration: {signal_time_str}")
 
-            self.plotting_end_index = len(self.i)
-            self.i = np.arange(len(self.i))
-            self.time = self.i / self.sampling_rate
+            self.plotting_end_index = number_of_points
+            self.view_span = None
+            self.signal_pyramids = None
+            self.baseline_pyramids = None
+            self.tile_cache.clear()
+            self.reset_results()
 
             self.plot_data()
 
-            self.signal_1_checkbox.setEnabled(True)
-            self.signal_2_checkbox.setEnabled(True)
+            for checkbox in self.signal_checkboxes:
+                checkbox.setEnabled(True)
+
+            save_path = None
+            if file_type in (".bin", ".sig") and self.save_lod_action.isChecked():
+                save_path = pyramid_path(file_path)
+            self.start_pyramid_worker(self.source.channels, self.on_signal_pyramids_ready, save_path)
+
+            cached = self.load_cached_results(file_path)
+            if cached is not None:
+                print("Using cached detection results.")
+                self.apply_detection_results(*cached)
+                return
 
             self.thread = QThread()
-            self.worker = PeakWorker(self.signal_1, self.signal_2)
+            profile_dir = DEFAULT_PROFILE_DIR if self.profile_action.isChecked() else None
+            n_workers = (os.cpu_count() or 1) if file_type in (".bin", ".sig") and self.parallel_action.isChecked() else 1
+            # the cache key the results belong to, whatever the menus say by the time they arrive
+            self.worker_params = self.cache_params()
+            self.worker = PeakWorker(self.source, n_workers, self.baseline_engine(), profile_dir, file_path,
+                                     self.detection_mode(), self.session_dir)
+            self.worker.set_visible_range(self.plotting_start_index, self.plotting_end_index)
             self.worker.moveToThread(self.thread)
             self.worker.progress.connect(self.on_worker_progress)
+            self.worker.metrics.connect(self.on_detection_metrics)
+            self.worker.partial.connect(self.on_partial_detection)
             self.thread.started.connect(self.worker.run)
             self.worker.finished.connect(self.on_peaks_detection_finished)
+            self.worker.cancelled.connect(self.on_peaks_detection_cancelled)
             self.worker.error.connect(self.on_peaks_detection_error)
             self.worker.finished.connect(self.thread.quit)
-            self.worker.finished.connect(self.worker.deleteLater)
+            self.worker.cancelled.connect(self.thread.quit)
+            self.worker.error.connect(self.thread.quit)
+            self.thread.finished.connect(self.worker.deleteLater)
             self.thread.finished.connect(self.thread.deleteLater)
 
+            job = (self.thread, self.worker)
+            self.thread.finished.connect(lambda: self.end_job(self.detection_jobs, job))
+            self.detection_jobs.append(job)
+
             self.update_progress(0, "Detecting peaks...")
 
             self.thread.start()
@@ -157,31 +286,359 @@ class SignalAnalyzer(MainWindow):
             print("Error loading file:", e)
             self.hide_progress("Error while loading")
 
-    def on_peaks_detection_finished(self, tumor_peaks_1, tumor_peaks_2, water_peaks_1, water_peaks_2, baseline_1, baseline_2):
-        self.s1_tumor_peaks = tumor_peaks_1
-        self.s2_tumor_peaks = tumor_peaks_2
-        self.s1_water_peaks = water_peaks_1
-        self.s2_water_peaks = water_peaks_2
-        self.baseline_1 = baseline_1
-        self.baseline_2 = baseline_2
+    def baseline_engine(self):
+        return self.baseline_engine_group.checkedAction().data()
+
+    def detection_mode(self):
+        return self.mode_group.checkedAction().data()
+
+    def bin_channels(self):
+        return self.bin_channels_group.checkedAction().data()
+
+    def cache_params(self):
+        # a headerless .bin read with another channel count is a different recording
+        return {**detection_params(baseline_engine=self.baseline_engine(), mode=self.detection_mode()),
+                "n_channels": self.source.n_channels}
+
+    def set_channel_count(self, n_channels):
+        if len(self.signal_checkboxes) == n_channels:
+            return
+
+        self.set_channel_controls(n_channels)
+        for checkbox in self.signal_checkboxes:
+            checkbox.stateChanged.connect(self.on_checkbox_toggle)
+        self.set_channel_artists(n_channels)
+
+    def reset_results(self, baseline_factory=lambda: None):
+        n_channels = self.source.n_channels if self.source is not None else len(self.signal_checkboxes)
+        self.tumor_peaks = [PeakIndex() for _ in range(n_channels)]
+        self.water_peaks = [PeakIndex() for _ in range(n_channels)]
+        self.baselines = [baseline_factory() for _ in range(n_channels)]
+        self.candidates = None
+        self.discard_result_store()
+        self.set_threshold_controls_enabled(False)
+        self.export_action.setEnabled(False)
+
+    def set_results(self, results):
+        self.tumor_peaks = [PeakIndex(tumor_peaks) for tumor_peaks, _, _ in results]
+        self.water_peaks = [PeakIndex(water_peaks) for _, water_peaks, _ in results]
+        self.baselines = [baseline for _, _, baseline in results]
+        self.tile_cache.discard("baseline")
+
+    def update_peak_counts(self):
+        for channel, (label, peaks) in enumerate(zip(self.peak_count_labels, self.tumor_peaks)):
+            label.setText(f"Signal {channel + 1} tumor peaks: {len(peaks)}")
+        self.update_coincidences()
+
+    def update_coincidences(self):
+        tolerance = int(round(self.tolerance_spin.value() / 1000 * self.sampling_rate))
+        self.coincidences = channel_coincidences(self.tumor_peaks, self.water_peaks, tolerance)
+        for channel, label in enumerate(self.coincidence_labels, start=1):
+            if channel not in self.coincidences:
+                label.setText(f"Signal 1–{channel + 1}: --")
+                continue
+            label.setText("\n".join(
+                f"Signal 1–{channel + 1} {name}: {result['matched']} pairs, "
+                f"{len(result['unmatched_a'])} / {len(result['unmatched_b'])} unmatched, "
+                f"median lag {self.format_lag(result['median_lag'])}"
+                for name, result in self.coincidences[channel].items()
+            ))
+
+    def format_lag(self, lag):
+        return "--" if np.isnan(lag) else f"{lag / self.sampling_rate * 1000:+.2f} ms"
+
+    def load_cached_results(self, file_path):
+        if not self.cache_action.isChecked():
+            return None
+
+        try:
+            arrays = self.result_cache.load(file_path, self.cache_params())
+        except OSError as e:
+            print("Error reading result cache:", e)
+            return None
+
+        if arrays is None:
+            return None
+        return arrays_to_results(arrays), CandidateStore.from_arrays(arrays)
+
+    def cancel_detection(self):
+        for _, worker in self.detection_jobs:
+            worker.cancel()
+        self.worker = None
+
+    def on_detection_metrics(self, report):
+        if self.is_current_worker():
+            self.detection_metrics = report
 
-        self.peaks_1_count_label.setText(f"Signal 1 tumor peaks: {len(tumor_peaks_1)}")
-        self.peaks_2_count_label.setText(f"Signal 2 tumor peaks: {len(tumor_peaks_2)}")
+    def is_current_worker(self):
+        # a cancelled run of the same file can still have signals queued after its replacement started
+        return self.worker is not None and self.sender() is self.worker
+
+    def on_partial_detection(self, file_path, results):
+        if not self.is_current_worker():
+            return
+
+        self.set_results(results)
+        self.update_peak_counts()
+        self.peaks_checkbox.setEnabled(True)
+        self.water_checkbox.setEnabled(True)
+        self.baseline_checkbox.setEnabled(True)
+
+        self.plot_current_range()
+
+    def on_peaks_detection_cancelled(self, file_path):
+        print("Stopped peak detection for:", file_path)
+
+    def on_peaks_detection_finished(self, file_path, store):
+        if not self.is_current_worker():
+            store.remove()
+            return
+        self.worker = None
+
+        if self.cache_action.isChecked():
+            try:
+                self.result_cache.store(self.file_path, self.worker_params, store.arrays)
+            except OSError as e:
+                print("Error writing result cache:", e)
+
+        # the previous store's maps are only dropped once its results are replaced
+        previous, self.result_store = self.result_store, store
+        self.apply_detection_results(store.results(), store.candidates())
+        if previous is not None:
+            previous.remove()
+
+    def discard_result_store(self):
+        # callers drop the peaks, baselines and candidates mapped from it first
+        if self.result_store is not None:
+            self.result_store.remove()
+            self.result_store = None
+
+    def apply_detection_results(self, results, candidates=None):
+        self.set_results(results)
+        self.candidates = candidates
+        self.set_threshold_controls_enabled(bool(candidates))
+        if candidates and self.threshold_values() != peak_params():
+            self.set_selected_peaks(candidates.select_all(self.threshold_values()))
+        self.start_pyramid_worker(self.baselines, self.on_baseline_pyramids_ready)
+        self.update_peak_counts()
 
         self.plot_current_range()
 
         self.peaks_checkbox.setEnabled(True)
         self.water_checkbox.setEnabled(True)
         self.baseline_checkbox.setEnabled(True)
+        self.export_action.setEnabled(self.export_worker is None)
 
         self.hide_progress("Peaks are ready")
 
+    def schedule_peak_selection(self, _):
+        if self.candidates:
+            self.selection_timer.start()
+
+    def set_selected_peaks(self, selected):
+        self.tumor_peaks = [PeakIndex(tumor_peaks) for tumor_peaks, _ in selected]
+        self.water_peaks = [PeakIndex(water_peaks) for _, water_peaks in selected]
+
+    def apply_peak_selection(self):
+        if not self.candidates:
+            return
+        self.selection_worker.request(self.candidates, self.threshold_values())
+
+    def on_peaks_selected(self, candidates, params, selected):
+        # a newer file or newer thresholds have their own request on the way
+        if candidates is not self.candidates or params != self.threshold_values():
+            return
+        self.set_selected_peaks(selected)
+        self.update_peak_counts()
+        self.plot_current_range()
+
+    def reset_thresholds(self):
+        self.set_threshold_values(peak_params())
+        self.apply_peak_selection()
+
+    def start_pyramid_worker(self, signals, on_ready, save_path=None):
+        thread = QThread()
+        worker = PyramidWorker(self.file_path, signals, save_path)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.finished.connect(on_ready)
+        worker.error.connect(self.on_pyramid_error)
+        worker.finished.connect(thread.quit)
+        worker.error.connect(thread.quit)
+        worker.finished.connect(worker.deleteLater)
+        thread.finished.connect(thread.deleteLater)
+
+        job = (thread, worker)
+        thread.finished.connect(lambda: self.end_job(self.pyramid_jobs, job))
+        self.pyramid_jobs.append(job)
+        thread.start()
+
+    def end_job(self, jobs, job):
+        jobs.remove(job)
+        self.close_retired_sources()
+
+    def retire_source(self):
+        # workers of the replaced file may still be reading it, so it is closed once they are done
+        if self.source is not None:
+            self.retired_sources.append(self.source)
+            self.source = None
+        self.close_retired_sources()
+
+    def close_retired_sources(self, force=False):
+        if not force and (self.detection_jobs or self.pyramid_jobs or self.export_worker is not None):
+            return
+        for source in self.retired_sources:
+            source.close()
+        self.retired_sources = []
+
+    def on_signal_pyramids_ready(self, file_path, pyramids):
+        if file_path != self.file_path:
+            return
+        self.signal_pyramids = pyramids
+        self.plot_current_range()
+
+    def on_baseline_pyramids_ready(self, file_path, pyramids):
+        if file_path != self.file_path:
+            return
+        self.baseline_pyramids = pyramids
+        self.plot_current_range()
+
+    def on_pyramid_error(self, message):
+        print("Error building zoom levels:", message)
+
     def on_peaks_detection_error(self, message):
         print("Error detecting peaks:", message)
+        if not self.is_current_worker():
+            return
+        self.worker = None
         self.hide_progress("Error during peak detection")
 
+    def is_following(self):
+        return self.stream_worker is not None
+
+    def on_follow_toggled(self, checked):
+        if not checked:
+            self.stop_following()
+            return
+
+        start_dir = os.path.expanduser("~/Documents")
+        file_path, _ = QFileDialog.getOpenFileName(self, "Follow Data File", start_dir, "Binary files (*.bin)")
+
+        if not file_path:
+            print("No file selected.")
+            self.follow_action.setChecked(False)
+            return
+
+        self.ensure_plot()
+        self.stop_following()
+        self.file_path = file_path
+        self.file_label.setText(f"Following file: {os.path.basename(file_path)}")
+        print("Following file:", file_path)
+
+        self.retire_source()
+        self.view_span = None
+        self.signal_pyramids = None
+        self.baseline_pyramids = None
+        self.set_channel_count(self.bin_channels())
+        self.tile_cache.clear()
+        self.reset_results(lambda: PiecewiseBaseline([], [], 0))
+        self.range_slider.setEnabled(False)
+        self.range_button.setEnabled(False)
+        self.show_progress_busy("Waiting for data...")
+
+        self.stream_thread = QThread()
+        self.stream_worker = StreamWorker(file_path, self.bin_channels(), self.baseline_engine())
+        self.stream_worker.moveToThread(self.stream_thread)
+        self.stream_thread.started.connect(self.stream_worker.run)
+        self.stream_worker.update.connect(self.on_stream_update)
+        self.stream_worker.error.connect(self.on_stream_error)
+        self.stream_worker.finished.connect(self.stream_thread.quit)
+        self.stream_worker.finished.connect(self.stream_worker.deleteLater)
+        self.stream_thread.finished.connect(self.stream_thread.deleteLater)
+        self.stream_thread.start()
+
+    def stop_following(self):
+        if self.stream_worker is None:
+            return
+
+        self.stream_worker.stop()
+        self.stream_thread.quit()
+        self.stream_thread.wait()
+        self.stream_worker = None
+        self.stream_thread = None
+        self.follow_action.setChecked(False)
+        self.range_slider.setEnabled(True)
+        self.range_button.setEnabled(True)
+        self.hide_progress("Stopped following")
+
+    def on_stream_update(self, file_path, length, results):
+        if file_path != self.file_path:
+            return
+
+        self.source = SignalSource.from_bin(file_path, self.sampling_rate, len(results), length=length)
+
+        for channel, (tumor_peaks, water_peaks, breakpoints, values, end) in enumerate(results):
+            self.tumor_peaks[channel].extend(tumor_peaks)
+            self.water_peaks[channel].extend(water_peaks)
+            self.baselines[channel].append(breakpoints, values, end)
+        self.tile_cache.discard("baseline")
+
+        self.file_size_label.setText(f"File size: {format_size(os.path.getsize(self.file_path))}")
+        self.data_points_label.setText(f"Data points: {length:,}")
+        self.signal_time_label.setText(f"Signal duration: {format_time(self.source.duration)}")
+        self.update_peak_counts()
+
+        for checkbox in self.signal_checkboxes + [self.baseline_checkbox, self.peaks_checkbox, self.water_checkbox]:
+            checkbox.setEnabled(True)
+        self.export_action.setEnabled(self.export_worker is None)
+
+        self.plotting_start_index = max(0, length - self.stream_window)
+        self.plotting_end_index = length
+        if self.is_following():
+            self.status_label.setText("Following file...")
+            self.progress_bar.hide()
+        self.plot_current_range()
+
+    def on_stream_error(self, message):
+        print("Error following file:", message)
+        self.stop_following()
+        self.hide_progress("Error while following")
+
+    def closeEvent(self, event):
+        self.prefetch_worker.stop()
+        self.prefetch_thread.quit()
+        self.prefetch_thread.wait()
+        self.selection_worker.stop()
+        self.selection_thread.quit()
+        self.selection_thread.wait()
+        self.stop_following()
+        self.cancel_detection()
+        for thread, _ in list(self.detection_jobs):
+            thread.quit()
+            thread.wait()
+        for thread, _ in list(self.pyramid_jobs):
+            thread.quit()
+            thread.wait()
+        if self.convert_worker is not None:
+            self.convert_worker.cancel()
+            self.convert_thread.quit()
+            self.convert_thread.wait()
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+            self.export_thread.quit()
+            self.export_thread.wait()
+        # nothing may still map the session's result files when they are deleted
+        self.reset_results()
+        self.retire_source()
+        self.close_retired_sources(force=True)
+        try:
+            shutil.rmtree(self.session_dir)
+        except OSError as e:
+            print("Could not remove session files:", e)
+        super().closeEvent(event)
+
     def convert_file_to_bin(self):
-        self.show_progress_busy("Converting to .bin...")
+        self.show_progress_busy("Converting...")
 
         start_dir = os.path.expanduser("~/Documents")
         file_path, _ = QFileDialog.getOpenFileName(self,"Select a file", start_dir,"All files (*)")
@@ -193,131 +650,383 @@ class SignalAnalyzer(MainWindow):
 
         save_path, _ = QFileDialog.getSaveFileName(
             self,
-            "Save as .bin",
-            os.path.splitext(file_path)[0] + ".bin",
-            "Binary files (*.bin)"
+            "Save as",
+            os.path.splitext(file_path)[0] + (".sig" if file_path.lower().endswith(".bin") else ".bin"),
+            "Chunked signal files (*.sig);;Binary files (*.bin)" if file_path.lower().endswith(".bin")
+            else "Binary files (*.bin);;Chunked signal files (*.sig)"
         )
         if not save_path:
             print("Save cancelled.")
             self.hide_progress("Conversion cancelled")
             return
 
-        try:
-            saved_file = csv_to_bin(file_path, save_path)
-            print(f"File converted and saved to: {saved_file}")
-            self.hide_progress("Conversion finished")
-        except Exception as e:
-            print("Error converting file:", e)
-            self.hide_progress("Conversion error")
+        self.update_progress(0, "Converting...")
+        self.convert_action.setEnabled(False)
+        self.cancel_button.show()
+
+        self.convert_thread = QThread()
+        self.convert_worker = ConvertWorker(file_path, save_path, self.bin_channels())
+        self.convert_worker.moveToThread(self.convert_thread)
+        self.convert_worker.progress.connect(self.on_worker_progress)
+        self.convert_thread.started.connect(self.convert_worker.run)
+        self.convert_worker.finished.connect(self.on_conversion_finished)
+        self.convert_worker.cancelled.connect(self.on_conversion_cancelled)
+        self.convert_worker.error.connect(self.on_conversion_error)
+        for signal in (self.convert_worker.finished, self.convert_worker.cancelled, self.convert_worker.error):
+            signal.connect(self.convert_thread.quit)
+            signal.connect(self.convert_worker.deleteLater)
+        self.convert_thread.finished.connect(self.convert_thread.deleteLater)
+        self.convert_thread.start()
+
+    def end_conversion(self, final_text):
+        self.convert_worker = None
+        self.convert_action.setEnabled(True)
+        self.cancel_button.hide()
+        self.hide_progress(final_text)
+
+    def on_conversion_finished(self, saved_file):
+        print(f"File converted and saved to: {saved_file}")
+        self.end_conversion("Conversion finished")
+
+    def on_conversion_cancelled(self):
+        print("Conversion cancelled.")
+        self.end_conversion("Conversion cancelled")
+
+    def on_conversion_error(self, message):
+        print("Error converting file:", message)
+        self.end_conversion("Conversion error")
+
+    def export_peaks(self):
+        if self.source is None or self.worker is not None:
+            return
+
+        # only the formats whose writer can be imported here
+        filters = {name: extension for name, extension in (("Parquet (*.parquet)", ".parquet"), ("HDF5 (*.h5)", ".h5"),
+                                                           ("NumPy archive (*.npz)", ".npz"), ("CSV (*.csv)", ".csv"))
+                   if export_available(EXPORT_FORMATS[extension])}
+        default_extension = next(iter(filters.values()))
+        save_path, selected_filter = QFileDialog.getSaveFileName(
+            self,
+            "Export peaks",
+            os.path.splitext(self.file_path)[0] + ".peaks" + default_extension,
+            ";;".join(filters)
+        )
+        if not save_path:
+            print("Export cancelled.")
+            return
+        if os.path.splitext(save_path)[1].lower() not in EXPORT_FORMATS:
+            save_path += filters.get(selected_filter, default_extension)
+
+        self.update_progress(0, "Exporting peaks...")
+        self.progress_bar.show()
+        self.export_action.setEnabled(False)
+        self.cancel_button.show()
+
+        # the table is a snapshot: re-selection or streaming after this point does not change the file
+        baselines = [PiecewiseBaseline(baseline.breakpoints, baseline.values, len(baseline)) for baseline in self.baselines]
+        self.export_thread = QThread()
+        self.export_worker = ExportWorker(save_path, self.source, [peaks.peaks for peaks in self.tumor_peaks],
+                                          [peaks.peaks for peaks in self.water_peaks], baselines, self.candidates)
+        self.export_worker.moveToThread(self.export_thread)
+        self.export_worker.progress.connect(self.on_worker_progress)
+        self.export_thread.started.connect(self.export_worker.run)
+        self.export_worker.finished.connect(self.on_export_finished)
+        self.export_worker.cancelled.connect(self.on_export_cancelled)
+        self.export_worker.error.connect(self.on_export_error)
+        for signal in (self.export_worker.finished, self.export_worker.cancelled, self.export_worker.error):
+            signal.connect(self.export_thread.quit)
+            signal.connect(self.export_worker.deleteLater)
+        self.export_thread.finished.connect(self.export_thread.deleteLater)
+        self.export_thread.start()
+
+    def end_export(self, final_text):
+        self.export_worker = None
+        self.close_retired_sources()
+        self.export_action.setEnabled(self.source is not None and self.worker is None)
+        self.cancel_button.hide()
+        self.hide_progress(final_text)
+
+    def on_export_finished(self, save_path, rows):
+        print(f"Exported {rows:,} peaks to: {save_path}")
+        self.end_export("Export finished")
+
+    def on_export_cancelled(self):
+        print("Export cancelled.")
+        self.end_export("Export cancelled")
+
+    def on_export_error(self, message):
+        print("Error exporting peaks:", message)
+        self.end_export("Export error")
+
+    def on_cancel_clicked(self):
+        if self.convert_worker is not None:
+            self.convert_worker.cancel()
+        if self.export_worker is not None:
+            self.export_worker.cancel()
 
 
     def get_plotting_range(self):
         start = self.plotting_start_index
         end = self.plotting_end_index
-        x_range = self.i[start:end]
-        y1_range = self.signal_1[start:end]
-        y2_range = self.signal_2[start:end]
-        return x_range, y1_range, y2_range, start, end
+        # channels are sliced lazily by the plot, a chunked source would decode the whole range here
+        return self.source.channels, start, end
 
     def plot_current_range(self):
         self.plot_signals(*self.get_plotting_range())
 
     def plot_data(self):
-        if self.i is None:
+        if self.source is None:
             print("Load a data file first before plotting")
             return
 
         self.plot_current_range()
 
-    def plot_signals(self, row_indexes, signal_1, signal_2, plotting_start_index, plotting_end_index):
-        self.figure.clear()
-        ax = self.figure.add_subplot(111)
-
-        if self.signal_1_checkbox.isChecked() and signal_1 is not None:
-            time_range = self.time[plotting_start_index:plotting_end_index]
-            x_down, y_down = minmax_downsample(time_range, signal_1, canvas_width=self.canvas.width())
-            ax.plot(x_down, y_down, color="cornflowerblue", label='Signal 1', linewidth=0.8)
-
-            if self.baseline_checkbox.isChecked() and self.baseline_1 is not None:
-                baseline_range = self.baseline_1[plotting_start_index:plotting_end_index]
-                time_range = self.time[plotting_start_index:plotting_end_index]
-                x_down_b, y_down_b = minmax_downsample(time_range, baseline_range, canvas_width=self.canvas.width())
-                ax.plot(x_down_b, y_down_b, color='black', linewidth=1.5)
-
-            if self.peaks_checkbox.isChecked():
-                tumor_peaks_in_range = self.s1_tumor_peaks[(self.s1_tumor_peaks >= plotting_start_index) & (self.s1_tumor_peaks < plotting_end_index)]
-                if len(tumor_peaks_in_range) > 0:
-                    ax.plot(self.time[tumor_peaks_in_range], self.signal_1[tumor_peaks_in_range], color='red', marker='o', linestyle='None', label="Signal 1 tumor peaks")
-
-            if self.water_checkbox.isChecked():
-                water_peaks_in_range = self.s1_water_peaks[(self.s1_water_peaks >= plotting_start_index) & (self.s1_water_peaks < plotting_end_index)]
-                if len(water_peaks_in_range) > 0:
-                    ax.plot(self.time[water_peaks_in_range], self.signal_1[water_peaks_in_range], color='blue', marker='v', linestyle='None')
-
-        if self.signal_2_checkbox.isChecked() and signal_2 is not None:
-            time_range = self.time[plotting_start_index:plotting_end_index]
-            x_down, y_down = minmax_downsample(time_range, signal_2, canvas_width=self.canvas.width())
-            ax.plot(x_down, y_down, color="orange", label='Signal 2', linewidth=0.8, alpha=0.9)
-
-            if self.baseline_checkbox.isChecked() and self.baseline_2 is not None:
-                baseline_range = self.baseline_2[plotting_start_index:plotting_end_index]
-                time_range = self.time[plotting_start_index:plotting_end_index]
-                x_down_b, y_down_b = minmax_downsample(time_range, baseline_range, canvas_width=self.canvas.width())
-                ax.plot(x_down_b, y_down_b, color='black', linewidth=1.5, label='Baseline')
-
-            if self.peaks_checkbox.isChecked():
-                tumor_peaks_in_range = self.s2_tumor_peaks[
-                    (self.s2_tumor_peaks >= plotting_start_index) & (self.s2_tumor_peaks < plotting_end_index)]
-                if len(tumor_peaks_in_range) > 0:
-                    ax.plot(self.time[tumor_peaks_in_range], self.signal_2[tumor_peaks_in_range], color='green', marker='o', linestyle='None',
-                            label="Signal 2 tumor peaks")
-
-            if self.water_checkbox.isChecked():
-                water_peaks_in_range = self.s2_water_peaks[
-                    (self.s2_water_peaks >= plotting_start_index) & (self.s2_water_peaks < plotting_end_index)]
-                if len(water_peaks_in_range) > 0:
-                    ax.plot(self.time[water_peaks_in_range], self.signal_2[water_peaks_in_range], color='blue', marker='v', linestyle='None',
-                            label="Water")
-
-        ax.set_title("Signal data")
-        ax.set_xlabel("Time (seconds)")
-        ax.set_ylabel("Response")
-        ax.legend()
-
-        self.canvas.draw()
+    def downsample_range(self, kind, pyramids, channel, y, plotting_start_index, plotting_end_index):
+        canvas_width = self.canvas.width()
+
+        pyramid = pyramids[channel] if pyramids is not None else None
+        result = self.tile_cache.query(kind, channel, y, pyramid, plotting_start_index, plotting_end_index, canvas_width)
+        if result is not None:
+            x_down, y_down = result
+            return self.source.time_at(x_down - plotting_start_index), y_down
+
+        y_range = y[plotting_start_index:plotting_end_index]
+        time_range = self.source.time_range(0, len(y_range))
+        return minmax_downsample(time_range, y_range, canvas_width=canvas_width)
+
+    def init_plot(self):
+        self.ax = self.figure.add_subplot(111)
+        self.ax.set_title("Signal data")
+        self.ax.set_xlabel("Time (seconds)")
+        self.ax.set_ylabel("Response")
+
+        self.plot_artists = []
+        self.plot_background = None
+        self.legends = {}
+        self.legend_pixels = {}
+        self.legend_handles = None
+        # x is time since the view start, so a pan keeps the axes and only this offset changes
+        self.x_offset = 0.0
+        self.offset_text = self.ax.annotate("", xy=(1, 0), xycoords="axes fraction", xytext=(0, -20),
+                                            textcoords="offset points", ha="right", va="top", animated=True)
+        self.ax.fmt_xdata = lambda x: self.ax.xaxis.get_major_formatter().format_data_short(x + self.x_offset)
+        self.set_channel_artists(len(self.signal_checkboxes))
+        self.canvas.mpl_connect("draw_event", self.on_canvas_draw)
+
+    def set_channel_artists(self, n_channels):
+        for artist in self.plot_artists:
+            artist.remove()
+
+        def line(**style):
+            # animated artists are left out of full draws and blitted on top of the cached background
+            return self.ax.plot([], [], animated=True, **style)[0]
+
+        self.signal_lines = [
+            line(color=SIGNAL_COLORS[channel % len(SIGNAL_COLORS)], label=f"Signal {channel + 1}", linewidth=0.8,
+                 alpha=0.9 if channel else 1.0)
+            for channel in range(n_channels)
+        ]
+        self.baseline_lines = [line(color="black", linewidth=1.5, label="Baseline") for _ in range(n_channels)]
+        self.tumor_markers = [
+            line(color=PEAK_COLORS[channel % len(PEAK_COLORS)], marker="o", linestyle="None",
+                 label=f"Signal {channel + 1} tumor peaks")
+            for channel in range(n_channels)
+        ]
+        self.water_markers = [line(color="blue", marker="v", linestyle="None", label="Water") for _ in range(n_channels)]
+        self.plot_artists = self.signal_lines + self.baseline_lines + self.tumor_markers + self.water_markers
+        for legend in self.legends.values():
+            legend.remove()
+        self.legends = {}
+        self.legend_pixels = {}
+        self.legend_handles = None
+
+    def on_canvas_draw(self, _):
+        self.plot_background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.legend_pixels = {}
+        self.draw_plot_artists()
+
+    def draw_plot_artists(self):
+        for artist in self.plot_artists + [self.offset_text]:
+            if artist.get_visible():
+                self.ax.draw_artist(artist)
+
+        for legend in self.legends.values():
+            if not legend.get_visible():
+                continue
+            # laying out the legend text costs more than the lines, so it is rendered once per full draw
+            pixels = self.legend_pixels.get(legend)
+            if pixels is None:
+                self.ax.draw_artist(legend)
+                self.legend_pixels[legend] = self.canvas.copy_from_bbox(legend.get_window_extent())
+            else:
+                self.canvas.restore_region(pixels)
+
+    def schedule_plot(self):
+        self.plot_timer.start()
+
+    def set_peak_markers(self, markers, peaks, signal, visible, plotting_start_index, plotting_end_index):
+        markers.set_visible(visible)
+        if not visible:
+            return
+
+        peaks_in_range = peaks.decimate(plotting_start_index, plotting_end_index, self.canvas.width())
+        markers.set_data(self.source.time_at(peaks_in_range - plotting_start_index), signal[peaks_in_range])
+
+    def prefetch_tiles(self, start, end):
+        previous = self.last_view
+        self.last_view = (start, end)
+
+        # a pan keeps the span, anything else is a zoom and gets neighbours on both sides
+        direction = 0
+        if previous is not None and end - start == previous[1] - previous[0] and start != previous[0]:
+            direction = 1 if start > previous[0] else -1
+
+        sources = []
+        for channel, (signal, checkbox, baseline) in enumerate(zip(self.source.channels, self.signal_checkboxes, self.baselines)):
+            if not checkbox.isChecked():
+                continue
+            sources.append(("signal", channel, signal, self.signal_pyramids))
+            if self.baseline_checkbox.isChecked() and baseline is not None:
+                sources.append(("baseline", channel, baseline, self.baseline_pyramids))
+
+        jobs = []
+        for level, index in self.tile_cache.plan(start, end, len(self.source), self.canvas.width(), direction):
+            for kind, channel, data, pyramids in sources:
+                pyramid = pyramids[channel] if pyramids is not None else None
+                jobs.append((kind, channel, data, pyramid, level, index, self.tile_cache.generation(kind)))
+        self.prefetch_worker.request(jobs)
+
+    def plot_signals(self, signals, plotting_start_index, plotting_end_index):
+        self.plot_timer.stop()
+
+        channels = zip(signals, self.signal_checkboxes, self.baselines, self.tumor_peaks, self.water_peaks)
+        for channel, (signal, checkbox, baseline, tumor_peaks, water_peaks) in enumerate(channels):
+            shown = checkbox.isChecked() and signal is not None
+
+            self.signal_lines[channel].set_visible(shown)
+            if shown:
+                self.signal_lines[channel].set_data(
+                    *self.downsample_range("signal", self.signal_pyramids, channel, signal, plotting_start_index,
+                                           plotting_end_index))
+
+            baseline_shown = shown and self.baseline_checkbox.isChecked() and baseline is not None
+            self.baseline_lines[channel].set_visible(baseline_shown)
+            if baseline_shown:
+                self.baseline_lines[channel].set_data(
+                    *self.downsample_range("baseline", self.baseline_pyramids, channel, baseline, plotting_start_index,
+                                           plotting_end_index))
+
+            self.set_peak_markers(self.tumor_markers[channel], tumor_peaks, signal, shown and self.peaks_checkbox.isChecked(),
+                                  plotting_start_index, plotting_end_index)
+            self.set_peak_markers(self.water_markers[channel], water_peaks, signal, shown and self.water_checkbox.isChecked(),
+                                  plotting_start_index, plotting_end_index)
+
+        self.prefetch_tiles(plotting_start_index, plotting_end_index)
+
+        self.x_offset = float(self.source.time_at(plotting_start_index))
+        self.offset_text.set_text(f"+{self.x_offset:.6g} s")
+        self.offset_text.set_visible(self.x_offset > 0)
+        self.set_legend()
+
+        # the axes only change on a zoom or when the data leaves them, everything else is blitted
+        span = plotting_end_index - plotting_start_index
+        limits = ((0.0, float(self.source.time_at(span))), self.fit_y_limits(span != self.view_span))
+        self.view_span = span
+        if self.plot_background is None or limits != (self.ax.get_xlim(), self.ax.get_ylim()):
+            self.ax.set_xlim(limits[0])
+            self.ax.set_ylim(limits[1])
+            self.canvas.draw_idle()
+            return
+
+        self.canvas.restore_region(self.plot_background)
+        self.draw_plot_artists()
+        self.canvas.blit(self.figure.bbox)
+
+    def fit_y_limits(self, refit):
+        lows = []
+        highs = []
+        for line in self.signal_lines + self.baseline_lines:
+            y = line.get_ydata()
+            if line.get_visible() and len(y):
+                lows.append(np.min(y))
+                highs.append(np.max(y))
+
+        limits = self.ax.get_ylim()
+        if not lows:
+            return limits
+        low = float(min(lows))
+        high = float(max(highs))
+        margin = Y_MARGIN
+        if not refit:
+            if limits[0] <= low and high <= limits[1]:
+                return limits
+            # a pan that leaves the limits widens them with room to spare, so the next pans stay inside
+            low = min(low, limits[0])
+            high = max(high, limits[1])
+            margin = Y_PAN_MARGIN
+        pad = (high - low) * margin or 1.0
+        return low - pad, high + pad
+
+    def set_legend(self):
+        handles = {}
+        for artist in self.plot_artists:
+            if artist.get_visible():
+                handles.setdefault(artist.get_label(), artist)
+        handles = tuple(handles.values())
+        if handles == self.legend_handles:
+            return
+
+        self.legend_handles = handles
+        if handles and handles not in self.legends:
+            # opaque, so its cached pixels do not depend on the lines drawn under it
+            legend = self.ax.legend(handles=list(handles), loc="upper right", framealpha=1)
+            legend.set_animated(True)
+            self.legends[handles] = legend
+        for key, legend in self.legends.items():
+            legend.set_visible(key == handles)
 
     def on_slider_change(self, values):
         start, end = values
         self.slider_label.setText(f"Range: {start}% – {end}%")
 
-        if self.i is not None:
-            total_data_points = len(self.i)
+        if self.source is not None and not self.is_following():
+            total_data_points = len(self.source)
             self.plotting_start_index = int(start / 100 * total_data_points)
             self.plotting_end_index = int(end / 100 * total_data_points)
+            if self.worker is not None:
+                self.worker.set_visible_range(self.plotting_start_index, self.plotting_end_index)
             if self.plotting_start_index < self.plotting_end_index:
-                self.plot_current_range()
+                self.schedule_plot()
 
     def reset_slider_range(self):
-        if self.i is None:
+        if self.source is None or self.is_following():
             return
 
         self.range_slider.setValue((0, 100))
         self.slider_label.setText("Range: 0% – 100%")
         self.plotting_start_index = 0
-        self.plotting_end_index = len(self.i)
+        self.plotting_end_index = len(self.source)
         self.plot_current_range()
 
     def on_checkbox_toggle(self, _):
-        if self.i is not None:
-            self.plot_current_range()
+        if self.source is not None:
+            self.schedule_plot()
 
 
 if __name__ == "__main__":
+    if startup_profile is not None:
+        startup_profile.phase("imports")
     app = QApplication(sys.argv)
 
     with open("style.qss", "r") as file:
         app.setStyleSheet(file.read())
+    if startup_profile is not None:
+        startup_profile.phase("application")
 
     window = SignalAnalyzer()
+    if startup_profile is not None:
+        startup_profile.phase("main window")
     window.show()
+    if startup_profile is not None:
+        startup_profile.phase("show")
     sys.exit(app.exec())
\ No newline at end of file
@@ -1,15 +1,11 @@
 from PySide6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel,
-    QPushButton, QCheckBox, QMenuBar, QMenu, QFrame, QProgressBar
+    QPushButton, QCheckBox, QMenuBar, QMenu, QFrame, QProgressBar, QFormLayout, QSpinBox, QDoubleSpinBox
 )
-from matplotlib.backends.backend_qt5agg import (
-    FigureCanvasQTAgg as FigureCanvas,
-    NavigationToolbar2QT as NavigationToolbar
-)
-from matplotlib.figure import Figure
-from qtpy.QtCore import Qt
-from superqt import QRangeSlider
-from PySide6.QtGui import QIcon
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QIcon, QActionGroup
+from detection import CANDIDATE_HEIGHT_SD, peak_params
+from coincidence import COINCIDENCE_TOLERANCE
 
 
 class MainWindow(QMainWindow):
@@ -26,9 +22,69 @@ class MainWindow(QMainWindow):
         self.menu_bar.addMenu(self.file_menu)
 
         self.open_action = self.file_menu.addAction("Open file")
+        self.follow_action = self.file_menu.addAction("Follow a growing .bin file")
+        self.follow_action.setCheckable(True)
         self.convert_action = self.file_menu.addAction("Convert a file to .bin format")
+        self.export_action = self.file_menu.addAction("Export peaks")
+        self.export_action.setEnabled(False)
+        self.save_lod_action = self.file_menu.addAction("Save zoom levels next to .bin files")
+        self.save_lod_action.setCheckable(True)
+        self.save_lod_action.setChecked(True)
+
+        self.bin_channels_menu = self.file_menu.addMenu("Channels in .bin files")
+        self.bin_channels_group = QActionGroup(self)
+        self.bin_channels_actions = {}
+        for n_channels in range(1, 9):
+            action = self.bin_channels_menu.addAction(str(n_channels))
+            action.setCheckable(True)
+            action.setData(n_channels)
+            self.bin_channels_group.addAction(action)
+            self.bin_channels_actions[n_channels] = action
+        self.bin_channels_actions[2].setChecked(True)
+
         self.exit_action = self.file_menu.addAction("Exit")
 
+        self.detection_menu = QMenu("Detection", self)
+        self.menu_bar.addMenu(self.detection_menu)
+
+        self.parallel_action = self.detection_menu.addAction("Use all CPU cores for .bin files")
+        self.parallel_action.setCheckable(True)
+        self.parallel_action.setChecked(True)
+
+        self.cache_action = self.detection_menu.addAction("Reuse cached detection results")
+        self.cache_action.setCheckable(True)
+        self.cache_action.setChecked(True)
+
+        self.clear_cache_action = self.detection_menu.addAction("Clear result cache")
+
+        self.profile_action = self.detection_menu.addAction("Save detection profiles")
+        self.profile_action.setCheckable(True)
+
+        self.baseline_menu = self.detection_menu.addMenu("Baseline engine")
+        self.baseline_engine_group = QActionGroup(self)
+        self.baseline_engine_actions = {}
+        for engine, label in (("percentile", "Percentile (sort)"),
+                              ("histogram", "Histogram (fast, identical)"),
+                              ("rolling", "Rolling histogram")):
+            action = self.baseline_menu.addAction(label)
+            action.setCheckable(True)
+            action.setData(engine)
+            self.baseline_engine_group.addAction(action)
+            self.baseline_engine_actions[engine] = action
+        self.baseline_engine_actions["histogram"].setChecked(True)
+
+        self.mode_menu = self.detection_menu.addMenu("Detection mode")
+        self.mode_group = QActionGroup(self)
+        self.mode_actions = {}
+        for mode, label in (("sections", "Sections (extended windows)"),
+                            ("whole", "Whole signal (rolling baseline)")):
+            action = self.mode_menu.addAction(label)
+            action.setCheckable(True)
+            action.setData(mode)
+            self.mode_group.addAction(action)
+            self.mode_actions[mode] = action
+        self.mode_actions["sections"].setChecked(True)
+
         main_layout = QHBoxLayout()
         container = QWidget()
         container.setLayout(main_layout)
@@ -64,11 +120,88 @@ class MainWindow(QMainWindow):
         peaks_title.setProperty("role", "title")
         left_panel.addWidget(peaks_title)
 
-        self.peaks_1_count_label = QLabel("Signal 1 tumor peaks: --")
-        left_panel.addWidget(self.peaks_1_count_label)
+        self.peak_count_layout = QVBoxLayout()
+        self.peak_count_labels = []
+        left_panel.addLayout(self.peak_count_layout)
+
+        line = QFrame()
+        line.setFrameShape(QFrame.HLine)
+        line.setFrameShadow(QFrame.Sunken)
+        line.setStyleSheet("margin: 6px 0;")
+        left_panel.addWidget(line)
+
+        coincidences_title = QLabel("Coincidences")
+        coincidences_title.setProperty("role", "title")
+        left_panel.addWidget(coincidences_title)
+
+        self.tolerance_spin = QDoubleSpinBox()
+        self.tolerance_spin.setRange(0.02, 1000.0)
+        self.tolerance_spin.setSingleStep(0.5)
+        self.tolerance_spin.setSuffix(" ms")
+        self.tolerance_spin.setValue(COINCIDENCE_TOLERANCE * 1000)
+
+        tolerance_form = QFormLayout()
+        tolerance_form.addRow("Tolerance", self.tolerance_spin)
+        left_panel.addLayout(tolerance_form)
 
-        self.peaks_2_count_label = QLabel("Signal 2 tumor peaks: --")
-        left_panel.addWidget(self.peaks_2_count_label)
+        self.coincidence_layout = QVBoxLayout()
+        self.coincidence_labels = []
+        left_panel.addLayout(self.coincidence_layout)
+
+        line = QFrame()
+        line.setFrameShape(QFrame.HLine)
+        line.setFrameShadow(QFrame.Sunken)
+        line.setStyleSheet("margin: 6px 0;")
+        left_panel.addWidget(line)
+
+        thresholds_title = QLabel("Peak thresholds")
+        thresholds_title.setProperty("role", "title")
+        left_panel.addWidget(thresholds_title)
+
+        self.height_spin = QDoubleSpinBox()
+        self.height_spin.setRange(CANDIDATE_HEIGHT_SD, 50.0)
+        self.height_spin.setSingleStep(0.1)
+        self.height_spin.setSuffix(" SD")
+
+        self.distance_spin = QSpinBox()
+        self.distance_spin.setRange(1, 10_000_000)
+        self.distance_spin.setSingleStep(1000)
+        self.distance_spin.setSuffix(" samples")
+
+        self.prominence_spin = QDoubleSpinBox()
+        self.prominence_spin.setRange(0.0, 100_000.0)
+        self.prominence_spin.setSingleStep(5.0)
+
+        self.water_dip_spin = QDoubleSpinBox()
+        self.water_dip_spin.setRange(0.0, 50.0)
+        self.water_dip_spin.setSingleStep(0.5)
+        self.water_dip_spin.setSuffix(" SD")
+
+        self.water_height_spin = QDoubleSpinBox()
+        self.water_height_spin.setRange(0.0, 100.0)
+        self.water_height_spin.setSingleStep(0.5)
+        self.water_height_spin.setSuffix(" SD")
+
+        self.threshold_spins = {
+            "height_sd": self.height_spin,
+            "distance": self.distance_spin,
+            "prominence": self.prominence_spin,
+            "water_dip_sd": self.water_dip_spin,
+            "water_height_sd": self.water_height_spin,
+        }
+        self.set_threshold_values(peak_params())
+
+        threshold_form = QFormLayout()
+        threshold_form.addRow("Height above baseline", self.height_spin)
+        threshold_form.addRow("Min distance", self.distance_spin)
+        threshold_form.addRow("Min prominence", self.prominence_spin)
+        threshold_form.addRow("Water dip below baseline", self.water_dip_spin)
+        threshold_form.addRow("Water max height", self.water_height_spin)
+        left_panel.addLayout(threshold_form)
+
+        self.thresholds_button = QPushButton("Reset thresholds")
+        left_panel.addWidget(self.thresholds_button)
+        self.set_threshold_controls_enabled(False)
 
         line = QFrame()
         line.setFrameShape(QFrame.HLine)
@@ -95,15 +228,10 @@ class MainWindow(QMainWindow):
         self.baseline_checkbox.setEnabled(False)
         left_panel.addWidget(self.baseline_checkbox)
 
-        self.signal_1_checkbox = QCheckBox("Signal 1")
-        self.signal_1_checkbox.setChecked(True)
-        self.signal_1_checkbox.setEnabled(False)
-        left_panel.addWidget(self.signal_1_checkbox)
-
-        self.signal_2_checkbox = QCheckBox("Signal 2")
-        self.signal_2_checkbox.setChecked(True)
-        self.signal_2_checkbox.setEnabled(False)
-        left_panel.addWidget(self.signal_2_checkbox)
+        self.signal_checkbox_layout = QVBoxLayout()
+        self.signal_checkboxes = []
+        left_panel.addLayout(self.signal_checkbox_layout)
+        self.set_channel_controls(2)
 
         left_panel.addStretch()
 
@@ -117,19 +245,21 @@ class MainWindow(QMainWindow):
         self.progress_bar.hide()
         left_panel.addWidget(self.progress_bar)
 
-        right_panel = QVBoxLayout()
-        main_layout.addLayout(right_panel, 4)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.hide()
+        left_panel.addWidget(self.cancel_button)
 
-        self.figure = Figure(figsize=(8, 6))
-        self.canvas = FigureCanvas(self.figure)
-        self.toolbar = NavigationToolbar(self.canvas, self)
-        right_panel.addWidget(self.toolbar)
-        right_panel.addWidget(self.canvas)
+        self.right_panel = QVBoxLayout()
+        main_layout.addLayout(self.right_panel, 4)
 
-        self.range_slider = QRangeSlider(Qt.Horizontal)
-        self.range_slider.setRange(0, 100)
-        self.range_slider.setValue((0, 100))
-        right_panel.addWidget(self.range_slider)
+        # matplotlib and superqt cost more to import than the rest of the window takes to build, see create_plot_widgets
+        self.figure = None
+        self.canvas = None
+        self.toolbar = None
+        self.range_slider = None
+        self.plot_placeholder = QLabel("Loading plot...")
+        self.plot_placeholder.setAlignment(Qt.AlignCenter)
+        self.right_panel.addWidget(self.plot_placeholder, 1)
 
         self.slider_label = QLabel("Range: 0% – 100%")
         self.range_button = QPushButton("Reset range")
@@ -138,4 +268,64 @@ class MainWindow(QMainWindow):
         range_control_row.addWidget(self.slider_label)
         range_control_row.addStretch()
         range_control_row.addWidget(self.range_button)
-        right_panel.addLayout(range_control_row)
+        self.right_panel.addLayout(range_control_row)
+
+    def create_plot_widgets(self) -> bool:
+        if self.canvas is not None:
+            return False
+
+        from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas, NavigationToolbar2QT as NavigationToolbar
+        from matplotlib.figure import Figure
+        from superqt import QRangeSlider
+
+        self.figure = Figure(figsize=(8, 6))
+        self.canvas = FigureCanvas(self.figure)
+        self.toolbar = NavigationToolbar(self.canvas, self)
+
+        self.range_slider = QRangeSlider(Qt.Horizontal)
+        self.range_slider.setRange(0, 100)
+        self.range_slider.setValue((0, 100))
+
+        self.right_panel.removeWidget(self.plot_placeholder)
+        self.plot_placeholder.deleteLater()
+        self.right_panel.insertWidget(0, self.toolbar)
+        self.right_panel.insertWidget(1, self.canvas)
+        self.right_panel.insertWidget(2, self.range_slider)
+        return True
+
+    def set_channel_controls(self, n_channels):
+        for widget in self.peak_count_labels + self.coincidence_labels + self.signal_checkboxes:
+            widget.deleteLater()
+        self.peak_count_labels = []
+        self.coincidence_labels = []
+        self.signal_checkboxes = []
+
+        for channel in range(n_channels):
+            label = QLabel(f"Signal {channel + 1} tumor peaks: --")
+            self.peak_count_layout.addWidget(label)
+            self.peak_count_labels.append(label)
+
+            checkbox = QCheckBox(f"Signal {channel + 1}")
+            checkbox.setChecked(True)
+            checkbox.setEnabled(False)
+            self.signal_checkbox_layout.addWidget(checkbox)
+            self.signal_checkboxes.append(checkbox)
+
+        for channel in range(1, n_channels):
+            label = QLabel(f"Signal 1–{channel + 1}: --")
+            self.coincidence_layout.addWidget(label)
+            self.coincidence_labels.append(label)
+
+    def threshold_values(self) -> dict:
+        return {name: spin.value() for name, spin in self.threshold_spins.items()}
+
+    def set_threshold_values(self, params):
+        for name, spin in self.threshold_spins.items():
+            spin.blockSignals(True)
+            spin.setValue(params[name])
+            spin.blockSignals(False)
+
+    def set_threshold_controls_enabled(self, enabled):
+        for spin in self.threshold_spins.values():
+            spin.setEnabled(enabled)
+        self.thresholds_button.setEnabled(enabled)
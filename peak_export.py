@@ -0,0 +1,260 @@
+import os
+from importlib.util import find_spec
+import numpy as np
+from algorithms import half_prominence_bounds, window_prominences
+from detection import EXTEND, classified_peaks
+from signal_stats import channel_block
+
+EXPORT_FORMATS = {".parquet": "parquet", ".h5": "hdf5", ".hdf5": "hdf5", ".npz": "npz", ".csv": "csv"}
+EXPORT_EXTENSIONS = {"parquet": ".parquet", "hdf5": ".h5", "npz": ".npz", "csv": ".csv"}
+EXPORT_BACKENDS = {"parquet": "pyarrow", "hdf5": "h5py"}
+EXPORT_COLUMNS = ("channel", "index", "time", "height", "width", "area", "prominence", "class")
+CLASS_NAMES = ("tumor", "water")
+BATCH_SIZE = 1 << 22
+CSV_BATCH_ROWS = 1 << 18
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def export_format(save_path: str) -> str:
+    extension = os.path.splitext(save_path)[1].lower()
+    if extension not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format '{extension}', use one of {', '.join(EXPORT_FORMATS)}")
+    return EXPORT_FORMATS[extension]
+
+
+def export_available(name: str) -> bool:
+    return name not in EXPORT_BACKENDS or find_spec(EXPORT_BACKENDS[name]) is not None
+
+
+def check_export_backend(name: str):
+    if not export_available(name):
+        raise ImportError(f"Exporting to {name} needs {EXPORT_BACKENDS[name]}, install it with "
+                          f"'pip install {EXPORT_BACKENDS[name]}' or pick another format")
+
+
+def peak_features(x: np.ndarray, offset: int, peaks: np.ndarray, baseline: np.ndarray, prominence: np.ndarray,
+                  sampling_rate: float) -> dict:
+    # x holds [offset, offset + len(x)); widths are taken at half prominence and searched at most EXTEND samples out,
+    # areas integrate the signal above the peak's baseline over that same interval
+    local = (peaks - offset).astype(np.intp)
+    missing = np.isnan(prominence)
+    if np.any(missing):
+        prominence = prominence.copy()
+        prominence[missing] = window_prominences(x, local[missing], EXTEND)
+
+    left_ips, right_ips = half_prominence_bounds(x, local, prominence, EXTEND)
+
+    first = np.ceil(left_ips).astype(np.intp)
+    last = np.floor(right_ips).astype(np.intp)
+    cumulative = np.concatenate(([0.0], np.cumsum(x)))
+    area = cumulative[last + 1] - cumulative[first] - baseline * (last - first + 1)
+
+    return {
+        "index": peaks,
+        "time": peaks / sampling_rate,
+        "height": x[local],
+        "width": (right_ips - left_ips) / sampling_rate,
+        "area": area / sampling_rate,
+        "prominence": prominence,
+    }
+
+
+def peak_table_batches(frames, sampling_rate: float, tumor_peaks: list, water_peaks: list, baselines: list,
+                       candidates=None, batch_size: int = BATCH_SIZE):
+    # yields (columns, fraction done) per block of the recording, rows ordered by index then channel
+    signal_length = len(frames)
+    for start in range(0, signal_length, batch_size):
+        end = min(start + batch_size, signal_length)
+
+        channel_peaks = [classified_peaks(tumor, water, start, end) for tumor, water in zip(tumor_peaks, water_peaks)]
+
+        if not any(len(peaks) for peaks, _ in channel_peaks):
+            continue
+
+        offset = max(0, start - EXTEND)
+        block = channel_block(frames, offset, min(signal_length, end + EXTEND)).astype(np.float64)
+
+        parts = []
+        for channel, (x, (peaks, classes), baseline) in enumerate(zip(block, channel_peaks, baselines)):
+            if len(peaks) == 0:
+                continue
+            baseline_values = baseline.value_at(peaks)
+            prominence = (candidates.lookup(channel, peaks, "prominence") if candidates
+                          else np.full(len(peaks), np.nan))
+            columns = peak_features(x, offset, peaks, baseline_values, prominence, sampling_rate)
+            columns["channel"] = np.full(len(peaks), channel, dtype=np.uint8)
+            columns["class"] = classes.astype(np.uint8)
+            parts.append(columns)
+
+        table = {name: np.concatenate([part[name] for part in parts]) for name in EXPORT_COLUMNS}
+        order = np.lexsort((table["channel"], table["index"]))
+        yield {name: column[order] for name, column in table.items()}, end / signal_length
+
+
+class _ParquetWriter:
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.writer = None
+        self.path = path
+        self.pq = pq
+
+    def table(self, columns):
+        arrays = [self.pa.array(columns[name]) for name in EXPORT_COLUMNS[:-1]]
+        arrays.append(self.pa.DictionaryArray.from_arrays(columns["class"].astype(np.int8), list(CLASS_NAMES)))
+        return self.pa.Table.from_arrays(arrays, names=list(EXPORT_COLUMNS))
+
+    def write(self, columns):
+        table = self.table(columns)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, self.table(empty_columns()).schema)
+        self.writer.close()
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class _Hdf5Writer:
+    def __init__(self, path):
+        import h5py
+
+        self.file = h5py.File(path, "w")
+        group = self.file.create_group("peaks")
+        group.attrs["class_names"] = list(CLASS_NAMES)
+        self.datasets = {name: group.create_dataset(name, shape=(0,), maxshape=(None,), dtype=column.dtype,
+                                                    chunks=True, compression="gzip", compression_opts=1)
+                         for name, column in empty_columns().items()}
+
+    def write(self, columns):
+        for name, dataset in self.datasets.items():
+            size = len(dataset)
+            dataset.resize((size + len(columns[name]),))
+            dataset[size:] = columns[name]
+
+    def close(self):
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+class _NpzWriter:
+    def __init__(self, path):
+        self.path = path
+        self.batches = []
+
+    def write(self, columns):
+        self.batches.append(columns)
+
+    def close(self):
+        batches = self.batches or [empty_columns()]
+        with open(self.path, "wb") as file:
+            np.savez(file, class_names=np.array(CLASS_NAMES),
+                     **{name: np.concatenate([batch[name] for batch in batches]) for name in EXPORT_COLUMNS})
+
+    def abort(self):
+        self.batches = []
+
+
+class _CsvWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow.csv as pa_csv
+        except ImportError:
+            pa_csv = None
+
+        self.pa_csv = pa_csv
+        self.file = open(path, "wb")
+        self.header = True
+
+    def write(self, columns):
+        names = np.array(CLASS_NAMES)
+        for first in range(0, len(columns["index"]), CSV_BATCH_ROWS):
+            rows = {name: column[first:first + CSV_BATCH_ROWS] for name, column in columns.items()}
+            rows["class"] = names[rows["class"]]
+            self.write_rows(rows)
+
+    def write_rows(self, rows):
+        if self.pa_csv is not None:
+            import pyarrow as pa
+
+            self.pa_csv.write_csv(pa.table(rows), self.file, self.pa_csv.WriteOptions(include_header=self.header))
+        else:
+            import pandas as pd
+
+            pd.DataFrame(rows).to_csv(self.file, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        if self.header:
+            self.file.write((",".join(EXPORT_COLUMNS) + "\n").encode())
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+WRITERS = {"parquet": _ParquetWriter, "hdf5": _Hdf5Writer, "npz": _NpzWriter, "csv": _CsvWriter}
+
+
+def empty_columns() -> dict:
+    columns = {name: np.zeros(0, dtype=np.float64) for name in EXPORT_COLUMNS}
+    columns["channel"] = np.zeros(0, dtype=np.uint8)
+    columns["index"] = np.zeros(0, dtype=np.int64)
+    columns["class"] = np.zeros(0, dtype=np.uint8)
+    return columns
+
+
+def export_peaks(save_path: str,
+                 frames,
+                 sampling_rate: float,
+                 tumor_peaks: list,
+                 water_peaks: list,
+                 baselines: list,
+                 candidates=None,
+                 batch_size: int = BATCH_SIZE,
+                 progress=None,
+                 is_cancelled=None) -> int:
+
+    name = export_format(save_path)
+    check_export_backend(name)
+    writer_class = WRITERS[name]
+    tmp_path = save_path + ".part"
+    rows = 0
+
+    try:
+        out = writer_class(tmp_path)
+        try:
+            for columns, fraction in peak_table_batches(frames, sampling_rate, tumor_peaks, water_peaks, baselines,
+                                                        candidates, batch_size):
+                out.write(columns)
+                rows += len(columns["index"])
+
+                if progress is not None:
+                    progress(fraction)
+                if is_cancelled is not None and is_cancelled():
+                    raise ExportCancelled()
+        except BaseException:
+            out.abort()
+            raise
+        out.close()
+
+        os.replace(tmp_path, save_path)
+
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return rows
@@ -0,0 +1,52 @@
+import numpy as np
+
+
+class PeakIndex:
+    def __init__(self, peaks=()):
+        peaks = np.asarray(peaks, dtype=np.int64)
+        if len(peaks) > 1 and np.any(peaks[1:] < peaks[:-1]):
+            peaks = np.sort(peaks)
+        self.peaks = np.ascontiguousarray(peaks)
+        self._buffer = self.peaks
+
+    def __len__(self):
+        return len(self.peaks)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.peaks if dtype is None else self.peaks.astype(dtype)
+
+    def extend(self, peaks):
+        peaks = np.asarray(peaks, dtype=np.int64)
+        if len(peaks) == 0:
+            return
+        size = len(self.peaks)
+        if size and peaks.min() < self.peaks[-1]:
+            # a sort in place would reorder views handed out earlier, so out-of-order peaks get a fresh array
+            merged = np.concatenate((self.peaks, peaks))
+            merged.sort(kind="stable")
+            self.peaks = self._buffer = merged
+            return
+
+        # appends go into spare capacity that doubles when it runs out, so following a stream copies each peak O(1) times
+        if size + len(peaks) > len(self._buffer):
+            buffer = np.empty(max(2 * len(self._buffer), size + len(peaks)), dtype=np.int64)
+            buffer[:size] = self.peaks
+            self._buffer = buffer
+        self._buffer[size:size + len(peaks)] = peaks
+        self.peaks = self._buffer[:size + len(peaks)]
+
+    def bounds(self, start: int, end: int) -> tuple[int, int]:
+        return int(np.searchsorted(self.peaks, start, side="left")), int(np.searchsorted(self.peaks, end, side="left"))
+
+    def range(self, start: int, end: int) -> np.ndarray:
+        first, last = self.bounds(start, end)
+        return self.peaks[first:last]
+
+    def decimate(self, start: int, end: int, n_bins: int) -> np.ndarray:
+        peaks = self.range(start, end)
+        if len(peaks) <= n_bins or end <= start:
+            return peaks
+
+        # one marker per pixel column is all the canvas can show
+        columns = (peaks - start) * n_bins // (end - start)
+        return peaks[np.flatnonzero(np.diff(columns, prepend=-1))]
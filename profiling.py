@@ -0,0 +1,185 @@
+import builtins
+import cProfile
+import importlib.util
+import json
+import sys
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from formatters import format_time
+
+DEFAULT_PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "signal-analyzer", "profiles")
+
+
+class PipelineProfile:
+    def __init__(self):
+        self.stages = {}
+        self.sections = []
+
+    @contextmanager
+    def stage(self, name: str):
+        wall_start = time.perf_counter()
+        # thread time, so a worker thread is not charged for the GUI thread
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+
+    def add_stage(self, name: str, wall: float, cpu: float, calls: int = 1):
+        totals = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        totals["wall"] += wall
+        totals["cpu"] += cpu
+        totals["calls"] += calls
+
+    def add_section(self, start: int, samples: int, wall: float, cpu: float, tumor_peaks: int, water_peaks: int):
+        self.sections.append({
+            "start": start,
+            "samples": samples,
+            "wall": wall,
+            "cpu": cpu,
+            "tumor_peaks": tumor_peaks,
+            "water_peaks": water_peaks,
+        })
+
+    def merge(self, other: "PipelineProfile"):
+        for name, totals in other.stages.items():
+            self.add_stage(name, totals["wall"], totals["cpu"], totals["calls"])
+        self.sections.extend(other.sections)
+        self.sections.sort(key=lambda section: section["start"])
+
+    def to_dict(self) -> dict:
+        return {
+            "samples": sum(section["samples"] for section in self.sections),
+            "tumor_peaks": sum(section["tumor_peaks"] for section in self.sections),
+            "water_peaks": sum(section["water_peaks"] for section in self.sections),
+            "stages": self.stages,
+            "sections": self.sections,
+        }
+
+
+class StartupProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = []
+        self.imports = {}
+        self.pending = []
+        self.original_import = None
+
+    def install(self):
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.timed_import
+
+    def uninstall(self):
+        if self.original_import is not None:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+
+    @staticmethod
+    def import_key(name, globals, fromlist, level) -> str | None:
+        # the module this statement would load, or None when everything it names is already imported
+        if level:
+            try:
+                name = importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__") or "")
+            except (ImportError, ValueError):
+                return name
+        module = sys.modules.get(name)
+        if module is None:
+            return name
+        for item in fromlist or ():
+            if item != "*" and not hasattr(module, item):
+                return f"{name}.{item}"
+        return None
+
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        key = self.import_key(name, globals, fromlist, level)
+        if key is None:
+            return self.original_import(name, globals, locals, fromlist, level)
+
+        # nested imports are subtracted from their parent, so self times add up to the import phase
+        started = time.perf_counter()
+        self.pending.append(0.0)
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = self.pending.pop()
+            if self.pending:
+                self.pending[-1] += elapsed
+            totals = self.imports.setdefault(key, {"self": 0.0, "total": 0.0})
+            totals["self"] += elapsed - nested
+            totals["total"] += elapsed
+
+    def phase(self, name: str):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self, top: int = 15) -> str:
+        lines = [f"Startup: {format_time(self.last - self.started)}"]
+        for name, seconds in self.phases:
+            lines.append(f"  {name:<24} {format_time(seconds):>12}")
+        lines.append("Slowest imports (self / including nested):")
+        for name, totals in sorted(self.imports.items(), key=lambda item: -item[1]["self"])[:top]:
+            lines.append(f"  {name:<40} {format_time(totals['self']):>12} {format_time(totals['total']):>12}")
+        return "\n".join(lines)
+
+
+def stage(profile: PipelineProfile | None, name: str):
+    return profile.stage(name) if profile is not None else nullcontext()
+
+
+def run_report(profiles: list[PipelineProfile], wall: float, cpu: float, **meta) -> dict:
+    channels = [profile.to_dict() for profile in profiles]
+
+    stages = {}
+    for channel in channels:
+        for name, totals in channel["stages"].items():
+            combined = stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+            for key in combined:
+                combined[key] += totals[key]
+
+    samples = sum(channel["samples"] for channel in channels)
+    return {
+        **meta,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "wall": wall,
+        "cpu": cpu,
+        "samples": samples,
+        "samples_per_second": samples / wall if wall > 0 else 0.0,
+        "tumor_peaks": sum(channel["tumor_peaks"] for channel in channels),
+        "water_peaks": sum(channel["water_peaks"] for channel in channels),
+        "stages": stages,
+        "channels": channels,
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"Detection: {report['samples']:,} samples in {format_time(report['wall'])} "
+        f"({report['samples_per_second']:,.0f} samples/s), "
+        f"{report['tumor_peaks']} tumor / {report['water_peaks']} water peaks"
+    ]
+    for name, totals in sorted(report["stages"].items(), key=lambda item: -item[1]["wall"]):
+        lines.append(f"  {name:<16} {format_time(totals['wall']):>12} wall {format_time(totals['cpu']):>12} cpu "
+                     f"{totals['calls']:>6} calls")
+    return "\n".join(lines)
+
+
+def dump_report(report: dict, path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+
+
+def profile_call(function, stats_path: str = None):
+    if stats_path is None:
+        return function()
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function)
+    finally:
+        os.makedirs(os.path.dirname(stats_path) or ".", exist_ok=True)
+        profiler.dump_stats(stats_path)
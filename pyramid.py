@@ -0,0 +1,76 @@
+import os
+import numpy as np
+
+
+class MinMaxPyramid:
+    def __init__(self, levels: list[tuple[np.ndarray, np.ndarray]], length: int, base_bin: int = 64, factor: int = 4):
+        self.levels = levels
+        self.length = length
+        self.base_bin = base_bin
+        self.factor = factor
+
+    @classmethod
+    def build(cls, y, base_bin: int = 64, factor: int = 4, min_bins: int = 1000, chunk_bins: int = 16384):
+        length = len(y)
+        n_bins = -(-length // base_bin)
+        chunk_size = chunk_bins * base_bin
+
+        mins = []
+        maxs = []
+        for start in range(0, length, chunk_size):
+            chunk = np.asarray(y[start:min(start + chunk_size, length)])
+            bins = np.arange(0, len(chunk), base_bin)
+            mins.append(np.minimum.reduceat(chunk, bins))
+            maxs.append(np.maximum.reduceat(chunk, bins))
+
+        level_min = np.concatenate(mins) if mins else np.array([], dtype=getattr(y, "dtype", float))
+        level_max = np.concatenate(maxs) if maxs else level_min.copy()
+        levels = [(level_min, level_max)]
+
+        while n_bins // factor >= min_bins:
+            prev_min, prev_max = levels[-1]
+            bins = np.arange(0, len(prev_min), factor)
+            levels.append((np.minimum.reduceat(prev_min, bins), np.maximum.reduceat(prev_max, bins)))
+            n_bins = len(levels[-1][0])
+
+        return cls(levels, length, base_bin, factor)
+
+    def bin_size(self, level: int) -> int:
+        return self.base_bin * self.factor ** level
+
+
+def pyramid_path(file_path: str) -> str:
+    return file_path + ".lod.npz"
+
+
+def save_pyramids(path: str, pyramids: list[MinMaxPyramid]):
+    arrays = {}
+    for channel, pyramid in enumerate(pyramids):
+        arrays[f"c{channel}_meta"] = np.array([pyramid.length, pyramid.base_bin, pyramid.factor, len(pyramid.levels)])
+        for level, (level_min, level_max) in enumerate(pyramid.levels):
+            arrays[f"c{channel}_min_{level}"] = level_min
+            arrays[f"c{channel}_max_{level}"] = level_max
+
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_pyramids(path: str, file_path: str, length: int, n_channels: int = None) -> list[MinMaxPyramid] | None:
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(file_path):
+        return None
+
+    pyramids = []
+    with np.load(path) as data:
+        channel = 0
+        while f"c{channel}_meta" in data:
+            pyramid_length, base_bin, factor, n_levels = (int(v) for v in data[f"c{channel}_meta"])
+            if pyramid_length != length:
+                return None
+            levels = [(data[f"c{channel}_min_{level}"], data[f"c{channel}_max_{level}"]) for level in range(n_levels)]
+            pyramids.append(MinMaxPyramid(levels, pyramid_length, base_bin, factor))
+            channel += 1
+
+    if n_channels is not None and len(pyramids) != n_channels:
+        return None
+    return pyramids or None
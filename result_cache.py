@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from baseline import PiecewiseBaseline
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "signal-analyzer", "results")
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+
+def file_fingerprint(file_path: str, n_blocks: int = 16, block_size: int = 64 * 1024) -> dict:
+    stat = os.stat(file_path)
+    digest = hashlib.blake2b(digest_size=16)
+
+    with open(file_path, "rb") as file:
+        if stat.st_size <= n_blocks * block_size:
+            digest.update(file.read())
+        else:
+            for offset in np.linspace(0, stat.st_size - block_size, n_blocks, dtype=np.int64):
+                file.seek(int(offset))
+                digest.update(file.read(block_size))
+
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+
+def results_to_arrays(results: list) -> dict:
+    arrays = {}
+    for channel, (tumor_peaks, water_peaks, baseline) in enumerate(results):
+        arrays[f"tumor_peaks_{channel}"] = np.asarray(tumor_peaks, dtype=np.int64)
+        arrays[f"water_peaks_{channel}"] = np.asarray(water_peaks, dtype=np.int64)
+        arrays[f"baseline_breakpoints_{channel}"] = baseline.breakpoints
+        arrays[f"baseline_values_{channel}"] = baseline.values
+        arrays[f"baseline_length_{channel}"] = np.array([baseline.length], dtype=np.int64)
+    return arrays
+
+
+def arrays_to_results(arrays: dict) -> list:
+    results = []
+    channel = 0
+    while f"tumor_peaks_{channel}" in arrays:
+        baseline = PiecewiseBaseline(
+            arrays[f"baseline_breakpoints_{channel}"],
+            arrays[f"baseline_values_{channel}"],
+            int(arrays[f"baseline_length_{channel}"][0])
+        )
+        results.append((arrays[f"tumor_peaks_{channel}"], arrays[f"water_peaks_{channel}"], baseline))
+        channel += 1
+    return results
+
+
+def load_arrays(path: str) -> dict:
+    # every array stays on disk; callers slice what they need
+    return {
+        os.path.splitext(name)[0]: np.load(os.path.join(path, name), mmap_mode="r")
+        for name in os.listdir(path) if name.endswith(".npy")
+    }
+
+
+class ResultCache:
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, file_path: str, params: dict) -> str:
+        payload = json.dumps({"file": file_fingerprint(file_path), "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def load(self, file_path: str, params: dict) -> dict | None:
+        path = self.entry_path(self.key(file_path, params))
+        if not os.path.isdir(path):
+            return None
+
+        try:
+            arrays = load_arrays(path)
+        except (OSError, ValueError) as e:
+            print("Discarding unreadable cache entry:", e)
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+        os.utime(path)
+        return arrays
+
+    def store(self, file_path: str, params: dict, arrays: dict):
+        key = self.key(file_path, params)
+        path = self.entry_path(key)
+        tmp_path = path + ".tmp"
+
+        os.makedirs(self.directory, exist_ok=True)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + ".npy"), np.ascontiguousarray(array))
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        self.evict(keep=key)
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        if not os.path.isdir(self.directory):
+            return []
+
+        entries = []
+        for name in os.listdir(self.directory):
+            path = self.entry_path(name)
+            if name.endswith(".tmp") or not os.path.isdir(path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            entries.append((os.path.getmtime(path), size, name))
+        return entries
+
+    def evict(self, keep: str = None):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(self.entry_path(name), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
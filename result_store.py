@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from algorithms import CANDIDATE_DTYPE
+from candidate_store import CandidateStore
+from detection import SECTION_SIZE
+from result_cache import arrays_to_results, load_arrays, results_to_arrays
+
+SESSION_ROOT = os.path.join(tempfile.gettempdir(), "signal-analyzer")
+
+
+def new_session_dir() -> str:
+    os.makedirs(SESSION_ROOT, exist_ok=True)
+    return tempfile.mkdtemp(prefix="session-", dir=SESSION_ROOT)
+
+
+class ResultStore:
+    def __init__(self, directory: str, n_channels: int, section_size: int = SECTION_SIZE):
+        self.directory = directory
+        self.n_channels = n_channels
+        self.section_size = section_size
+        self.starts = []
+        self.ends = []
+        self.counts = [[] for _ in range(n_channels)]
+        self.arrays = None
+
+        os.makedirs(directory, exist_ok=True)
+        self.candidate_files = [open(self.path(f"candidates_{channel}.part"), "wb") for channel in range(n_channels)]
+
+    @classmethod
+    def create(cls, session_dir: str, n_channels: int, section_size: int = SECTION_SIZE):
+        return cls(tempfile.mkdtemp(prefix="results-", dir=session_dir), n_channels, section_size)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def save(self, name: str, array):
+        np.save(self.path(name + ".npy"), np.ascontiguousarray(array))
+
+    def add(self, start: int, channel_candidates: list, end: int = None):
+        # same collector interface as CandidateStore, but sections go straight to disk in arrival order
+        self.starts.append(start)
+        self.ends.append(start + self.section_size if end is None else end)
+        for file, counts, candidates in zip(self.candidate_files, self.counts, channel_candidates):
+            np.ascontiguousarray(candidates, dtype=CANDIDATE_DTYPE).tofile(file)
+            counts.append(len(candidates))
+
+    def close(self, results: list):
+        for name, array in results_to_arrays(results).items():
+            self.save(name, array)
+
+        self.save("candidate_section_size", np.array([self.section_size], dtype=np.int64))
+        header = {"descr": np.lib.format.dtype_to_descr(CANDIDATE_DTYPE), "fortran_order": False}
+        for channel, (file, counts) in enumerate(zip(self.candidate_files, self.counts)):
+            file.close()
+            self.save(f"candidate_starts_{channel}", np.array(self.starts, dtype=np.int64))
+            self.save(f"candidate_ends_{channel}", np.array(self.ends, dtype=np.int64))
+            self.save(f"candidate_counts_{channel}", np.array(counts, dtype=np.int64))
+
+            part_path = self.path(f"candidates_{channel}.part")
+            with open(self.path(f"candidates_{channel}.npy"), "wb") as out, open(part_path, "rb") as part:
+                np.lib.format.write_array_header_1_0(out, {**header, "shape": (sum(counts),)})
+                shutil.copyfileobj(part, out, 1 << 20)
+            os.remove(part_path)
+
+        self.candidate_files = []
+        self.arrays = load_arrays(self.directory)
+
+    def results(self) -> list:
+        return arrays_to_results(self.arrays)
+
+    def candidates(self) -> CandidateStore:
+        return CandidateStore.from_arrays(self.arrays)
+
+    def remove(self):
+        # the arrays are memory-mapped from the directory; on Windows it only goes once every map of them is dropped
+        for file in self.candidate_files:
+            file.close()
+        self.candidate_files = []
+        self.arrays = None
+        try:
+            shutil.rmtree(self.directory)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print("Could not remove detection results:", e)
@@ -0,0 +1,290 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+import numpy as np
+
+MAGIC = b"SIGFILE1"
+INDEX_MAGIC = b"SIGINDEX"
+FOOTER = struct.Struct("<QQQ8s")
+HEADER_LENGTH = struct.Struct("<I")
+CHUNK_SIZE = 1 << 16
+COMPRESSIONS = ("delta-zlib", "zlib", "none")
+CACHE_CHUNKS = 64
+
+
+def encode_chunk(data: np.ndarray, compression: str, level: int = 1) -> bytes:
+    if compression == "delta-zlib":
+        # integer wraparound keeps the delta exactly reversible with a cumulative sum in the same dtype
+        data = np.diff(data, prepend=data.dtype.type(0))
+    raw = np.ascontiguousarray(data).tobytes()
+    return raw if compression == "none" else zlib.compress(raw, level)
+
+
+def decode_chunk(blob: bytes, dtype: np.dtype, compression: str) -> np.ndarray:
+    raw = blob if compression == "none" else zlib.decompress(blob)
+    data = np.frombuffer(raw, dtype=dtype)
+    if compression == "delta-zlib":
+        data = np.cumsum(data, dtype=dtype)
+    return data
+
+
+class SigWriter:
+    def __init__(self,
+                 path: str,
+                 n_channels: int,
+                 sampling_rate: float,
+                 channel_names: list[str] = None,
+                 dtype=np.int16,
+                 chunk_size: int = CHUNK_SIZE,
+                 compression: str = "delta-zlib"):
+
+        dtype = np.dtype(dtype)
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}'.")
+        if compression == "delta-zlib" and dtype.kind not in "iu":
+            compression = "zlib"
+
+        self.path = path
+        self.n_channels = n_channels
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.header = {
+            "version": 1,
+            "sampling_rate": sampling_rate,
+            "channel_names": channel_names or [f"adc{i + 1}" for i in range(n_channels)],
+            "dtype": dtype.str,
+            "chunk_size": chunk_size,
+            "compression": compression,
+        }
+        self.index = []
+        self.chunk_frames = []
+        self.n_frames = 0
+        self.pending = []
+        self.pending_frames = 0
+
+        self.file = open(path, "wb")
+        header = json.dumps(self.header).encode()
+        self.file.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+
+    def write(self, frames: np.ndarray):
+        frames = np.asarray(frames, dtype=self.dtype).reshape(-1, self.n_channels)
+        self.pending.append(frames)
+        self.pending_frames += len(frames)
+
+        if self.pending_frames >= self.chunk_size:
+            buffered = np.concatenate(self.pending)
+            full = len(buffered) - len(buffered) % self.chunk_size
+            for start in range(0, full, self.chunk_size):
+                self.write_chunk(buffered[start:start + self.chunk_size])
+            self.pending = [buffered[full:]]
+            self.pending_frames = len(buffered) - full
+
+    def write_chunk(self, frames: np.ndarray):
+        entries = []
+        for channel in range(self.n_channels):
+            blob = encode_chunk(frames[:, channel], self.compression)
+            entries.append((self.file.tell(), len(blob)))
+            self.file.write(blob)
+        self.index.append(entries)
+        self.chunk_frames.append(len(frames))
+        self.n_frames += len(frames)
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.pending_frames:
+            self.write_chunk(np.concatenate(self.pending))
+            self.pending = []
+            self.pending_frames = 0
+
+        index_offset = self.file.tell()
+        np.asarray(self.index, dtype="<i8").reshape(-1, self.n_channels, 2).tofile(self.file)
+        np.asarray(self.chunk_frames, dtype="<i8").tofile(self.file)
+        self.file.write(FOOTER.pack(index_offset, len(self.index), self.n_frames, INDEX_MAGIC))
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class SigFile:
+    def __init__(self, path: str, cache_chunks: int = CACHE_CHUNKS):
+        self.path = path
+        self.file = open(path, "rb")
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cache_chunks = cache_chunks
+
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{path}' is not a .sig file.")
+        (header_length,) = HEADER_LENGTH.unpack(self.file.read(HEADER_LENGTH.size))
+        self.header = json.loads(self.file.read(header_length))
+        # samples are stored and shown as raw counts; nothing here would apply a scale
+        if self.header.get("scale", 1.0) != 1.0:
+            self.file.close()
+            raise ValueError(f"'{path}' stores scaled samples, which are not supported.")
+
+        self.file.seek(-FOOTER.size, os.SEEK_END)
+        index_offset, n_chunks, self.n_frames, index_magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if index_magic != INDEX_MAGIC:
+            raise ValueError(f"'{path}' has no chunk index; the file is incomplete.")
+
+        self.n_channels = len(self.header["channel_names"])
+        self.file.seek(index_offset)
+        self.index = np.fromfile(self.file, dtype="<i8", count=n_chunks * self.n_channels * 2).reshape(n_chunks, self.n_channels, 2)
+        self.chunk_frames = np.fromfile(self.file, dtype="<i8", count=n_chunks)
+
+        self.dtype = np.dtype(self.header["dtype"])
+        self.chunk_size = self.header["chunk_size"]
+        self.compression = self.header["compression"]
+        self.sampling_rate = self.header["sampling_rate"]
+        self.channel_names = self.header["channel_names"]
+
+    def __len__(self):
+        return self.n_frames
+
+    def close(self):
+        # never in the middle of another thread's read
+        with self.lock:
+            self.file.close()
+
+    def read_chunk(self, channel: int, chunk: int) -> np.ndarray:
+        key = (channel, chunk)
+        with self.lock:
+            data = self.cache.get(key)
+            if data is not None:
+                self.cache.move_to_end(key)
+                return data
+
+            offset, size = self.index[chunk, channel]
+            self.file.seek(int(offset))
+            blob = self.file.read(int(size))
+
+        data = decode_chunk(blob, self.dtype, self.compression)
+
+        with self.lock:
+            self.cache[key] = data
+            while len(self.cache) > self.cache_chunks:
+                self.cache.popitem(last=False)
+        return data
+
+    def read(self, channel: int, start: int, end: int) -> np.ndarray:
+        start = max(0, start)
+        end = min(end, self.n_frames)
+        if end <= start:
+            return np.empty(0, dtype=self.dtype)
+
+        first = start // self.chunk_size
+        last = (end - 1) // self.chunk_size
+        if first == last:
+            offset = first * self.chunk_size
+            return self.read_chunk(channel, first)[start - offset:end - offset]
+
+        out = np.empty(end - start, dtype=self.dtype)
+        for chunk in range(first, last + 1):
+            chunk_start = chunk * self.chunk_size
+            data = self.read_chunk(channel, chunk)
+            lo = max(start, chunk_start)
+            hi = min(end, chunk_start + len(data))
+            out[lo - start:hi - start] = data[lo - chunk_start:hi - chunk_start]
+        return out
+
+    def read_frames(self, start: int, end: int) -> np.ndarray:
+        # channels are stored planar, so the transposed view is already channel-major in memory
+        return np.stack([self.read(channel, start, end) for channel in range(self.n_channels)]).T
+
+    def take(self, channel: int, indices) -> np.ndarray:
+        indices = np.asarray(indices, dtype=np.int64)
+        indices = np.where(indices < 0, indices + self.n_frames, indices)
+        if np.any((indices < 0) | (indices >= self.n_frames)):
+            raise IndexError("index out of range")
+
+        out = np.empty(indices.shape, dtype=self.dtype)
+        chunks = indices // self.chunk_size
+        for chunk in np.unique(chunks):
+            selected = chunks == chunk
+            out[selected] = self.read_chunk(channel, int(chunk))[indices[selected] - chunk * self.chunk_size]
+        return out
+
+    def channel(self, index: int) -> "SigChannel":
+        return SigChannel(self, index)
+
+    def frames(self) -> "SigFrames":
+        return SigFrames(self)
+
+
+class SigChannel:
+    ndim = 1
+
+    def __init__(self, sig: SigFile, channel: int):
+        self.sig = sig
+        self.channel = channel
+        self.dtype = sig.dtype
+
+    def __len__(self):
+        return len(self.sig)
+
+    @property
+    def shape(self):
+        return (len(self.sig),)
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.sig.read(self.channel, 0, len(self.sig))
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, end, step = key.indices(len(self.sig))
+            if step == 1:
+                return self.sig.read(self.channel, start, end)
+            if step > 0:
+                return self.sig.read(self.channel, start, end)[::step]
+            return self.sig.take(self.channel, np.arange(start, end, step))
+        if isinstance(key, (int, np.integer)):
+            return self.sig.take(self.channel, [key])[0]
+        return self.sig.take(self.channel, key)
+
+
+
+class SigFrames:
+    ndim = 2
+
+    def __init__(self, sig: SigFile):
+        self.sig = sig
+        self.dtype = sig.dtype
+
+    def __len__(self):
+        return len(self.sig)
+
+    @property
+    def shape(self):
+        return (len(self.sig), self.sig.n_channels)
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.sig.read_frames(0, len(self.sig))
+        return data if dtype is None else data.astype(dtype)
+
+    def __getitem__(self, key):
+        rows, column = key if isinstance(key, tuple) else (key, slice(None))
+        if rows == slice(None) and isinstance(column, (int, np.integer)):
+            return self.sig.channel(int(column))
+        if not isinstance(rows, slice):
+            raise TypeError("chunked frames can only be sliced by rows")
+
+        start, end, step = rows.indices(len(self.sig))
+        if step != 1:
+            return np.asarray(self)[rows, column]
+        return self.sig.read_frames(start, end)[:, column]
@@ -0,0 +1,125 @@
+import os
+import re
+import numpy as np
+from sigfile import SigFile
+
+DEFAULT_SAMPLING_RATE = 50000
+DEFAULT_N_CHANNELS = 2
+
+
+def channel_columns(names) -> list[str]:
+    columns = [name for name in names if re.fullmatch(r"adc\d+", name)]
+    return sorted(columns, key=lambda name: int(name[3:]))
+
+
+class SignalSource:
+    def __init__(self,
+                 channels: list,
+                 sampling_rate: float = DEFAULT_SAMPLING_RATE,
+                 file_path: str = None,
+                 dtype=np.int16,
+                 offset: int = 0,
+                 channel_names: list[str] = None,
+                 frames=None,
+                 handle=None):
+        self.channels = channels
+        self.sampling_rate = sampling_rate
+        self.file_path = file_path
+        self.dtype = np.dtype(dtype)
+        self.offset = offset
+        self.channel_names = channel_names or [f"adc{i + 1}" for i in range(len(channels))]
+        self._frames = frames
+        # an open file the channels read from, closed with the source
+        self.handle = handle
+
+    @classmethod
+    def from_bin(cls,
+                 file_path: str,
+                 sampling_rate: float = DEFAULT_SAMPLING_RATE,
+                 n_channels: int = DEFAULT_N_CHANNELS,
+                 dtype=np.int16,
+                 offset: int = 0,
+                 length: int = None):
+        frame_size = n_channels * np.dtype(dtype).itemsize
+        number_of_samples = (os.path.getsize(file_path) - offset) // frame_size
+        if length is not None:
+            number_of_samples = min(number_of_samples, length)
+
+        if number_of_samples == 0:
+            raw_data = np.empty((0, n_channels), dtype=dtype)
+        else:
+            raw_data = np.memmap(file_path, dtype=dtype, mode="r", offset=offset, shape=(number_of_samples, n_channels))
+
+        return cls([raw_data[:, i] for i in range(n_channels)], sampling_rate, file_path, dtype, offset, frames=raw_data)
+
+    @classmethod
+    def from_sig(cls, file_path: str):
+        sig = SigFile(file_path)
+        channels = [sig.channel(i) for i in range(sig.n_channels)]
+        return cls(channels, sig.sampling_rate, file_path, sig.dtype, channel_names=sig.channel_names, frames=sig.frames(),
+                   handle=sig)
+
+    @classmethod
+    def from_csv(cls, file_path: str, sampling_rate: float = DEFAULT_SAMPLING_RATE):
+        import pandas as pd
+
+        data = pd.read_csv(file_path, low_memory=True)
+        names = channel_columns(data.columns)
+        if not names:
+            raise ValueError("The csv file should have columns 'adc1', 'adc2', ...")
+
+        frames = data[names].to_numpy()
+        return cls([frames[:, i] for i in range(len(names))], sampling_rate, dtype=frames.dtype, channel_names=names,
+                   frames=frames)
+
+    @classmethod
+    def open(cls, file_path: str, sampling_rate: float = DEFAULT_SAMPLING_RATE, n_channels: int = DEFAULT_N_CHANNELS):
+        file_type = os.path.splitext(file_path)[1].lower()
+        if file_type == ".bin":
+            return cls.from_bin(file_path, sampling_rate, n_channels)
+        if file_type == ".sig":
+            return cls.from_sig(file_path)
+        if file_type == ".csv":
+            return cls.from_csv(file_path, sampling_rate)
+        raise ValueError(f"Unsupported file type '{file_type}'.")
+
+    def __len__(self):
+        return len(self.channels[0]) if self.channels else 0
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def n_channels(self) -> int:
+        return len(self.channels)
+
+    @property
+    def frames(self):
+        # (samples, channels), so per-section statistics cover every channel in one pass
+        if self._frames is None:
+            self._frames = np.column_stack(self.channels)
+        return self._frames
+
+    @property
+    def duration(self) -> float:
+        return len(self) / self.sampling_rate
+
+    @property
+    def is_memmapped(self) -> bool:
+        return self.file_path is not None
+
+    def channel(self, index: int):
+        return self.channels[index]
+
+    def time_at(self, indices):
+        return np.asarray(indices) / self.sampling_rate
+
+    def time_range(self, start: int, end: int) -> np.ndarray:
+        return np.arange(start, end) / self.sampling_rate
@@ -0,0 +1,130 @@
+import numpy as np
+from algorithms import INT16_BINS, INT16_OFFSET, baseline_from_histogram, int16_histogram
+
+INT16_VALUES = np.arange(-INT16_OFFSET, INT16_BINS - INT16_OFFSET, dtype=np.int64)
+INT16_SQUARES = INT16_VALUES * INT16_VALUES
+
+
+def channel_block(frames, start: int, end: int) -> np.ndarray:
+    # one sequential read of the interleaved frames, then channel-major so every per-channel kernel gets contiguous rows
+    return np.ascontiguousarray(np.asarray(frames[start:end]).T)
+
+
+def sd_from_moments(n: int, total, total_sq) -> float:
+    if n == 0:
+        return 0.0
+    return float(np.sqrt((n * total_sq - total * total) / (n * n)))
+
+
+class SectionStats:
+    def __init__(self, n: int, total, total_sq, minimum, maximum, baseline=None):
+        self.n = n
+        self.total = total
+        self.total_sq = total_sq
+        self.minimum = minimum
+        self.maximum = maximum
+        self.baseline = baseline
+
+    @classmethod
+    def from_section(cls, section, histogram: np.ndarray = None):
+        section = np.asarray(section)
+        if len(section) == 0:
+            return cls(0, 0, 0, None, None, None)
+
+        if histogram is None and section.dtype != np.int16:
+            if np.issubdtype(section.dtype, np.integer):
+                values = section.astype(np.int64)
+                total, total_sq = int(values.sum()), int(np.dot(values, values))
+            else:
+                values = section.astype(np.float64)
+                total, total_sq = float(values.sum()), float(np.dot(values, values))
+            return cls(len(section), total, total_sq, section.min(), section.max())
+
+        # every int16 statistic comes from the one bincount, exactly, with integer moments
+        if histogram is None:
+            histogram = int16_histogram(section)
+        occupied = np.flatnonzero(histogram)
+        return cls(len(section), int(np.dot(histogram, INT16_VALUES)), int(np.dot(histogram, INT16_SQUARES)),
+                   int(occupied[0]) - INT16_OFFSET, int(occupied[-1]) - INT16_OFFSET, baseline_from_histogram(histogram))
+
+
+class ChannelStats:
+    def __init__(self, section_size: int):
+        self.section_size = section_size
+        self.sections = {}
+        self.histogram = None
+
+    def add(self, start: int, section):
+        section = np.asarray(section)
+        histogram = int16_histogram(section) if section.dtype == np.int16 else None
+        self.sections[start] = SectionStats.from_section(section, histogram)
+        if histogram is not None:
+            self.histogram = histogram if self.histogram is None else self.histogram + histogram
+
+    def merge(self, other: "ChannelStats"):
+        self.sections.update(other.sections)
+        if other.histogram is not None:
+            self.histogram = other.histogram.copy() if self.histogram is None else self.histogram + other.histogram
+
+    @property
+    def n(self) -> int:
+        return sum(section.n for section in self.sections.values())
+
+    @property
+    def total(self):
+        return sum(section.total for section in self.sections.values())
+
+    @property
+    def total_sq(self):
+        return sum(section.total_sq for section in self.sections.values())
+
+    @property
+    def sd(self) -> float:
+        return sd_from_moments(self.n, self.total, self.total_sq)
+
+    @property
+    def minimum(self):
+        return min((section.minimum for section in self.sections.values() if section.n), default=None)
+
+    @property
+    def maximum(self):
+        return max((section.maximum for section in self.sections.values() if section.n), default=None)
+
+
+class SignalStats:
+    def __init__(self, n_channels: int, section_size: int):
+        self.section_size = section_size
+        self.channels = [ChannelStats(section_size) for _ in range(n_channels)]
+
+    def __getitem__(self, channel: int) -> ChannelStats:
+        return self.channels[channel]
+
+    def __len__(self):
+        return len(self.channels)
+
+    def merge(self, other: "SignalStats"):
+        for channel, other_channel in zip(self.channels, other.channels):
+            channel.merge(other_channel)
+
+    def sds(self) -> list[float]:
+        return [channel.sd for channel in self.channels]
+
+    def section(self, start: int) -> list[SectionStats]:
+        return [channel.sections[start] for channel in self.channels]
+
+
+def frame_stats(frames, section_size: int, starts=None) -> SignalStats:
+    signal_length, n_channels = frames.shape
+    stats = SignalStats(n_channels, section_size)
+    for start in (range(0, signal_length, section_size) if starts is None else starts):
+        block = channel_block(frames, start, min(start + section_size, signal_length))
+        for channel, section in enumerate(block):
+            stats[channel].add(start, section)
+    return stats
+
+
+def signal_stats(signal, section_size: int) -> ChannelStats:
+    stats = ChannelStats(section_size)
+    for start in range(0, len(signal), section_size):
+        stats.add(start, signal[start:start + section_size])
+    return stats
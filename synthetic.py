@@ -0,0 +1,109 @@
+import json
+import os
+import numpy as np
+from signal_source import DEFAULT_SAMPLING_RATE
+
+CHUNK_SIZE = 1 << 22
+
+
+def place_events(n_samples: int, spacing: int, water_fraction: float, rng) -> tuple[np.ndarray, np.ndarray]:
+    slots = np.arange(spacing, n_samples - spacing, spacing)
+    positions = slots + rng.integers(-spacing // 4, spacing // 4 + 1, len(slots))
+    is_water = rng.random(len(slots)) < water_fraction
+    return np.sort(positions[~is_water]), np.sort(positions[is_water])
+
+
+def generate_recording(path: str,
+                       n_samples: int,
+                       n_channels: int = 2,
+                       baseline: float = 1000.0,
+                       noise_sd: float = 3.0,
+                       drift: float = 20.0,
+                       drift_period: int = 30 * DEFAULT_SAMPLING_RATE,
+                       spacing: int = 60000,
+                       water_fraction: float = 0.2,
+                       tumor_height: tuple[float, float] = (80, 300),
+                       water_height: tuple[float, float] = (40, 55),
+                       water_dip: float = 70,
+                       peak_width: int = 300,
+                       seed: int = 0) -> dict:
+
+    rng = np.random.default_rng(seed)
+    truth = []
+    channel_events = []
+    for _ in range(n_channels):
+        tumor, water = place_events(n_samples, spacing, water_fraction, rng)
+        tumor_heights = rng.uniform(*tumor_height, len(tumor))
+        water_heights = rng.uniform(*water_height, len(water))
+        channel_events.append((tumor, tumor_heights, water, water_heights))
+        truth.append({"tumor": tumor, "water": water})
+
+    dip_offset = 3000
+    dip_width = 600
+
+    with open(path, "wb") as out:
+        for start in range(0, n_samples, CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, n_samples)
+            t = np.arange(start, end)
+            frames = np.empty((end - start, n_channels), dtype=np.int16)
+
+            for channel, (tumor, tumor_heights, water, water_heights) in enumerate(channel_events):
+                x = baseline + drift * np.sin(2 * np.pi * (t / drift_period + channel / n_channels))
+                x += rng.normal(0, noise_sd, end - start)
+
+                bumps = [(tumor, tumor_heights, peak_width), (water, water_heights, peak_width),
+                         (water + dip_offset, np.full(len(water), -water_dip), dip_width)]
+                for centers, heights, width in bumps:
+                    first, last = np.searchsorted(centers, [start - 4 * width, end + 4 * width])
+                    for center, height in zip(centers[first:last], heights[first:last]):
+                        lo, hi = max(start, center - 4 * width), min(end, center + 4 * width)
+                        x[lo - start:hi - start] += height * np.exp(-0.5 * ((t[lo - start:hi - start] - center) / width) ** 2)
+
+                frames[:, channel] = np.clip(np.rint(x), -32768, 32767)
+
+            frames.tofile(out)
+
+    meta = {
+        "n_samples": n_samples,
+        "n_channels": n_channels,
+        "seed": seed,
+        "truth": [{kind: positions.tolist() for kind, positions in channel.items()} for channel in truth],
+    }
+    with open(truth_path(path), "w") as file:
+        json.dump(meta, file)
+
+    return meta
+
+
+def truth_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".truth.json"
+
+
+def load_truth(path: str) -> dict:
+    with open(truth_path(path)) as file:
+        meta = json.load(file)
+    meta["truth"] = [{kind: np.asarray(positions, dtype=np.int64) for kind, positions in channel.items()}
+                     for channel in meta["truth"]]
+    return meta
+
+
+def match_events(detected: np.ndarray, expected: np.ndarray, tolerance: int) -> dict:
+    detected = np.sort(np.asarray(detected, dtype=np.int64))
+    expected = np.asarray(expected, dtype=np.int64)
+
+    if len(detected) == 0 or len(expected) == 0:
+        hits = 0
+    else:
+        nearest = np.clip(np.searchsorted(detected, expected), 1, len(detected) - 1)
+        distance = np.minimum(np.abs(detected[nearest - 1] - expected), np.abs(detected[nearest] - expected))
+        if len(detected) == 1:
+            distance = np.abs(detected[0] - expected)
+        hits = int(np.count_nonzero(distance <= tolerance))
+
+    return {
+        "expected": len(expected),
+        "detected": len(detected),
+        "matched": hits,
+        "recall": hits / len(expected) if len(expected) else 1.0,
+        "precision": min(hits, len(detected)) / len(detected) if len(detected) else 1.0,
+    }
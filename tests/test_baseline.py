@@ -0,0 +1,23 @@
+import numpy as np
+from algorithms import compute_baseline, compute_baseline_histogram
+
+
+def same_bits(a, b) -> bool:
+    return np.float64(a).tobytes() == np.float64(b).tobytes()
+
+
+def test_histogram_baseline_matches_percentile_and_median():
+    rng = np.random.default_rng(0)
+    signals = [
+        rng.normal(1000, 25, 200_000).astype(np.int16),
+        rng.normal(0, 3, 200_001).astype(np.int16),
+        # a skewed tail, so the 5% and 95% cuts fall between distinct values
+        np.concatenate([rng.normal(-200, 5, 150_000), rng.exponential(400, 50_000)]).astype(np.int16),
+        # the 5% cut lerps from -32768 to 0, a difference numpy wraps in int16 and so keeps the low values
+        np.concatenate([np.full(2, -32768), np.arange(28)]).astype(np.int16),
+        np.array([-32768, 32767] * 50 + [0] * 7, dtype=np.int16),
+        np.full(1000, -7, dtype=np.int16),
+    ]
+    signals += [rng.integers(-32768, 32768, n, dtype=np.int16) for n in (1, 2, 3, 19, 20, 1001)]
+    for signal in signals:
+        assert same_bits(compute_baseline_histogram(signal), compute_baseline(signal))
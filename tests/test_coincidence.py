@@ -0,0 +1,32 @@
+import numpy as np
+from coincidence import coincidences, match_peaks, two_pointer_pairs
+
+
+def test_growing_gap_chain_pairs_neighbours():
+    # alternating channels with ever wider gaps, all within the tolerance: one crowded cluster the walk crosses once
+    positions = np.cumsum(np.arange(1, 200_001))
+    a = positions[0::2]
+    b = positions[1::2]
+    pair_a, pair_b = match_peaks(a, b, tolerance=int(positions[-1]))
+    assert np.array_equal(pair_a, np.arange(len(a)))
+    assert np.array_equal(pair_b, np.arange(len(b)))
+
+
+def test_matches_the_plain_walk():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        a = np.sort(rng.integers(0, 2000, rng.integers(0, 40)))
+        b = np.sort(rng.integers(0, 2000, rng.integers(0, 40)))
+        tolerance = int(rng.integers(0, 80))
+        pair_a, pair_b = match_peaks(a, b, tolerance)
+        walk_a, walk_b = two_pointer_pairs(a, b, tolerance)
+        assert np.array_equal(pair_a, walk_a) and np.array_equal(pair_b, walk_b)
+        assert np.all(np.abs(b[pair_b] - a[pair_a]) <= tolerance)
+
+
+def test_counts_and_lags():
+    result = coincidences(np.array([100, 500, 900]), np.array([104, 880, 2000]), tolerance=30)
+    assert result["matched"] == 2
+    assert result["lags"].tolist() == [4, -20]
+    assert result["unmatched_a"].tolist() == [500]
+    assert result["unmatched_b"].tolist() == [2000]
@@ -0,0 +1,27 @@
+import numpy as np
+from candidate_store import CandidateStore
+from detection import process_file_parallel, process_frames
+from synthetic import generate_recording
+
+
+def test_parallel_matches_serial(tmp_path):
+    path = str(tmp_path / "recording.bin")
+    generate_recording(path, 1_500_000, seed=4)
+    frames = np.fromfile(path, dtype=np.int16).reshape(-1, 2)
+
+    for engine in ("histogram", "rolling"):
+        serial_candidates = CandidateStore(2)
+        parallel_candidates = CandidateStore(2)
+        serial = process_frames(frames, baseline_engine=engine, candidates=serial_candidates)
+        # several workers, so shards can finish out of order
+        parallel = process_file_parallel(path, n_workers=3, baseline_engine=engine, candidates=parallel_candidates)
+
+        for (tumor, water, baseline), (serial_tumor, serial_water, serial_baseline) in zip(parallel, serial):
+            assert np.array_equal(tumor, serial_tumor)
+            assert np.array_equal(water, serial_water)
+            assert np.array_equal(baseline.breakpoints, serial_baseline.breakpoints)
+            assert np.array_equal(baseline.values, serial_baseline.values)
+        for sections, serial_sections in zip(parallel_candidates.sections, serial_candidates.sections):
+            assert sorted(sections) == sorted(serial_sections)
+            for start in sections:
+                assert np.array_equal(sections[start], serial_sections[start])
@@ -0,0 +1,74 @@
+import os
+import time
+import numpy as np
+import pytest
+
+pytest.importorskip("PySide6")
+pytest.importorskip("matplotlib")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication, QFileDialog
+from result_cache import ResultCache
+from synthetic import generate_recording
+
+UPDATE_TARGET_MS = 30
+
+
+def wait_for(app, condition, timeout: float = 120):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline
+        app.processEvents()
+        time.sleep(0.01)
+
+
+def test_pans_and_toggles_are_blitted(tmp_path, monkeypatch):
+    app = QApplication.instance() or QApplication([])
+    import main
+
+    path = str(tmp_path / "recording.bin")
+    generate_recording(path, 2_000_000, seed=3)
+    monkeypatch.setattr(QFileDialog, "getOpenFileName", staticmethod(lambda *args, **kwargs: (path, "")))
+
+    window = main.SignalAnalyzer()
+    window.result_cache = ResultCache(str(tmp_path / "cache"))
+    window.resize(1200, 800)
+    window.show()
+    try:
+        window.load_data()
+        wait_for(app, lambda: window.status_label.text() == "Peaks are ready"
+                 and window.signal_pyramids is not None and window.baseline_pyramids is not None)
+        window.baseline_checkbox.setChecked(True)
+        window.water_checkbox.setChecked(True)
+
+        def update(action) -> float:
+            started = time.perf_counter()
+            action()
+            window.plot_current_range()
+            app.processEvents()
+            return (time.perf_counter() - started) * 1000
+
+        span = len(window.source) // 10
+
+        def pan_to(start):
+            window.plotting_start_index = start
+            window.plotting_end_index = start + span
+
+        # the first view of a span sets the axes, a second pass over the same pans finds them wide enough
+        starts = [step * span // 8 for step in range(40)]
+        for start in starts:
+            update(lambda: pan_to(start))
+
+        full_draws = []
+        window.canvas.mpl_connect("draw_event", full_draws.append)
+        pans = [update(lambda: pan_to(start)) for start in starts]
+        toggles = []
+        for _ in range(10):
+            toggles.append(update(lambda: window.signal_checkboxes[1].toggle()))
+            toggles.append(update(lambda: window.peaks_checkbox.toggle()))
+
+        assert not full_draws
+        assert np.median(pans) < UPDATE_TARGET_MS
+        assert np.median(toggles) < UPDATE_TARGET_MS
+    finally:
+        window.close()
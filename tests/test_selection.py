@@ -0,0 +1,37 @@
+import numpy as np
+from scipy.signal import find_peaks
+from algorithms import select_by_distance, select_peaks
+from candidate_store import CandidateStore
+from detection import crop_section, peak_params, process_frames
+from synthetic import generate_recording
+
+
+def test_distance_rule_matches_find_peaks():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        # few distinct levels, so equal heights have to resolve the way find_peaks does
+        x = rng.integers(0, rng.integers(2, 20), rng.integers(1, 400)).astype(np.float64)
+        distance = rng.uniform(1, 40)
+        peaks, _ = find_peaks(x)
+        expected, _ = find_peaks(x, distance=distance)
+        assert np.array_equal(peaks[select_by_distance(peaks, x[peaks], distance)], expected)
+
+
+def test_reselection_matches_fresh_selection(tmp_path):
+    path = str(tmp_path / "recording.bin")
+    generate_recording(path, 1_000_000, seed=2)
+    frames = np.fromfile(path, dtype=np.int16).reshape(-1, 2)
+    store = CandidateStore(2)
+    process_frames(frames, candidates=store)
+
+    # the last two only change prominence and water thresholds, so they reuse the cached spacing
+    for params in (peak_params(distance=5000, prominence=10),
+                   peak_params(height_sd=3, distance=30000),
+                   peak_params(height_sd=3, distance=30000, prominence=80),
+                   peak_params(height_sd=3, distance=30000, water_dip_sd=1)):
+        for channel, (tumor, water) in enumerate(store.select_all(params)):
+            sections = store.sections[channel]
+            fresh = [crop_section(start, store.ends[start], *select_peaks(sections[start], **params))
+                     for start in sorted(sections)]
+            assert np.array_equal(tumor, np.concatenate([section[0] for section in fresh]))
+            assert np.array_equal(water, np.concatenate([section[1] for section in fresh]))
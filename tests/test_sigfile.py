@@ -0,0 +1,40 @@
+import json
+import numpy as np
+import pytest
+from sigfile import COMPRESSIONS, HEADER_LENGTH, MAGIC, SigFile, SigWriter
+from signal_source import SignalSource
+
+
+def test_round_trip_is_lossless(tmp_path):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(-32768, 32768, (10_000, 3), dtype=np.int16)
+    # full-scale jumps, so every delta between neighbours wraps around in int16
+    frames[:1000, 0] = np.tile([-32768, 32767], 500)
+    frames[1000:2000, 1] = 32767
+    frames[2000:3000, 2] = -32768
+
+    for compression in COMPRESSIONS:
+        path = str(tmp_path / f"{compression}.sig")
+        with SigWriter(path, 3, 50000, chunk_size=1024, compression=compression) as writer:
+            # writes that straddle chunks, and a partial chunk at the end
+            for start in range(0, len(frames), 777):
+                writer.write(frames[start:start + 777])
+
+        with SignalSource.from_sig(path) as source:
+            assert len(source) == len(frames)
+            assert source.sampling_rate == 50000
+            assert np.array_equal(np.asarray(source.frames), frames)
+            for channel in range(3):
+                assert np.array_equal(source.channel(channel)[1000:3333], frames[1000:3333, channel])
+                assert np.array_equal(source.channel(channel)[[-1, 0, 5000]], frames[[-1, 0, 5000], channel])
+        assert source.handle.file.closed
+
+
+def test_scaled_samples_are_rejected(tmp_path):
+    path = tmp_path / "scaled.sig"
+    header = json.dumps({"version": 1, "sampling_rate": 50000, "channel_names": ["adc1"], "dtype": "<i2",
+                         "chunk_size": 1024, "compression": "none", "scale": 0.5}).encode()
+    # the header is checked before the chunk index is read
+    path.write_bytes(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+    with pytest.raises(ValueError, match="scaled"):
+        SigFile(str(path))
@@ -0,0 +1,43 @@
+import numpy as np
+from algorithms import compute_baseline, rolling_baseline
+from synthetic import generate_recording
+from whole_signal import BOUNDARY_SEARCH, CHUNK_SIZE, chunk_bounds, process_frames_whole
+
+
+def test_constant_channel_keeps_chunks_bounded():
+    rng = np.random.default_rng(0)
+    frames = np.zeros((10_000_000, 2), dtype=np.int16)
+    frames[:, 1] = rng.integers(-100, 100, len(frames))
+    bounds = chunk_bounds(frames)
+    assert len(bounds) > 1
+    assert max(end - start for start, end in bounds) <= CHUNK_SIZE + BOUNDARY_SEARCH
+
+
+def test_plateau_across_a_chunk_boundary(tmp_path):
+    path = str(tmp_path / "recording.bin")
+    generate_recording(path, 1_000_000, seed=1)
+    frames = np.fromfile(path, dtype=np.int16).reshape(-1, 2)
+    frames[:, 1] = 0
+    # longer than the boundary search, so the cut at 100000 has to fall inside it
+    frames[98_000:106_000, 0] = 1500
+
+    chunked = process_frames_whole(frames, chunk_size=100_000)
+    single = process_frames_whole(frames, chunk_size=len(frames))
+    for (tumor, water, _), (single_tumor, single_water, _) in zip(chunked, single):
+        assert np.array_equal(tumor, single_tumor)
+        assert np.array_equal(water, single_water)
+    assert (98_000 + 105_999) // 2 in chunked[0][0]
+
+
+def test_rolling_baseline_matches_each_window():
+    rng = np.random.default_rng(3)
+    signal = (rng.normal(0, 30, 300_000) + np.linspace(-500, 500, 300_000)).astype(np.int16)
+    signal[::997] = 32767
+    # overlapping windows slide the histogram, windows further apart than their width rebuild it
+    for window, step in ((40_000, 5_000), (4_000, 10_000)):
+        for start, end in ((0, len(signal)), (123_456, 200_000)):
+            breakpoints, values = rolling_baseline(signal, window, step, start, end)
+            for piece_start, value in zip(breakpoints, values):
+                center = int(piece_start) + step // 2
+                expected = compute_baseline(signal[max(0, center - window // 2):center + window // 2])
+                assert np.float64(value).tobytes() == np.float64(expected).tobytes()
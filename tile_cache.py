@@ -0,0 +1,176 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+TILE_BINS = 512
+BASE_BIN = 64
+FACTOR = 4
+DEFAULT_MAX_BYTES = 64 * 1024**2
+
+
+def bin_size(level: int, base_bin: int = BASE_BIN, factor: int = FACTOR) -> int:
+    return base_bin * factor ** level
+
+
+def select_level(n_samples: int, canvas_width: int, base_bin: int = BASE_BIN, factor: int = FACTOR) -> int | None:
+    selected = None
+    level = 0
+    while n_samples // bin_size(level, base_bin, factor) >= max(canvas_width, 1):
+        selected = level
+        level += 1
+    return selected
+
+
+def compute_tile(signal, pyramid, level: int, index: int, tile_bins: int = TILE_BINS,
+                 base_bin: int = BASE_BIN, factor: int = FACTOR) -> tuple[np.ndarray, np.ndarray]:
+    size = bin_size(level, base_bin, factor)
+    start = index * tile_bins * size
+    end = min(start + tile_bins * size, len(signal))
+    if end <= start:
+        empty = np.array([], dtype=getattr(signal, "dtype", float))
+        return empty, empty
+
+    if pyramid is not None and pyramid.levels and (pyramid.base_bin, pyramid.factor) == (base_bin, factor):
+        # the finest saved level at or below the tile's level, folded up to the tile's bin size
+        used = min(level, len(pyramid.levels) - 1)
+        group = factor ** (level - used)
+        used_size = pyramid.bin_size(used)
+        level_min, level_max = pyramid.levels[used]
+        y_min = level_min[start // used_size:-(-end // used_size)]
+        y_max = level_max[start // used_size:-(-end // used_size)]
+    else:
+        group = size
+        y_min = y_max = np.asarray(signal[start:end])
+
+    bins = np.arange(0, len(y_min), group)
+    return np.minimum.reduceat(y_min, bins), np.maximum.reduceat(y_max, bins)
+
+
+class TileCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, tile_bins: int = TILE_BINS,
+                 base_bin: int = BASE_BIN, factor: int = FACTOR):
+        self.max_bytes = max_bytes
+        self.tile_bins = tile_bins
+        self.base_bin = base_bin
+        self.factor = factor
+        self.tiles = OrderedDict()
+        self.nbytes = 0
+        self.epoch = 0
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def tile_samples(self, level: int) -> int:
+        return self.tile_bins * bin_size(level, self.base_bin, self.factor)
+
+    def generation(self, kind: str) -> tuple[int, int]:
+        with self.lock:
+            return self.epoch, self.generations.get(kind, 0)
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+            self.nbytes = 0
+            self.epoch += 1
+
+    def discard(self, kind: str):
+        with self.lock:
+            for key in [key for key in self.tiles if key[0] == kind]:
+                self.nbytes -= self.tile_bytes(self.tiles.pop(key))
+            self.generations[kind] = self.generations.get(kind, 0) + 1
+
+    @staticmethod
+    def tile_bytes(tile) -> int:
+        y_min, y_max, _ = tile
+        return y_min.nbytes + y_max.nbytes
+
+    def get(self, key: tuple, n_samples: int):
+        with self.lock:
+            tile = self.tiles.get(key)
+            # a tile cut short by the end of a growing file is stale once more samples arrive
+            if tile is None or tile[2] != n_samples:
+                return None
+            self.tiles.move_to_end(key)
+            return tile
+
+    def put(self, key: tuple, tile: tuple, generation: tuple[int, int]):
+        with self.lock:
+            # tiles computed before a clear or discard belong to data that is no longer shown
+            if (self.epoch, self.generations.get(key[0], 0)) != generation:
+                return
+            previous = self.tiles.pop(key, None)
+            if previous is not None:
+                self.nbytes -= self.tile_bytes(previous)
+            self.tiles[key] = tile
+            self.nbytes += self.tile_bytes(tile)
+            while self.nbytes > self.max_bytes and len(self.tiles) > 1:
+                _, evicted = self.tiles.popitem(last=False)
+                self.nbytes -= self.tile_bytes(evicted)
+
+    def tile(self, kind: str, channel: int, signal, pyramid, level: int, index: int, generation: tuple[int, int] = None):
+        if generation is None:
+            generation = self.generation(kind)
+        key = (kind, channel, level, index)
+        start = index * self.tile_samples(level)
+        n_samples = max(0, min(start + self.tile_samples(level), len(signal)) - start)
+
+        tile = self.get(key, n_samples)
+        if tile is not None:
+            return tile
+
+        tile = (*compute_tile(signal, pyramid, level, index, self.tile_bins, self.base_bin, self.factor), n_samples)
+        self.put(key, tile, generation)
+        return tile
+
+    def query(self, kind: str, channel: int, signal, pyramid, start: int, end: int,
+              canvas_width: int) -> tuple[np.ndarray, np.ndarray] | None:
+        level = select_level(end - start, canvas_width, self.base_bin, self.factor)
+        if level is None:
+            return None
+
+        size = bin_size(level, self.base_bin, self.factor)
+        tile_samples = self.tile_samples(level)
+        first_tile = start // tile_samples
+        tiles = [self.tile(kind, channel, signal, pyramid, level, index)
+                 for index in range(first_tile, (end - 1) // tile_samples + 1)]
+
+        first_bin = start // size - first_tile * self.tile_bins
+        n_bins = -(-end // size) - start // size
+        y_min = np.concatenate([tile[0] for tile in tiles])[first_bin:first_bin + n_bins]
+        y_max = np.concatenate([tile[1] for tile in tiles])[first_bin:first_bin + n_bins]
+
+        # the level can have up to factor times more bins than the canvas has pixels; they are folded in groups aligned
+        # to the signal, so a pan does not reshuffle the envelope
+        first = start // size
+        group = max(1, len(y_min) // max(canvas_width, 1))
+        edges = np.flatnonzero((np.arange(len(y_min)) + first) % group == 0)
+        if len(edges) == 0 or edges[0] != 0:
+            edges = np.concatenate(([0], edges))
+        ends = np.append(edges[1:], len(y_min))
+        y_min = np.minimum.reduceat(y_min, edges)
+        y_max = np.maximum.reduceat(y_max, edges)
+
+        x_mid = np.minimum((first + (edges + ends) / 2) * size, len(signal) - 1)
+        y_minmax = np.empty(2 * len(y_min), dtype=y_min.dtype)
+        y_minmax[0::2] = y_min
+        y_minmax[1::2] = y_max
+        return np.repeat(x_mid, 2), y_minmax
+
+    def plan(self, start: int, end: int, length: int, canvas_width: int, direction: int) -> list[tuple[int, int]]:
+        level = select_level(end - start, canvas_width, self.base_bin, self.factor)
+        if level is None:
+            return []
+
+        # a full view ahead in the direction of travel, half a view each way when zooming
+        span = end - start
+        ranges = []
+        if direction >= 0:
+            ranges.append((end, min(length, end + (span if direction else span // 2))))
+        if direction <= 0:
+            ranges.append((max(0, start - (span if direction else span // 2)), start))
+
+        tile_samples = self.tile_samples(level)
+        tiles = []
+        for range_start, range_end in ranges:
+            indices = range(range_start // tile_samples, -(-range_end // tile_samples))
+            tiles.extend((level, index) for index in (indices if range_start >= end else reversed(indices)))
+        return tiles
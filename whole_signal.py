@@ -0,0 +1,168 @@
+import time
+import numpy as np
+from algorithms import CANDIDATE_DTYPE, gap_prominences, select_peaks, sliding_min_at
+from baseline import PiecewiseBaseline
+from detection import (
+    CANDIDATE_HEIGHT_SD, LOCAL_DIST, SECTION_SIZE, DetectionCancelled, peak_params, rolling_pieces
+)
+from profiling import PipelineProfile, stage
+from signal_stats import SignalStats, channel_block, frame_stats
+
+CHUNK_SIZE = 1 << 21
+BOUNDARY_SEARCH = 4096
+
+
+def chunk_end(frames, end: int, search: int = BOUNDARY_SEARCH) -> int:
+    # Prefer a boundary where every channel moves, so no plateau straddles it. Channels flat over the whole search
+    # window have no peak there to split and are left out. Without such a sample the boundary stays where it is and
+    # the scans' overlap margin sees any shorter plateau across it whole.
+    signal_length = len(frames)
+    if end >= signal_length:
+        return signal_length
+    block = np.asarray(frames[end - 1:min(end - 1 + search, signal_length)])
+    changed = block[1:] != block[:-1]
+    moving = np.any(changed, axis=0)
+    if not np.any(moving):
+        return end
+    boundaries = np.flatnonzero(np.all(changed[:, moving], axis=1))
+    return end + int(boundaries[0]) if len(boundaries) else end
+
+
+def chunk_bounds(frames, chunk_size: int = CHUNK_SIZE) -> list[tuple[int, int]]:
+    bounds = []
+    start = 0
+    while start < len(frames):
+        end = chunk_end(frames, min(start + chunk_size, len(frames)))
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def edge_records(heights: np.ndarray) -> np.ndarray:
+    # strictly higher than everything before it, or than everything after it
+    from_left = heights > np.concatenate(([-np.inf], np.maximum.accumulate(heights)[:-1]))
+    from_right = heights > np.concatenate((np.maximum.accumulate(heights[::-1])[:-1], [-np.inf]))[::-1]
+    return from_left | from_right
+
+
+class ChannelScan:
+    def __init__(self, baseline: PiecewiseBaseline, signal_total_sd: float, local_dist: int = LOCAL_DIST):
+        self.baseline = baseline
+        self.thresholds = baseline.values + CANDIDATE_HEIGHT_SD * signal_total_sd
+        # one scalar floor keeps every local maximum that any per-sample threshold could accept
+        self.floor = float(np.nanmin(self.thresholds)) if len(self.thresholds) else np.inf
+        self.local_dist = local_dist
+        self.peaks = []
+        self.heights = []
+        self.local_mins = []
+        self.gap_mins = []
+        self.open_min = np.inf
+
+    def prune(self, peaks: np.ndarray, heights: np.ndarray) -> np.ndarray:
+        # A maximum below its own piece's threshold can still be the nearest higher peak of an accepted one, but only
+        # of one in another piece, and then it is the highest of its piece towards that side. The rest only matter
+        # through the minima between them, which the merged gaps keep.
+        pieces = np.searchsorted(self.baseline.breakpoints, peaks, side="right") - 1
+        keep = self.thresholds[pieces] <= heights
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(pieces)) + 1, [len(peaks)]))
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            keep[first:last] |= edge_records(heights[first:last])
+        return np.flatnonzero(keep)
+
+    def add(self, x: np.ndarray, offset: int, start: int, end: int, profile: PipelineProfile = None):
+        from scipy.signal import find_peaks as scipy_find_peaks
+
+        # x holds [offset, offset + len(x)), covering [start, end) plus local_dist on each side where the signal has it;
+        # searching all of it finds a plateau cut by the boundary in both neighbouring chunks at the same middle sample,
+        # and only the chunk holding that sample keeps it
+        with stage(profile, "scipy_peaks"):
+            peaks, _ = scipy_find_peaks(x, height=self.floor)
+        peaks = peaks + offset
+        peaks = peaks[(peaks >= start) & (peaks < end)]
+
+        with stage(profile, "peak_features"):
+            gaps = np.minimum.reduceat(x[start - offset:end - offset], np.concatenate(([0], peaks - start)))
+            kept = self.prune(peaks, x[peaks - offset])
+            peaks = peaks[kept]
+            gaps = np.minimum.reduceat(gaps, np.concatenate(([0], kept + 1)))
+
+            # the gap between the last peak of one chunk and the first of the next spans the boundary
+            if len(peaks):
+                self.gap_mins.append(np.concatenate(([min(self.open_min, gaps[0])], gaps[1:-1])))
+                self.open_min = gaps[-1]
+            else:
+                self.open_min = min(self.open_min, gaps[0])
+
+            self.peaks.append(peaks)
+            self.heights.append(x[peaks - offset])
+            self.local_mins.append(sliding_min_at(x, self.local_dist, peaks - offset))
+
+    def candidates(self, baseline: PiecewiseBaseline, signal_total_sd: float, profile: PipelineProfile = None) -> np.ndarray:
+        peaks = np.concatenate(self.peaks) if self.peaks else np.array([], dtype=np.int64)
+        candidates = np.zeros(len(peaks), dtype=CANDIDATE_DTYPE)
+        if len(peaks) == 0:
+            return candidates
+
+        with stage(profile, "peak_features"):
+            candidates["index"] = peaks
+            candidates["height"] = np.concatenate(self.heights)
+            candidates["baseline"] = baseline.value_at(peaks)
+            candidates["prominence"] = gap_prominences(candidates["height"],
+                                                       np.concatenate(self.gap_mins + [[self.open_min]]))
+            candidates["local_min"] = np.concatenate(self.local_mins)
+            candidates["sd"] = signal_total_sd
+
+        return candidates[candidates["baseline"] + CANDIDATE_HEIGHT_SD * signal_total_sd <= candidates["height"]]
+
+
+def process_frames_whole(frames,
+                         section_size: int = SECTION_SIZE,
+                         chunk_size: int = CHUNK_SIZE,
+                         profile: PipelineProfile = None,
+                         progress=None,
+                         is_cancelled=None,
+                         candidates=None,
+                         stats: SignalStats = None) -> list:
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    signal_length, n_channels = frames.shape
+
+    if stats is None:
+        with stage(profile, "signal_stats"):
+            stats = frame_stats(frames, section_size)
+    total_signal_sds = stats.sds()
+
+    with stage(profile, "rolling_baseline"):
+        baselines = [PiecewiseBaseline(*rolling_pieces(frames[:, channel], 0, signal_length, section_size, 0), signal_length)
+                     for channel in range(n_channels)]
+
+    scans = [ChannelScan(baseline, sd) for baseline, sd in zip(baselines, total_signal_sds)]
+
+    bounds = chunk_bounds(frames, chunk_size)
+    for done, (start, end) in enumerate(bounds, 1):
+        if is_cancelled is not None and is_cancelled():
+            raise DetectionCancelled()
+
+        offset = max(0, start - LOCAL_DIST)
+        with stage(profile, "read_frames"):
+            block = channel_block(frames, offset, min(signal_length, end + LOCAL_DIST)).astype(np.float64)
+        for scan, x in zip(scans, block):
+            scan.add(x, offset, start, end, profile)
+
+        if progress is not None:
+            progress(done, len(bounds))
+
+    results = []
+    channel_candidates = []
+    for scan, baseline, sd in zip(scans, baselines, total_signal_sds):
+        channel_candidates.append(scan.candidates(baseline, sd, profile))
+        tumor_peaks, water_peaks = select_peaks(channel_candidates[-1], **peak_params(), profile=profile)
+        results.append((tumor_peaks, water_peaks, baseline))
+
+    if candidates is not None:
+        candidates.add(0, channel_candidates, signal_length)
+    if profile is not None:
+        profile.add_section(0, signal_length * n_channels, time.perf_counter() - wall_start, time.thread_time() - cpu_start,
+                            sum(len(r[0]) for r in results), sum(len(r[1]) for r in results))
+
+    return results
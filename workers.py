@@ -1,83 +1,418 @@
-from PySide6.QtCore import QObject, Signal
-import numpy as np
-from algorithms import find_peaks, compute_baseline
+import os
+import threading
+import time
+from PySide6.QtCore import QObject, QThread, Signal
+from detection import (
+    BASELINE_ENGINE, DETECTION_MODE, SECTION_SIZE, DetectionCancelled, IncrementalDetector, assemble_partial,
+    process_frames, process_file_parallel
+)
+from whole_signal import process_frames_whole
+from profiling import PipelineProfile, dump_report, format_report, profile_call, run_report
+from signal_source import DEFAULT_N_CHANNELS, SignalSource
+from pyramid import MinMaxPyramid, load_pyramids, save_pyramids
+from converter import ConversionCancelled, bin_to_sig, csv_to_bin
+from peak_export import ExportCancelled, export_peaks
+from tile_cache import TileCache
+from candidate_store import CandidateStore
+from result_store import ResultStore, new_session_dir
 
 class PeakWorker(QObject):
-    finished = Signal(np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray)
+    finished = Signal(str, object)
+    partial = Signal(str, list)
+    cancelled = Signal(str)
     error = Signal(str)
     progress = Signal(int, str)
+    metrics = Signal(dict)
 
-    def __init__(self, signal_1: np.ndarray, signal_2: np.ndarray):
+    def __init__(self,
+                 source: SignalSource,
+                 n_workers: int = 1,
+                 baseline_engine: str = BASELINE_ENGINE,
+                 profile_dir: str = None,
+                 file_path: str = None,
+                 mode: str = DETECTION_MODE,
+                 session_dir: str = None):
         super().__init__()
-        self.signal_1 = signal_1
-        self.signal_2 = signal_2
-        self.section_size = 200000
-
-    def process_signal(self, signal: np.ndarray):
-        signal_length = len(signal)
-
-        baselines = []
-        all_tumor_peaks = []
-        all_water_peaks = []
-        total_signal_sd = np.std(signal)
-
-        for sect in range(0, signal_length, self.section_size):
-            start = sect
-            end = min(start + self.section_size, signal_length)
-            section = signal[start:end]
-
-            section_sd = np.std(section)
-
-            section_bl = compute_baseline(section)
-            baselines.append(np.full_like(section, section_bl, dtype=float))
-
-            extend = 10000
-            start_extended = max(0, start - extend)
-            end_extended = min(signal_length, end + extend)
-            extended_section = signal[start_extended:end_extended]
-
-            tumor_peaks_from_ext, water_peaks_from_ext = find_peaks(
-                extended_section,
-                baseline=section_bl,
-                section_sd=section_sd,
-                signal_total_sd=total_signal_sd
-            )
+        self.source = source
+        self.n_workers = n_workers
+        self.baseline_engine = baseline_engine
+        self.mode = mode
+        self.profile_dir = profile_dir
+        self.file_path = file_path or source.file_path
+        self.section_size = SECTION_SIZE
+        self.partial_interval = 0.25
+        self.visible_range = None
+        self.sections = {}
+        self.store = ResultStore.create(session_dir or new_session_dir(), source.n_channels, self.section_size)
+        self.last_partial = 0.0
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
 
-            tumor_peaks_from_ext = tumor_peaks_from_ext + start_extended
-            water_peaks_from_ext = water_peaks_from_ext + start_extended
+    def is_cancelled(self):
+        return self._cancelled
 
-            tumor_peaks = tumor_peaks_from_ext[(tumor_peaks_from_ext >= start) & (tumor_peaks_from_ext < end)]
-            water_peaks = water_peaks_from_ext[(water_peaks_from_ext >= start) & (water_peaks_from_ext < end)]
+    def set_visible_range(self, start: int, end: int):
+        self.visible_range = (start, end)
 
-            all_tumor_peaks.extend(tumor_peaks)
-            all_water_peaks.extend(water_peaks)
+    def get_visible_range(self):
+        return self.visible_range
 
-        full_baseline = np.concatenate(baselines)
-        return np.array(all_tumor_peaks), np.array(all_water_peaks), full_baseline
+    def on_section(self, start: int, results: list):
+        self.sections[start] = results
+        if time.perf_counter() - self.last_partial >= self.partial_interval:
+            self.last_partial = time.perf_counter()
+            self.partial.emit(self.file_path, [
+                assemble_partial(len(self.source), {section: results[channel] for section, results in self.sections.items()},
+                                 self.section_size)
+                for channel in range(self.source.n_channels)
+            ])
 
+    def is_parallel(self):
+        return self.source.is_memmapped and self.n_workers > 1 and self.mode != "whole"
+
+    def detect(self, profile: PipelineProfile):
+        if self.mode == "whole":
+            self.progress.emit(0, f"Processing {self.source.n_channels} whole signals...")
+            return process_frames_whole(
+                self.source.frames,
+                self.section_size,
+                profile=profile,
+                progress=lambda done, total: self.progress.emit(int(done / total * 99), f"Detecting peaks: chunk {done}/{total}"),
+                is_cancelled=self.is_cancelled,
+                candidates=self.store
+            )
+
+        options = {
+            "section_size": self.section_size,
+            "baseline_engine": self.baseline_engine,
+            "progress": lambda done, total: self.progress.emit(int(done / total * 99), f"Detecting peaks: section {done}/{total}"),
+            "profile": profile,
+            "on_section": self.on_section,
+            "is_cancelled": self.is_cancelled,
+            "visible_range": self.get_visible_range,
+            "candidates": self.store,
+        }
+
+        if self.is_parallel():
+            self.progress.emit(0, f"Processing {self.source.n_channels} signals on {self.n_workers} cores...")
+            return process_file_parallel(
+                self.source.file_path,
+                n_channels=self.source.n_channels,
+                dtype=self.source.dtype,
+                offset=self.source.offset,
+                n_workers=self.n_workers,
+                **options
+            )
+
+        self.progress.emit(0, f"Processing {self.source.n_channels} signals...")
+        return process_frames(self.source.frames, **options)
 
     def run(self):
         try:
             print("Baseline computation and peak detection started.")
 
-            self.progress.emit(0, "Processing signal 1...")
-            tumor_peaks_1, water_peaks_1, baseline_1 = self.process_signal(self.signal_1)
+            wall_start = time.perf_counter()
+            cpu_start = time.thread_time()
+            profile = PipelineProfile()
+
+            run_name = os.path.splitext(os.path.basename(self.source.file_path or "signal"))[0] + time.strftime("-%Y%m%d-%H%M%S")
+            stats_path = os.path.join(self.profile_dir, run_name + ".prof") if self.profile_dir is not None else None
 
-            self.progress.emit(50, "Processing signal 2...")
-            tumor_peaks_2, water_peaks_2, baseline_2 = self.process_signal(self.signal_2)
+            results = profile_call(lambda: self.detect(profile), stats_path)
 
             print("Baseline computation and peak detection ended.")
 
+            report = run_report(
+                [profile],
+                time.perf_counter() - wall_start,
+                time.thread_time() - cpu_start,
+                file=self.source.file_path,
+                baseline_engine=self.baseline_engine,
+                mode=self.mode,
+                section_size=self.section_size,
+                n_channels=self.source.n_channels,
+                workers=self.n_workers if self.is_parallel() else 1
+            )
+            print(format_report(report))
+
+            if self.profile_dir is not None:
+                report["cprofile"] = stats_path
+                report_path = os.path.join(self.profile_dir, run_name + ".json")
+                try:
+                    dump_report(report, report_path)
+                    print("Detection profile saved to:", report_path)
+                except OSError as e:
+                    print("Could not save detection profile:", e)
+
+            self.metrics.emit(report)
             self.progress.emit(100, "Peaks detected")
 
-            self.finished.emit(
-                tumor_peaks_1,
-                tumor_peaks_2,
-                water_peaks_1,
-                water_peaks_2,
-                baseline_1,
-                baseline_2
+            # only the handle crosses threads; the window maps the arrays back from the session directory
+            self.store.close(results)
+            del results
+            self.finished.emit(self.file_path, self.store)
+
+        except DetectionCancelled:
+            print("Peak detection cancelled.")
+            self.store.remove()
+            self.cancelled.emit(self.file_path)
+
+        except Exception as e:
+            self.store.remove()
+            self.error.emit(str(e))
+
+
+class PyramidWorker(QObject):
+    finished = Signal(str, list)
+    error = Signal(str)
+
+    def __init__(self, file_path: str, signals: list, save_path: str = None):
+        super().__init__()
+        self.file_path = file_path
+        self.signals = signals
+        self.save_path = save_path
+
+    def run(self):
+        try:
+            pyramids = None
+            if self.save_path is not None:
+                pyramids = load_pyramids(self.save_path, self.file_path, len(self.signals[0]), len(self.signals))
+
+            if pyramids is None:
+                pyramids = [MinMaxPyramid.build(signal) for signal in self.signals]
+                if self.save_path is not None:
+                    try:
+                        save_pyramids(self.save_path, pyramids)
+                    except OSError as e:
+                        print("Could not save zoom levels:", e)
+
+            self.finished.emit(self.file_path, pyramids)
+
+        except Exception as e:
+            self.error.emit(str(e))
+
+        finally:
+            # baselines may be mapped from a session store that gets deleted once the window drops them
+            self.signals = None
+
+
+class TilePrefetchWorker(QObject):
+    finished = Signal()
+    error = Signal(str)
+
+    def __init__(self, tile_cache: TileCache):
+        super().__init__()
+        self.tile_cache = tile_cache
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self._running = True
+
+    def request(self, jobs: list):
+        # a new view replaces whatever was still queued for the previous one
+        with self.lock:
+            self.jobs = list(jobs)
+        self.wake.set()
+
+    def stop(self):
+        self._running = False
+        self.wake.set()
+
+    def next_job(self):
+        with self.lock:
+            if self.jobs:
+                return self.jobs.pop(0)
+            self.wake.clear()
+            return None
+
+    def run(self):
+        try:
+            while self._running:
+                job = self.next_job()
+                if job is None:
+                    self.wake.wait()
+                    continue
+                try:
+                    self.tile_cache.tile(*job)
+                except Exception as e:
+                    print("Error prefetching tile:", e)
+
+            self.finished.emit()
+
+        except Exception as e:
+            self.error.emit(str(e))
+
+
+class SelectionWorker(QObject):
+    selected = Signal(object, dict, list)
+    finished = Signal()
+    error = Signal(str)
+
+    def __init__(self):
+        super().__init__()
+        self.job = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self._running = True
+
+    def request(self, candidates, params: dict):
+        # only the latest thresholds matter, so a request still waiting is replaced
+        with self.lock:
+            self.job = (candidates, params)
+        self.wake.set()
+
+    def stop(self):
+        self._running = False
+        self.wake.set()
+
+    def next_job(self):
+        with self.lock:
+            job, self.job = self.job, None
+            if job is None:
+                self.wake.clear()
+            return job
+
+    def run(self):
+        while self._running:
+            job = self.next_job()
+            if job is None:
+                self.wake.wait()
+                continue
+            candidates, params = job
+            try:
+                self.selected.emit(candidates, params, candidates.select_all(params))
+            except Exception as e:
+                self.error.emit(str(e))
+            # candidates may be mapped from a session store that gets deleted once the window drops them
+            job = candidates = None
+
+        self.finished.emit()
+
+
+class StreamWorker(QObject):
+    update = Signal(str, int, list)
+    finished = Signal()
+    error = Signal(str)
+
+    def __init__(self, file_path: str, n_channels: int = DEFAULT_N_CHANNELS, baseline_engine: str = BASELINE_ENGINE,
+                 poll_interval_ms: int = 500):
+        super().__init__()
+        self.file_path = file_path
+        self.n_channels = n_channels
+        self.baseline_engine = baseline_engine
+        self.poll_interval_ms = poll_interval_ms
+        self.section_size = SECTION_SIZE
+        self._running = True
+
+    def stop(self):
+        self._running = False
+
+    def read_signals(self):
+        source = SignalSource.from_bin(self.file_path, n_channels=self.n_channels)
+        if len(source) == 0:
+            return None
+        return source.channels
+
+    def run(self):
+        try:
+            detectors = [IncrementalDetector(self.section_size, baseline_engine=self.baseline_engine)
+                         for _ in range(self.n_channels)]
+            length = 0
+
+            while self._running:
+                signals = self.read_signals()
+                if signals is not None and len(signals[0]) > length:
+                    length = len(signals[0])
+                    results = [detector.update(signal) for detector, signal in zip(detectors, signals)]
+                    self.update.emit(self.file_path, length, results)
+                QThread.msleep(self.poll_interval_ms)
+
+            signals = self.read_signals()
+            if signals is not None:
+                length = len(signals[0])
+                results = [detector.update(signal, final=True) for detector, signal in zip(detectors, signals)]
+                self.update.emit(self.file_path, length, results)
+
+            self.finished.emit()
+
+        except Exception as e:
+            self.error.emit(str(e))
+
+
+class ConvertWorker(QObject):
+    finished = Signal(str)
+    cancelled = Signal()
+    error = Signal(str)
+    progress = Signal(int, str)
+
+    def __init__(self, file_path: str, save_path: str, n_channels: int = DEFAULT_N_CHANNELS):
+        super().__init__()
+        self.file_path = file_path
+        self.save_path = save_path
+        self.n_channels = n_channels
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            options = {
+                "progress": lambda fraction: self.progress.emit(int(fraction * 100), f"Converting to {os.path.splitext(self.save_path)[1]}..."),
+                "is_cancelled": lambda: self._cancelled,
+            }
+            if self.file_path.lower().endswith(".bin"):
+                saved_file = bin_to_sig(self.file_path, self.save_path, self.n_channels, **options)
+            else:
+                saved_file = csv_to_bin(self.file_path, self.save_path, **options)
+            self.finished.emit(saved_file)
+
+        except ConversionCancelled:
+            self.cancelled.emit()
+
+        except Exception as e:
+            self.error.emit(str(e))
+
+
+class ExportWorker(QObject):
+    finished = Signal(str, int)
+    cancelled = Signal()
+    error = Signal(str)
+    progress = Signal(int, str)
+
+    def __init__(self, save_path: str, source: SignalSource, tumor_peaks: list, water_peaks: list, baselines: list,
+                 candidates: CandidateStore = None):
+        super().__init__()
+        self.save_path = save_path
+        self.source = source
+        self.tumor_peaks = tumor_peaks
+        self.water_peaks = water_peaks
+        self.baselines = baselines
+        self.candidates = candidates
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        try:
+            rows = export_peaks(
+                self.save_path,
+                self.source.frames,
+                self.source.sampling_rate,
+                self.tumor_peaks,
+                self.water_peaks,
+                self.baselines,
+                self.candidates,
+                progress=lambda fraction: self.progress.emit(int(fraction * 100), "Exporting peaks..."),
+                is_cancelled=lambda: self._cancelled
             )
+            self.finished.emit(self.save_path, rows)
+
+        except ExportCancelled:
+            self.cancelled.emit()
 
         except Exception as e:
             self.error.emit(str(e))